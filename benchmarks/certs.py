@@ -0,0 +1,130 @@
+"""
+Synthetic host keys and certificates for the benchmarks. The certificates follow the
+layout of PROTOCOL.certkeys, but the key material and signatures are random bytes of
+the right size, since vault-ssh-renew never verifies them.
+"""
+
+import base64
+import os
+import struct
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Tuple
+
+
+def _string(data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + data
+
+
+def _mpint(size: int) -> bytes:
+    # A leading zero byte keeps the random value positive, like OpenSSH does
+    return _string(b"\0" + b"\xff" + os.urandom(size - 1))
+
+
+class KeyType(NamedTuple):
+    name: str
+    # The type specific public key fields, encoded as wire strings
+    key_fields: Tuple[bytes, ...]
+    signature_size: int
+
+
+def key_types() -> Dict[str, KeyType]:
+    return {
+        "rsa-2048": KeyType("ssh-rsa", (_string(b"\x01\x00\x01"), _mpint(256)), 256),
+        "rsa-4096": KeyType("ssh-rsa", (_string(b"\x01\x00\x01"), _mpint(512)), 512),
+        "dsa": KeyType(
+            "ssh-dss", (_mpint(128), _mpint(20), _mpint(128), _mpint(128)), 40
+        ),
+        "ecdsa-p256": KeyType(
+            "ecdsa-sha2-nistp256",
+            (_string(b"nistp256"), _string(b"\x04" + os.urandom(64))),
+            72,
+        ),
+        "ecdsa-p521": KeyType(
+            "ecdsa-sha2-nistp521",
+            (_string(b"nistp521"), _string(b"\x04" + os.urandom(132))),
+            139,
+        ),
+        "ed25519": KeyType("ssh-ed25519", (_string(os.urandom(32)),), 64),
+    }
+
+
+def build_certificate(
+    key_type: KeyType,
+    principals: Iterable[str],
+    valid_after: datetime,
+    valid_before: datetime,
+) -> Tuple[str, str]:
+    """
+    :return: The public key and certificate, in the format of the .pub files
+    """
+    cert_type = "%s-cert-v01@openssh.com" % key_type.name
+    signature_key = _string(b"ssh-ed25519") + _string(os.urandom(32))
+    body = b"".join(
+        [
+            _string(cert_type.encode("ascii")),
+            _string(os.urandom(32)),  # nonce
+            *key_type.key_fields,
+            struct.pack(">QI", 1, 2),  # serial, host certificate
+            _string(b"vault-benchmark"),
+            _string(b"".join(_string(p.encode("utf-8")) for p in principals)),
+            struct.pack(
+                ">QQ", int(valid_after.timestamp()), int(valid_before.timestamp())
+            ),
+            _string(b""),  # critical options
+            _string(b""),  # extensions
+            _string(b""),  # reserved
+            _string(signature_key),
+            _string(_string(b"ssh-ed25519") + _string(os.urandom(64))),
+        ]
+    )
+    key = _string(key_type.name.encode("ascii")) + b"".join(key_type.key_fields)
+    return (
+        "%s %s benchmark\n" % (key_type.name, base64.b64encode(key).decode("ascii")),
+        "%s %s" % (cert_type, base64.b64encode(body).decode("ascii")),
+    )
+
+
+class CertificateCase(NamedTuple):
+    key_path: Path
+    cert_path: Path
+
+
+def write_cases(
+    directory: Path,
+    valid_after: datetime,
+    valid_before: datetime,
+    large_principals: int = 1000,
+) -> Dict[str, CertificateCase]:
+    """
+    Write a key and certificate for every key type, plus RSA-4096 and Ed25519
+    certificates with a large number of principals
+    :return: The files written, by benchmark name
+    """
+    cases = {}
+    types = key_types()
+    variants = [(name, key_type, 1) for name, key_type in types.items()]
+    variants += [
+        ("%s-%d-principals" % (name, large_principals), types[name], large_principals)
+        for name in ("rsa-4096", "ed25519")
+    ]
+    for name, key_type, count in variants:
+        principals = ["host%04d.example.com" % i for i in range(count)]
+        public_key, certificate = build_certificate(
+            key_type, principals, valid_after, valid_before
+        )
+        key_path = directory / ("%s.pub" % name)
+        cert_path = directory / ("%s-cert.pub" % name)
+        key_path.write_text(public_key, encoding="utf-8")
+        cert_path.write_text(certificate, encoding="utf-8")
+        cases[name] = CertificateCase(key_path, cert_path)
+    return cases
+
+
+__all__ = [
+    "CertificateCase",
+    "KeyType",
+    "build_certificate",
+    "key_types",
+    "write_cases",
+]
@@ -0,0 +1,223 @@
+"""
+Benchmarks for certificate parsing and the renewal workflow.
+
+    python -m benchmarks.run                       # print results
+    python -m benchmarks.run --save benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+Results are stored as JSON with the median time per operation, so that a change to
+the baseline shows up as a readable diff in review. Comparing against a baseline exits
+with status 1 if any benchmark got slower than the tolerance allows.
+"""
+
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import click
+
+from benchmarks.certs import (
+    CertificateCase,
+    build_certificate,
+    key_types,
+    write_cases,
+)
+from vault_ssh_renew.cert import HostCertificate
+from vault_ssh_renew.cli import run_renew_workflow
+from vault_ssh_renew.config import Config
+from vault_ssh_renew.metrics import METRICS
+from tests.conftest import FakeVault
+
+THRESHOLD = timedelta(days=7)
+
+
+def measure(func: Callable[[], None], repeat: int, number: int) -> Dict[str, float]:
+    """
+    Call `func` `number` times in each of `repeat` rounds
+    :return: The median and minimum time per call, in seconds
+    """
+    func()  # warm up caches and lazy imports
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    return {"median": statistics.median(rounds), "min": min(rounds)}
+
+
+def bench_parsing(directory: Path, quick: bool) -> Dict[str, Dict[str, float]]:
+    now = datetime.now(timezone.utc)
+    cases = write_cases(directory, now - timedelta(days=1), now + timedelta(days=30))
+    results = {}
+    for name, case in cases.items():
+
+        def _parse():
+            HostCertificate.get(
+                case.key_path, case.cert_path
+            ).read().check_renewal_required(THRESHOLD)
+
+        results["parse/%s" % name] = measure(_parse, 3 if quick else 7, 200)
+    return results
+
+
+def bench_import(quick: bool) -> Dict[str, Dict[str, float]]:
+    def _start(code: str) -> Callable[[], None]:
+        return lambda: subprocess.run([sys.executable, "-c", code], check=True)
+
+    repeat = 3 if quick else 10
+    return {
+        "startup/interpreter": measure(_start("pass"), repeat, 1),
+        "startup/import-cli": measure(_start("import vault_ssh_renew.cli"), repeat, 1),
+    }
+
+
+def bench_workflow(directory: Path, quick: bool) -> Dict[str, Dict[str, float]]:
+    now = datetime.now(timezone.utc)
+    key_type = key_types()["ed25519"]
+    principals = ["host.example.com"]
+    public_key, expired = build_certificate(
+        key_type, principals, now - timedelta(days=30), now + timedelta(days=1)
+    )
+    _, fresh = build_certificate(key_type, principals, now, now + timedelta(days=30))
+    case = CertificateCase(directory / "host.pub", directory / "host-cert.pub")
+    case.key_path.write_text(public_key, encoding="utf-8")
+
+    def _config(addr: str) -> Config:
+        return Config(
+            case.key_path,
+            case.cert_path,
+            urlparse(addr),
+            "benchmark-token",
+            "ssh/sign/host",
+            principals,
+            THRESHOLD.days,
+            None,
+            None,
+            False,
+            # Every round signs a new certificate
+            sign_min_interval=0,
+        )
+
+    results = {}
+    # Answers every request with the same freshly issued certificate
+    vault = FakeVault()
+    vault.handle = lambda request: (200, {"data": {"signed_key": fresh}})
+    try:
+        config = _config(vault.addr.geturl())
+
+        def _renewal():
+            case.cert_path.write_text(expired, encoding="utf-8")
+            run_renew_workflow(config)
+
+        def _no_renewal():
+            run_renew_workflow(config)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            repeat = 3 if quick else 7
+            results["workflow/renewal"] = measure(_renewal, repeat, 20)
+            case.cert_path.write_text(fresh, encoding="utf-8")
+            results["workflow/no-renewal"] = measure(_no_renewal, repeat, 100)
+    finally:
+        vault.close()
+    METRICS.reset()
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> List[str]:
+    """
+    :return: The names of the benchmarks whose median regressed beyond the tolerance
+    """
+    regressions = []
+    for name in sorted(results):
+        current = results[name]["median"]
+        previous = baseline.get(name, {}).get("median")
+        if previous is None:
+            click.echo("%-40s %10.1fµs  (new)" % (name, current * 1e6))
+            continue
+        change = current / previous - 1
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        click.echo(
+            click.style(
+                "%-40s %10.1fµs  %+6.1f%%" % (name, current * 1e6, change * 100),
+                fg="red" if regressed else None,
+            )
+        )
+    return regressions
+
+
+@click.command()
+@click.option("--save", type=click.Path(dir_okay=False), help="Write results here.")
+@click.option(
+    "--compare",
+    "baseline_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Compare the results to a previously saved baseline.",
+)
+@click.option(
+    "--tolerance",
+    type=float,
+    default=0.25,
+    show_default=True,
+    help="The relative slowdown accepted when comparing to a baseline.",
+)
+@click.option("--quick", is_flag=True, help="Run fewer rounds.")
+def main(
+    save: Optional[str], baseline_path: Optional[str], tolerance: float, quick: bool
+):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        parse_dir = Path(tmp) / "parse"
+        workflow_dir = Path(tmp) / "workflow"
+        parse_dir.mkdir()
+        workflow_dir.mkdir()
+        results.update(bench_parsing(parse_dir, quick))
+        results.update(bench_workflow(workflow_dir, quick))
+    results.update(bench_import(quick))
+    results = {
+        name: {key: round(value, 7) for key, value in values.items()}
+        for name, values in results.items()
+    }
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, tolerance)
+    if regressions:
+        click.echo(
+            click.style("Regressed: %s" % ", ".join(regressions), fg="red"), err=True
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
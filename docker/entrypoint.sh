@@ -1,4 +1,3 @@
 #!/bin/sh -eu
 
-/venv/bin/vault-ssh-renew
-/usr/sbin/crond -f
\ No newline at end of file
+exec /venv/bin/vault-ssh-renew --daemon
@@ -1,10 +1,16 @@
+import json
 import os
+import socketserver
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Tuple
 from urllib.parse import urlparse, urlunparse
 
 import pytest
 
-
 TEST_FILES = pytest.mark.datafiles(
     os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
 )
@@ -24,14 +30,51 @@ def certificate(datafiles, request) -> Path:
 def mock_config(datafiles):
     class MockConfig:
         addr = urlparse("http://127.0.0.1:8200/")
+        addrs = [addr]
         token = "mytoken"
         renewal_threshold_days = 7
+        renewal_spread_days = 0
         ssh_sign_path = "ssh/sign/host"
         ssh_principals = [
-            "nowhere.example.com",
+            "erichto.halbordnung.de",
         ]
         ssh_host_key_path = datafiles / "rsa.pub"
         ssh_host_cert_path = datafiles / "rsa-cert.pub"
+        host_key_pairs = ()
+        all_host_keys = False
+        concurrency = 4
+        cache_dir = None
+        vault_pool_size = 4
+        vault_keep_alive = True
+        vault_connect_timeout = 5.0
+        vault_read_timeout = 30.0
+        vault_deadline = 120.0
+        vault_max_retries = 3
+        vault_breaker_threshold = 5
+        daemon = False
+        retry_interval = 900
+        metrics_textfile = None
+        metrics_listen = None
+        hook_timeout = 60.0
+        watch = False
+        renewal_fraction = None
+        renewal_floor_hours = 1.0
+        check_principals = True
+        lock_timeout = 300.0
+        auth_method = "token"
+        auth_mount = None
+        approle_role_id = None
+        approle_secret_id_file = None
+        kubernetes_role = None
+        kubernetes_jwt_path = None
+        token_cache = None
+        use_agent_token = False
+        principal_sources = ("fqdn",)
+        principal_metadata_path = "/nonexistent/instance-data.json"
+        principal_timeout = 5.0
+        principal_cache_ttl = 3600.0
+        sign_min_interval = 60.0
+        sign_backoff_cap = 3600.0
         on_renew_hook = "touch " + os.path.join(str(datafiles), "renewed")
         on_failure_hook = "touch " + os.path.join(str(datafiles), "failed")
         debug = False
@@ -65,3 +108,99 @@ def no_permission_renewal_mock(requests_mock, mock_config):
         json={"errors": ["Not permitted"]},
     )
     return requests_mock
+
+
+class _TCPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeRequest(NamedTuple):
+    path: str
+    headers: Dict[str, str]
+    payload: Any
+
+    @property
+    def token(self) -> Optional[str]:
+        return self.headers.get("X-Vault-Token")
+
+
+class FakeVault:
+    """
+    A Vault server on a local port or Unix domain socket, speaking HTTP/1.1 with
+    keep-alive. By default, it signs every request, answering with the statuses in
+    `statuses` first and waiting `delay` seconds before each response. Tests replace
+    `handle` for other endpoints. The requests and the number of connections are
+    recorded.
+    """
+
+    def __init__(self, unix: bool = False):
+        self.statuses = []
+        self.delay = 0.0
+        self.requests = []
+        self.connections = 0
+        vault = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                vault.connections += 1
+
+            def do_POST(self):
+                payload = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+                request = FakeRequest(self.path, dict(self.headers), payload)
+                vault.requests.append(request)
+                time.sleep(vault.delay)
+                status, body = vault.handle(request)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        if unix:
+            # Socket paths are limited in length, so keep it short
+            self._directory = tempfile.mkdtemp()
+            self._socket_path = os.path.join(self._directory, "vault.sock")
+            self._server = _UnixServer(self._socket_path, _Handler)
+            self.addr = urlparse("unix://" + self._socket_path)
+        else:
+            self._directory = None
+            self._server = _TCPServer(("127.0.0.1", 0), _Handler)
+            self.addr = urlparse("http://127.0.0.1:%d" % self._server.server_address[1])
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def handle(self, request: FakeRequest) -> Tuple[int, Any]:
+        status = self.statuses.pop(0) if self.statuses else 200
+        return (
+            status,
+            {"data": {"signed_key": "signed " + request.payload["public_key"]}},
+        )
+
+    def paths(self):
+        return [request.path for request in self.requests]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._directory is not None:
+            os.unlink(self._socket_path)
+            os.rmdir(self._directory)
+
+
+@pytest.fixture
+def fake_vault():
+    vault = FakeVault()
+    yield vault
+    vault.close()
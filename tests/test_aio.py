@@ -0,0 +1,188 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from vault_ssh_renew.aio import (
+    AsyncVaultConnection,
+    AsyncVaultRenewer,
+    check_renewal_required,
+)
+from vault_ssh_renew.errors import RenewError, TokenRejected, VaultResponseError
+from vault_ssh_renew.retry import RetryPolicy
+from .conftest import TEST_FILES
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _renewer(vault, tmp_path, key, connection):
+    return AsyncVaultRenewer.build(
+        vault.addr,
+        "mytoken",
+        "ssh/sign/host",
+        key,
+        ["a.example.com"],
+        tmp_path / ("%s-cert.pub" % key),
+        connection,
+    )
+
+
+def test_renews_concurrently_over_shared_pool(tmp_path, fake_vault):
+    vault = fake_vault
+    vault.delay = 0.05
+
+    async def _main():
+        async with AsyncVaultConnection(pool_size=2) as connection:
+
+            async def _renew(key):
+                renewer = await _renewer(vault, tmp_path, key, connection).renew()
+                return await renewer.write_certificate()
+
+            return await asyncio.gather(*[_renew("key%d" % i) for i in range(8)])
+
+    assert _run(_main()) == [True] * 8
+    assert len(vault.requests) == 8
+    assert vault.connections <= 2
+    assert (tmp_path / "key3-cert.pub").read_text() == "signed key3"
+
+
+def test_retries_temporary_errors(tmp_path, fake_vault):
+    fake_vault.statuses = [503, 503]
+    connection = AsyncVaultConnection(policy=RetryPolicy(backoff_base=0.01))
+    _run(_renewer(fake_vault, tmp_path, "key", connection).renew())
+    assert len(fake_vault.requests) == 3
+
+
+@pytest.mark.parametrize(
+    "status, error", [(403, TokenRejected), (400, VaultResponseError)]
+)
+def test_raises_on_error(tmp_path, fake_vault, status, error):
+    fake_vault.statuses = [status]
+    with pytest.raises(error) as e:
+        _run(_renewer(fake_vault, tmp_path, "key", None).renew())
+    assert e.value.status_code == status
+
+
+def test_creates_ssl_context_once(mocker):
+    create = mocker.patch("ssl.create_default_context")
+    streams = (mocker.Mock(), mocker.Mock())
+
+    async def _open_connection(host, port, ssl=None):
+        return streams
+
+    open_connection = mocker.patch(
+        "asyncio.open_connection", side_effect=_open_connection
+    )
+
+    async def _main():
+        connection = AsyncVaultConnection()
+        assert await connection._connect(("http", "vault", 80)) == streams
+        assert not create.called
+        await connection._connect(("https", "vault", 443))
+        await connection._connect(("https", "vault2", 443))
+
+    _run(_main())
+    create.assert_called_once_with()
+    assert open_connection.call_args[1]["ssl"] is create.return_value
+
+
+def test_cancellation_discards_connection(tmp_path, fake_vault):
+    vault = fake_vault
+    vault.delay = 0.5
+
+    async def _main():
+        async with AsyncVaultConnection(pool_size=1) as connection:
+            task = asyncio.ensure_future(
+                _renewer(vault, tmp_path, "slow", connection).renew()
+            )
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            vault.delay = 0
+            await _renewer(vault, tmp_path, "fast", connection).renew()
+
+    _run(_main())
+    assert vault.connections == 2
+
+
+def test_rejects_line_breaks_in_headers(fake_vault):
+    async def _main():
+        async with AsyncVaultConnection() as connection:
+            await connection.post(
+                fake_vault.addr.geturl() + "/v1/ssh/sign/host",
+                {"public_key": "key"},
+                {"X-Vault-Token": "mytoken\r\nX-Injected: 1"},
+            )
+
+    with pytest.raises(RenewError):
+        _run(_main())
+    assert not fake_vault.requests
+
+
+def test_closes_connection_without_content_length():
+    connections = []
+
+    async def _serve(reader, writer):
+        connections.append(writer)
+        await reader.readuntil(b"\r\n\r\n")
+        # Without Content-Length, the body ends with the connection
+        writer.write(b'HTTP/1.1 200 OK\r\n\r\n{"data": {}}')
+        await writer.drain()
+        writer.close()
+
+    async def _main():
+        server = await asyncio.start_server(_serve, "127.0.0.1", 0)
+        url = (
+            "http://127.0.0.1:%d/v1/ssh/sign/host" % server.sockets[0].getsockname()[1]
+        )
+        try:
+            async with AsyncVaultConnection() as connection:
+                for _ in range(2):
+                    response = await connection.post(url, {}, {})
+                    assert response.json() == {"data": {}}
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    _run(_main())
+    assert len(connections) == 2
+
+
+def test_waiting_for_connection_counts_against_deadline(tmp_path, fake_vault):
+    fake_vault.delay = 0.4
+    connection = AsyncVaultConnection(
+        policy=RetryPolicy(deadline=0.6, max_retries=0), pool_size=1
+    )
+
+    async def _main():
+        async with connection:
+            return await asyncio.gather(
+                *[
+                    _renewer(fake_vault, tmp_path, key, connection).renew()
+                    for key in ("first", "second")
+                ],
+                return_exceptions=True,
+            )
+
+    first, second = _run(_main())
+    # The second request waited for the first one and then ran out of time
+    assert isinstance(first, AsyncVaultRenewer)
+    assert isinstance(second, RenewError)
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
+def test_checks_certificate(datafiles):
+    status = _run(
+        check_renewal_required(
+            datafiles / "rsa.pub", datafiles / "rsa-cert.pub", timedelta(days=1)
+        )
+    )
+    assert status.needs_renewal is False
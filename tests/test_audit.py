@@ -0,0 +1,72 @@
+import csv
+import io
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from click.testing import CliRunner
+
+from vault_ssh_renew.audit import CSVWriter, audit, find_certificates
+from vault_ssh_renew.cli import audit as audit_command
+from vault_ssh_renew.policy import RenewalPolicy
+from .conftest import TEST_FILES
+
+
+@TEST_FILES
+def test_finds_certificates_recursively(datafiles):
+    (datafiles / "a" / "b").ensure(dir=True)
+    shutil.copy(str(datafiles / "rsa-cert.pub"), str(datafiles / "a" / "b"))
+    found = sorted(find_certificates(str(datafiles)))
+    assert str(datafiles / "a" / "b" / "rsa-cert.pub") in found
+    assert str(datafiles / "rsa.pub") not in found
+    assert len(found) == 6
+
+
+@TEST_FILES
+def test_audits_certificates(datafiles):
+    paths = [str(datafiles / name) for name in ["rsa-cert.pub", "bad-cert.pub"]]
+    with ThreadPoolExecutor(2) as executor:
+        rows = list(
+            audit(
+                paths,
+                RenewalPolicy(timedelta(days=7)),
+                executor=executor,
+                now=datetime(2020, 8, 1, tzinfo=timezone.utc),
+            )
+        )
+    assert rows[0] == {
+        "path": paths[0],
+        "type": "ssh-rsa-cert-v01@openssh.com",
+        "serial": 15589578443163736678,
+        "key_id": "vault-root-84674ade1f101c979fd9e0f0b6f0eda8b5b43e52f4f16208651eccfd53b7b62f",
+        "principals": ["erichto.halbordnung.de"],
+        "valid_after": "2020-07-22T20:12:07+00:00",
+        "valid_before": "2020-08-23T20:12:37+00:00",
+        "needs_renewal": False,
+    }
+    assert rows[1] == {
+        "path": paths[1],
+        "error": "Certificate type mismatch in certificate",
+    }
+
+
+def test_writes_csv():
+    output = io.StringIO()
+    writer = CSVWriter(output)
+    writer.write({"path": "a-cert.pub", "principals": ["a", "b"], "serial": 1})
+    writer.write({"path": "b-cert.pub", "error": "broken"})
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert rows[0]["principals"] == "a,b"
+    assert rows[0]["serial"] == "1"
+    assert rows[1]["error"] == "broken"
+
+
+@TEST_FILES
+def test_audit_command_uses_process_pool(datafiles):
+    (datafiles / "bad-cert.pub").remove()
+    result = CliRunner().invoke(audit_command, [str(datafiles), "--jobs", "2"])
+    assert result.exit_code == 0
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert len(rows) == 4
+    assert all(row["needs_renewal"] for row in rows if row["key_id"] != "forever")
@@ -0,0 +1,206 @@
+import os
+import stat
+import time
+
+import pytest
+
+from vault_ssh_renew.auth import (
+    AppRoleLogin,
+    CachedToken,
+    KubernetesLogin,
+    StaticToken,
+    TokenCache,
+    VaultLogin,
+)
+from vault_ssh_renew.cli import run_renew_workflow
+from vault_ssh_renew.errors import RenewError, TokenRejected
+from vault_ssh_renew.vault import VaultConnection
+from .conftest import TEST_FILES, FakeVault
+
+
+class LoginVault(FakeVault):
+    """
+    Implements the AppRole and Kubernetes logins and renew-self, and only signs for
+    the tokens it issued
+    """
+
+    def __init__(self, ttl=3600, renewable=True):
+        super().__init__()
+        self.ttl = ttl
+        self.renewable = renewable
+        self.tokens = set()
+
+    def handle(self, request):
+        path, payload = request.path, request.payload
+        if path in ("/v1/auth/approle/login", "/v1/auth/kubernetes/login"):
+            if (
+                payload.get("secret_id", "secret") != "secret"
+                or payload.get("jwt", "jwt") != "jwt"
+            ):
+                return 400, {"errors": ["invalid credentials"]}
+            token = "token-%d" % len(self.requests)
+            self.tokens.add(token)
+            return 200, {"auth": self._auth(token)}
+        if request.token not in self.tokens:
+            return 403, {"errors": ["permission denied"]}
+        if path == "/v1/auth/token/renew-self":
+            return 200, {"auth": self._auth(request.token)}
+        return super().handle(request)
+
+    def _auth(self, token):
+        return {
+            "client_token": token,
+            "lease_duration": self.ttl,
+            "renewable": self.renewable,
+        }
+
+
+@pytest.fixture
+def vault():
+    vault = LoginVault()
+    yield vault
+    vault.close()
+
+
+@pytest.fixture
+def secret_id_file(tmp_path):
+    path = tmp_path / "secret-id"
+    path.write_text("secret\n")
+    return path
+
+
+def _login(vault, secret_id_file, cache=None):
+    return VaultLogin(vault.addr.geturl(), AppRoleLogin("role", secret_id_file), cache)
+
+
+def test_logs_in_once(vault, secret_id_file):
+    login = _login(vault, secret_id_file)
+    with VaultConnection() as connection:
+        first = login.get(connection)
+        assert login.get(connection) == first
+    assert vault.paths() == ["/v1/auth/approle/login"]
+    assert vault.requests[0].payload == {"role_id": "role", "secret_id": "secret"}
+
+
+def test_reuses_cached_token_across_runs(vault, secret_id_file, tmp_path):
+    cache = TokenCache(tmp_path / "cache" / "vault-token.json")
+    token = _login(vault, secret_id_file, cache).get(None)
+    assert (
+        stat.S_IMODE(os.stat(str(tmp_path / "cache" / "vault-token.json")).st_mode)
+        == 0o600
+    )
+    assert _login(vault, secret_id_file, cache).get(None) == token
+    assert vault.paths() == ["/v1/auth/approle/login"]
+
+
+def test_cached_token_of_other_login_is_ignored(vault, secret_id_file, tmp_path):
+    cache = TokenCache(tmp_path / "vault-token.json")
+    cache.store("other", CachedToken("foreign", 3600, True, time.time()))
+    assert _login(vault, secret_id_file, cache).get(None) != "foreign"
+    assert vault.paths() == ["/v1/auth/approle/login"]
+
+
+def test_readable_token_cache_is_ignored(vault, secret_id_file, tmp_path):
+    path = tmp_path / "vault-token.json"
+    cache = TokenCache(path)
+    _login(vault, secret_id_file, cache).get(None)
+    os.chmod(str(path), 0o644)
+    _login(vault, secret_id_file, cache).get(None)
+    assert vault.paths() == ["/v1/auth/approle/login"] * 2
+
+
+def test_renews_token_before_expiry(vault, secret_id_file, tmp_path):
+    cache = TokenCache(tmp_path / "vault-token.json")
+    login = _login(vault, secret_id_file, cache)
+    token = login.get(None)
+    key = login._key
+    cache.store(key, CachedToken(token, 3600, True, time.time() - 3000))
+    assert _login(vault, secret_id_file, cache).get(None) == token
+    assert vault.paths() == ["/v1/auth/approle/login", "/v1/auth/token/renew-self"]
+    assert cache.load(key).issued_at > time.time() - 60
+
+
+def test_logs_in_again_when_token_expired(vault, secret_id_file, tmp_path):
+    cache = TokenCache(tmp_path / "vault-token.json")
+    login = _login(vault, secret_id_file, cache)
+    token = login.get(None)
+    cache.store(login._key, CachedToken(token, 3600, True, time.time() - 3590))
+    assert _login(vault, secret_id_file, cache).get(None) != token
+    assert vault.paths() == ["/v1/auth/approle/login"] * 2
+
+
+def test_logs_in_again_when_renewal_fails(vault, secret_id_file, tmp_path):
+    cache = TokenCache(tmp_path / "vault-token.json")
+    login = _login(vault, secret_id_file, cache)
+    token = login.get(None)
+    cache.store(login._key, CachedToken(token, 3600, True, time.time() - 3000))
+    vault.tokens.clear()
+    assert _login(vault, secret_id_file, cache).get(None) != token
+    assert vault.paths() == [
+        "/v1/auth/approle/login",
+        "/v1/auth/token/renew-self",
+        "/v1/auth/approle/login",
+    ]
+
+
+def test_retries_with_new_token_when_rejected(vault, secret_id_file):
+    login = _login(vault, secret_id_file)
+    tokens = []
+
+    def _request(token):
+        tokens.append(token)
+        if len(tokens) == 1:
+            raise TokenRejected("permission denied")
+        return token
+
+    assert login.call(None, _request) == tokens[1]
+    assert tokens[0] != tokens[1]
+
+
+def test_static_token_is_not_retried():
+    def _request(token):
+        raise TokenRejected("permission denied")
+
+    with pytest.raises(TokenRejected):
+        StaticToken("mytoken").call(None, _request)
+
+
+def test_failed_login(vault, tmp_path):
+    path = tmp_path / "secret-id"
+    path.write_text("wrong")
+    with pytest.raises(RenewError):
+        _login(vault, path).get(None)
+
+
+def test_kubernetes_login(vault, tmp_path):
+    jwt_path = tmp_path / "token"
+    jwt_path.write_text("jwt")
+    login = VaultLogin(
+        vault.addr.geturl(), KubernetesLogin("ssh-host", jwt_path, "k8s-cluster")
+    )
+    vault.handle = lambda request: (
+        200,
+        {"auth": {"client_token": "k8s", "lease_duration": 0}},
+    )
+    assert login.get(None) == "k8s"
+    assert vault.paths() == ["/v1/auth/k8s-cluster/login"]
+    assert vault.requests[0].payload == {"role": "ssh-host", "jwt": "jwt"}
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_renews_with_approle(datafiles, mock_config, vault, secret_id_file):
+    mock_config.addr = vault.addr
+    mock_config.addrs = [vault.addr]
+    mock_config.token = None
+    mock_config.auth_method = "approle"
+    mock_config.approle_role_id = "role"
+    mock_config.approle_secret_id_file = secret_id_file
+    mock_config.cache_dir = datafiles / "cache"
+    mock_config.vault_max_retries = 0
+    run_renew_workflow(mock_config)
+    assert mock_config.ssh_host_cert_path.read_text(encoding="utf-8").startswith(
+        "signed "
+    )
+    assert vault.paths() == ["/v1/auth/approle/login", "/v1/ssh/sign/host"]
+    assert (datafiles / "cache" / "vault-token.json").exists()
@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from benchmarks.certs import write_cases
+from vault_ssh_renew.cert import HostCertificate
+
+
+def test_synthetic_certificates_parse(tmpdir):
+    now = datetime(2020, 8, 1, tzinfo=timezone.utc)
+    cases = write_cases(Path(str(tmpdir)), now, now + timedelta(days=30), 10)
+    assert "rsa-4096-10-principals" in cases
+    for case in cases.values():
+        status = (
+            HostCertificate.get(case.key_path, case.cert_path)
+            .read()
+            .check_renewal_required(timedelta(days=7))
+        )
+        assert status.not_before == now
+        assert status.not_after == now + timedelta(days=30)
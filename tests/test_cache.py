@@ -0,0 +1,71 @@
+import os
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+from vault_ssh_renew.cache import StatusCache
+from vault_ssh_renew.cert import HostCertificate, CachedHostCertificateValidate
+from vault_ssh_renew.util import write_json_atomic
+from .conftest import TEST_FILES
+
+
+def _check(datafiles: Path, cache: StatusCache):
+    validate = HostCertificate.get(
+        datafiles / "rsa.pub", datafiles / "rsa-cert.pub", cache
+    ).read()
+    return validate, validate.check_renewal_required(timedelta(days=1))
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
+def test_answers_from_cache_for_unchanged_files(datafiles: Path, mocker):
+    cache = StatusCache(datafiles / "cache")
+    first, first_status = _check(datafiles, cache)
+    assert not isinstance(first, CachedHostCertificateValidate)
+    read_text = mocker.spy(Path, "read_text")
+    second, second_status = _check(datafiles, cache)
+    assert isinstance(second, CachedHostCertificateValidate)
+    assert not read_text.called
+    assert second_status.needs_renewal is False
+    assert second_status.not_after == first_status.not_after
+    assert second_status.info.principals == first_status.info.principals
+    assert second_status.info.serial == first_status.info.serial
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
+def test_invalidates_when_certificate_is_replaced(datafiles: Path):
+    cache = StatusCache(datafiles / "cache")
+    _check(datafiles, cache)
+    replacement = datafiles / "replacement"
+    replacement.write_binary((datafiles / "rsa-cert.pub").read_binary())
+    os.replace(str(replacement), str(datafiles / "rsa-cert.pub"))
+    validate, _ = _check(datafiles, cache)
+    assert not isinstance(validate, CachedHostCertificateValidate)
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
+def test_invalidates_when_key_is_rotated(datafiles: Path):
+    cache = StatusCache(datafiles / "cache")
+    _check(datafiles, cache)
+    key = datafiles / "rsa.pub"
+    key.write_text(key.read_text(encoding="utf-8") + " ", encoding="utf-8")
+    validate, _ = _check(datafiles, cache)
+    assert not isinstance(validate, CachedHostCertificateValidate)
+
+
+def test_writes_json_atomically(tmp_path):
+    path = tmp_path / "cache" / "state.json"
+    write_json_atomic(path, {"a": 1})
+    assert path.read_text() == '{"a": 1}'
+    assert path.stat().st_mode & 0o777 == 0o600
+    with pytest.raises(TypeError):
+        write_json_atomic(path, {"a": object()})
+    (path.parent / "directory").mkdir()
+    with pytest.raises(OSError):
+        write_json_atomic(path.parent / "directory", {"a": 1})
+    # Neither failure leaves a temporary file behind
+    assert sorted(os.listdir(str(path.parent))) == ["directory", "state.json"]
+    assert path.read_text() == '{"a": 1}'
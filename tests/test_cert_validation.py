@@ -5,6 +5,7 @@ import pytest
 
 from vault_ssh_renew.cert import HostCertificate
 from vault_ssh_renew.errors import RenewError
+from vault_ssh_renew.policy import RenewalPolicy
 from .conftest import TEST_FILES
 
 
@@ -95,3 +96,73 @@ def test_rejects_cert_with_mismatching_data_between_header_and_payload(datafiles
         HostCertificate.get(
             datafiles / "rsa.pub", datafiles / "bad-cert.pub"
         ).read().check_renewal_required(timedelta(days=1))
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_requires_no_renewal_for_certs_valid_forever(datafiles: Path):
+    status = (
+        HostCertificate.get(
+            datafiles / "ed25519.pub", datafiles / "ed25519-forever-cert.pub"
+        )
+        .read()
+        .check_renewal_required(timedelta(days=1))
+    )
+    assert status.needs_renewal is False
+
+
+@TEST_FILES
+def test_rejects_truncated_cert(datafiles: Path):
+    cert_type, cert_data = (
+        (datafiles / "rsa-cert.pub").read_text(encoding="utf-8").split(" ")
+    )
+    truncated = datafiles / "truncated-cert.pub"
+    truncated.write_text(cert_type + " " + cert_data[:200], encoding="utf-8")
+    with pytest.raises(RenewError):
+        HostCertificate.get(
+            datafiles / "rsa.pub", truncated
+        ).read().check_renewal_required(timedelta(days=1))
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
+def test_requires_renewal_for_cert_of_other_key(datafiles: Path):
+    status = (
+        HostCertificate.get(
+            datafiles / "ed25519-other.pub", datafiles / "ed25519-cert.pub"
+        )
+        .read()
+        .check_renewal_required(timedelta(days=1))
+    )
+    assert status.key_mismatch is True
+    assert status.needs_renewal is True
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
+def test_accepts_certificate_with_comment(datafiles: Path):
+    certificate = datafiles / "ed25519-cert.pub"
+    certificate.write_text(
+        certificate.read_text(encoding="utf-8").strip() + " root@host\n",
+        encoding="utf-8",
+    )
+    status = (
+        HostCertificate.get(datafiles / "ed25519.pub", certificate)
+        .read()
+        .check_renewal_required(timedelta(days=1))
+    )
+    assert status.needs_renewal is False
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
+def test_requires_renewal_for_other_principals(datafiles: Path):
+    validate = HostCertificate.get(
+        datafiles / "rsa.pub", datafiles / "rsa-cert.pub"
+    ).read()
+    status = validate.check_renewal_required(
+        RenewalPolicy(timedelta(days=1), principals=["other.example.com"])
+    )
+    assert status.needs_renewal is True
+    assert status.principals_mismatch is True
+    assert status.info.principals == ("erichto.halbordnung.de",)
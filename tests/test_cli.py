@@ -1,3 +1,5 @@
+from urllib.parse import urlunparse
+
 import pytest
 
 from vault_ssh_renew.cli import run_renew_workflow
@@ -13,6 +15,21 @@ def test_renews(datafiles, mock_config):
     assert (datafiles / "renewed").exists()
 
 
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_does_not_reload_for_identical_certificate(
+    datafiles, mock_config, requests_mock
+):
+    signed_key = mock_config.ssh_host_cert_path.read_text(encoding="utf-8")
+    requests_mock.post(
+        urlunparse(mock_config.addr) + "/v1/" + mock_config.ssh_sign_path,
+        json={"data": {"signed_key": signed_key}},
+    )
+    run_renew_workflow(mock_config)
+    assert requests_mock.called
+    assert not (datafiles / "renewed").exists()
+
+
 @TEST_FILES
 @pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
 def test_does_not_renew_if_recent(datafiles, mock_config, success_renewal_mock):
@@ -40,3 +57,58 @@ def test_calls_error_hook_on_vault_error(datafiles, mock_config, mocker):
     run_renew_workflow(mock_config)
     assert (datafiles / "failed").exists()
     exit_spy.assert_called_once_with(1)
+
+
+@TEST_FILES
+@pytest.mark.usefixtures("success_renewal_mock")
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_renews_all_host_keys(datafiles, mock_config):
+    for key_type in ["rsa", "ecdsa", "ed25519"]:
+        (datafiles / (key_type + ".pub")).rename(
+            datafiles / ("ssh_host_%s_key.pub" % key_type)
+        )
+    mock_config.all_host_keys = True
+    run_renew_workflow(mock_config)
+    for key_type in ["rsa", "ecdsa", "ed25519"]:
+        cert = datafiles / ("ssh_host_%s_key-cert.pub" % key_type)
+        assert cert.read_text(encoding="utf-8") == "foo"
+    assert (datafiles / "renewed").exists()
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_fails_batch_if_one_key_fails(datafiles, mock_config, mocker, requests_mock):
+    requests_mock.post(
+        urlunparse(mock_config.addr) + "/v1/" + mock_config.ssh_sign_path,
+        [{"json": {"data": {"signed_key": "foo"}}}, {"status_code": 403}],
+    )
+    mock_config.concurrency = 1
+    mock_config.host_key_pairs = [
+        (datafiles / "rsa.pub", datafiles / "rsa-cert.pub"),
+        (datafiles / "ecdsa.pub", datafiles / "ecdsa-cert.pub"),
+    ]
+    exit_spy = mocker.spy(mock_config, "exit")
+    run_renew_workflow(mock_config)
+    assert (datafiles / "rsa-cert.pub").read_text(encoding="utf-8") == "foo"
+    assert (datafiles / "failed").exists()
+    # sshd still needs to pick up the certificate that was renewed
+    assert (datafiles / "renewed").exists()
+    exit_spy.assert_called_once_with(1)
+
+
+@TEST_FILES
+@pytest.mark.usefixtures("success_renewal_mock")
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_continues_batch_with_missing_key(datafiles, mock_config, mocker):
+    (datafiles / "rsa.pub").remove()
+    mock_config.concurrency = 2
+    mock_config.host_key_pairs = [
+        (datafiles / "rsa.pub", datafiles / "rsa-cert.pub"),
+        (datafiles / "ed25519.pub", datafiles / "ed25519-cert.pub"),
+    ]
+    exit_spy = mocker.spy(mock_config, "exit")
+    run_renew_workflow(mock_config)
+    assert (datafiles / "ed25519-cert.pub").read_text(encoding="utf-8") == "foo"
+    assert (datafiles / "failed").exists()
+    assert (datafiles / "renewed").exists()
+    exit_spy.assert_called_once_with(1)
@@ -0,0 +1,64 @@
+import signal
+from datetime import datetime, timezone
+
+import pytest
+
+from vault_ssh_renew.batch import KeyPair
+from vault_ssh_renew.daemon import RenewalDaemon, MAX_SLEEP
+from vault_ssh_renew.ledger import RenewalLedger
+from .conftest import TEST_FILES
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-10T12:00:00+0000")
+def test_sleeps_until_renewal_threshold(mock_config):
+    daemon = RenewalDaemon(mock_config, lambda config, pairs, connection, hooks: True)
+    pair = KeyPair(mock_config.ssh_host_key_path, mock_config.ssh_host_cert_path)
+    assert daemon.next_deadline([pair]) == datetime(
+        2020, 8, 16, 20, 12, 37, tzinfo=timezone.utc
+    )
+    assert daemon.run_once() == MAX_SLEEP.total_seconds()
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-16T20:00:00+0000")
+def test_wakes_up_at_renewal_threshold(mock_config):
+    daemon = RenewalDaemon(mock_config, lambda config, pairs, connection, hooks: True)
+    assert daemon.run_once() == 12 * 60 + 37
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_retries_after_failure(mock_config):
+    daemon = RenewalDaemon(mock_config, lambda config, pairs, connection, hooks: False)
+    assert daemon.run_once() == mock_config.retry_interval
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_retries_without_certificate(datafiles, mock_config):
+    mock_config.ssh_host_cert_path = datafiles / "missing-cert.pub"
+    daemon = RenewalDaemon(mock_config, lambda config, pairs, connection, hooks: True)
+    assert daemon.run_once() == mock_config.retry_interval
+
+
+@TEST_FILES
+def test_stops_on_sigterm(mock_config, mocker):
+    daemon = RenewalDaemon(mock_config, lambda config, pairs, connection, hooks: True)
+    run_once = mocker.patch.object(
+        daemon, "run_once", side_effect=lambda: daemon._handle(signal.SIGTERM, None)
+    )
+    daemon.run()
+    run_once.assert_called_once_with()
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-10T12:00:00+0000")
+def test_retries_mismatched_certificate_after_minimum_interval(datafiles, mock_config):
+    mock_config.ssh_host_key_path = datafiles / "ecdsa.pub"
+    mock_config.sign_min_interval = 120
+    RenewalLedger.from_config(mock_config, mock_config.ssh_host_cert_path).record(
+        "unchanged", 200
+    )
+    daemon = RenewalDaemon(mock_config, lambda config, pairs, connection, hooks: True)
+    assert daemon.run_once() == 120
@@ -0,0 +1,69 @@
+import json
+from urllib.parse import urlparse
+
+import requests
+
+from vault_ssh_renew.endpoints import Endpoints
+from vault_ssh_renew.retry import RetryPolicy
+from vault_ssh_renew.vault import VaultConnection, create_session
+
+NODES = ["http://vault-a:8200", "http://vault-b:8200", "http://vault-c:8200"]
+SIGN = "/v1/ssh/sign/host"
+
+
+def _connection(endpoints: Endpoints) -> VaultConnection:
+    return VaultConnection(create_session(), RetryPolicy(), endpoints=endpoints)
+
+
+def _post(connection: VaultConnection) -> requests.Response:
+    return connection.post(NODES[0] + SIGN, {}, {})
+
+
+def _write_state(path, nodes, preferred):
+    path.write_text(json.dumps({"endpoints": nodes, "preferred": preferred}))
+
+
+def test_prefers_fastest_healthy_endpoint(requests_mock):
+    requests_mock.get(NODES[0] + "/v1/sys/health", status_code=503)
+    requests_mock.get(NODES[1] + "/v1/sys/health", exc=requests.ConnectionError)
+    requests_mock.get(NODES[2] + "/v1/sys/health", status_code=200)
+    sign = requests_mock.post(NODES[2] + SIGN, json={})
+    endpoints = Endpoints([urlparse(node) for node in NODES])
+    _post(_connection(endpoints))
+    _post(_connection(endpoints))
+    assert sign.call_count == 2
+    assert requests_mock.call_count == 5
+
+
+def test_fails_over_without_waiting(requests_mock, mocker, tmp_path):
+    sleep = mocker.patch("vault_ssh_renew.vault.time.sleep")
+    state = tmp_path / "state.json"
+    _write_state(state, NODES, NODES[0])
+    requests_mock.post(NODES[0] + SIGN, exc=requests.ConnectTimeout)
+    requests_mock.post(NODES[1] + SIGN, json={})
+    endpoints = Endpoints([urlparse(node) for node in NODES], state)
+    assert _post(_connection(endpoints)).status_code == 200
+    assert not sleep.called
+    assert [request.hostname for request in requests_mock.request_history] == [
+        "vault-a",
+        "vault-b",
+    ]
+    assert NODES[1] in state.read_text()
+
+
+def test_follows_and_remembers_active_node(requests_mock, tmp_path):
+    state = tmp_path / "state.json"
+    _write_state(state, NODES[:2], NODES[0])
+    requests_mock.post(
+        NODES[0] + SIGN, status_code=307, headers={"Location": NODES[1] + SIGN}
+    )
+    requests_mock.post(NODES[1] + SIGN, json={})
+    endpoints = Endpoints([urlparse(node) for node in NODES[:2]], state)
+    _post(_connection(endpoints))
+    _post(_connection(endpoints))
+    posts = [r.hostname for r in requests_mock.request_history if r.method == "POST"]
+    assert posts == ["vault-a", "vault-b", "vault-b"]
+    # The next run starts with the active node, without probing
+    requests_mock.reset_mock()
+    _post(_connection(Endpoints([urlparse(node) for node in NODES[:2]], state)))
+    assert [r.hostname for r in requests_mock.request_history] == ["vault-b"]
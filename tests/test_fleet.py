@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from vault_ssh_renew.batch import RenewOutcome
+from vault_ssh_renew.errors import RenewError
+from vault_ssh_renew.fleet import FleetRenewer, RateLimiter, read_inventory
+from .conftest import TEST_FILES
+
+
+def _write_inventory(datafiles, lines):
+    inventory = datafiles / "inventory"
+    inventory.write_text("\n".join(lines), encoding="utf-8")
+    return inventory
+
+
+@TEST_FILES
+def test_reads_inventory(datafiles):
+    inventory = _write_inventory(
+        datafiles,
+        [
+            "# key cert principals",
+            "",
+            "/a/key.pub /a/key-cert.pub a.example.com a",
+            "'/b c/key.pub' /b/key-cert.pub b.example.com  # trailing comment",
+        ],
+    )
+    entries = list(read_inventory(inventory))
+    assert [str(entry.key_path) for entry in entries] == ["/a/key.pub", "/b c/key.pub"]
+    assert entries[0].principals == ("a.example.com", "a")
+    assert entries[1].principals == ("b.example.com",)
+
+
+@TEST_FILES
+def test_rejects_inventory_without_principals(datafiles):
+    inventory = _write_inventory(datafiles, ["/a/key.pub /a/key-cert.pub"])
+    with pytest.raises(RenewError):
+        list(read_inventory(inventory))
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
+def test_renews_fleet(datafiles, mock_config, success_renewal_mock):
+    inventory = _write_inventory(
+        datafiles,
+        [
+            "%s %s erichto.halbordnung.de"
+            % (datafiles / "rsa.pub", datafiles / "rsa-cert.pub"),
+            "%s %s ecdsa.example.com"
+            % (datafiles / "ecdsa.pub", datafiles / "missing-cert.pub"),
+            "%s %s bad.example.com"
+            % (datafiles / "rsa.pub", datafiles / "bad-cert.pub"),
+        ],
+    )
+    results = FleetRenewer(mock_config, 4, 0).run(list(read_inventory(inventory)))
+    assert [outcome for _, outcome in results] == [
+        RenewOutcome.NOT_REQUIRED,
+        RenewOutcome.RENEWED,
+        RenewOutcome.FAILED,
+    ]
+    assert success_renewal_mock.call_count == 1
+    assert success_renewal_mock.last_request.json()["valid_principals"] == (
+        "ecdsa.example.com"
+    )
+    assert (datafiles / "missing-cert.pub").read_text(encoding="utf-8") == "foo"
+
+
+def test_rate_limiter_spaces_out_callers():
+    loop = asyncio.new_event_loop()
+
+    async def _measure():
+        limiter = RateLimiter(100)
+        start = loop.time()
+        for _ in range(5):
+            await limiter.wait()
+        return loop.time() - start
+
+    try:
+        assert loop.run_until_complete(_measure()) >= 0.04
+    finally:
+        loop.close()
@@ -0,0 +1,71 @@
+import json
+import shlex
+import sys
+import time
+from datetime import datetime, timezone
+
+from vault_ssh_renew.hooks import HookEvent, HookRunner
+
+DUMP_ENV = (
+    "import json, os, sys; "
+    "open(sys.argv[1], 'a').write(json.dumps("
+    "{k: v for k, v in os.environ.items() if k.startswith('VAULT_SSH_')}) + '\\n')"
+)
+
+
+def dump_env_command(path) -> str:
+    return " ".join(shlex.quote(arg) for arg in [sys.executable, "-c", DUMP_ENV, path])
+
+
+def read_env(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_passes_event_in_environment(tmpdir):
+    output = str(tmpdir / "env.jsonl")
+    event = HookEvent("on_renew", dump_env_command(output))
+    not_before = datetime(2020, 8, 1, tzinfo=timezone.utc)
+    not_after = datetime(2020, 9, 1, tzinfo=timezone.utc)
+    event.renewed["/etc/ssh/ssh_host_rsa_key-cert.pub"] = (not_before, not_after)
+    assert HookRunner(10).run(event) == 0
+    (env,) = read_env(output)
+    assert env == {
+        "VAULT_SSH_HOOK": "on_renew",
+        "VAULT_SSH_RENEWED_CERTS": "/etc/ssh/ssh_host_rsa_key-cert.pub",
+        "VAULT_SSH_FAILED_CERTS": "",
+        "VAULT_SSH_CERT_PATH": "/etc/ssh/ssh_host_rsa_key-cert.pub",
+        "VAULT_SSH_CERT_NOT_BEFORE": "2020-08-01T00:00:00+00:00",
+        "VAULT_SSH_CERT_NOT_AFTER": "2020-09-01T00:00:00+00:00",
+    }
+
+
+def test_does_not_use_shell(tmpdir):
+    marker = tmpdir / "marker"
+    runner = HookRunner(10)
+    assert runner.run(HookEvent("on_renew", "true && touch %s" % marker)) == 0
+    assert not marker.exists()
+
+
+def test_kills_hook_after_timeout():
+    runner = HookRunner(0.2)
+    start = time.monotonic()
+    command = "%s -c 'import time; time.sleep(30)'" % sys.executable
+    assert runner.run(HookEvent("on_renew", command)) is None
+    assert time.monotonic() - start < 10
+
+
+def test_coalesces_pending_events(tmpdir):
+    output = str(tmpdir / "env.jsonl")
+    command = dump_env_command(output)
+    runner = HookRunner(10)
+    slow = "%s -c 'import time; time.sleep(0.5)'" % sys.executable
+    runner.submit(HookEvent("on_renew", slow))
+    for path in ["a-cert.pub", "b-cert.pub", "a-cert.pub"]:
+        event = HookEvent("on_renew", command)
+        event.renewed[path] = (None, None)
+        runner.submit(event)
+    assert runner.wait(10)
+    (env,) = read_env(output)
+    assert env["VAULT_SSH_RENEWED_CERTS"].split(":") == ["a-cert.pub", "b-cert.pub"]
+    assert "VAULT_SSH_CERT_PATH" not in env
@@ -0,0 +1,47 @@
+import os
+import stat
+
+import pytest
+
+from vault_ssh_renew.errors import RenewError
+from vault_ssh_renew.install import install_file
+
+
+def test_creates_new_file(tmp_path):
+    target = tmp_path / "host-cert.pub"
+    assert install_file(target, b"cert") is True
+    assert target.read_bytes() == b"cert"
+    assert stat.S_IMODE(target.stat().st_mode) == 0o644
+    assert os.listdir(str(tmp_path)) == ["host-cert.pub"]
+
+
+def test_skips_identical_contents(tmp_path, mocker):
+    target = tmp_path / "host-cert.pub"
+    target.write_bytes(b"cert")
+    replace = mocker.spy(os, "replace")
+    inode = target.stat().st_ino
+    assert install_file(target, b"cert") is False
+    assert not replace.called
+    assert target.stat().st_ino == inode
+
+
+def test_preserves_mode_and_syncs(tmp_path, mocker):
+    target = tmp_path / "host-cert.pub"
+    target.write_bytes(b"old")
+    target.chmod(0o640)
+    fsync = mocker.spy(os, "fsync")
+    assert install_file(target, b"new") is True
+    assert target.read_bytes() == b"new"
+    assert stat.S_IMODE(target.stat().st_mode) == 0o640
+    # the temporary file and the directory
+    assert fsync.call_count == 2
+
+
+def test_fails_without_fallback(tmp_path, mocker):
+    target = tmp_path / "host-cert.pub"
+    target.write_bytes(b"old")
+    mocker.patch("vault_ssh_renew.install.os.replace", side_effect=OSError("EXDEV"))
+    with pytest.raises(RenewError):
+        install_file(target, b"new")
+    assert target.read_bytes() == b"old"
+    assert os.listdir(str(tmp_path)) == ["host-cert.pub"]
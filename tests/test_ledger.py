@@ -0,0 +1,125 @@
+import json
+from pathlib import Path
+from urllib.parse import urlunparse
+
+import pytest
+
+from vault_ssh_renew.cli import run_renew_workflow
+from vault_ssh_renew.errors import RenewError
+from vault_ssh_renew.ledger import (
+    BACKOFF_BASE,
+    HISTORY,
+    RenewalLedger,
+    ledger_path_for,
+)
+from .conftest import TEST_FILES
+
+
+def test_no_attempts(tmp_path):
+    assert RenewalLedger(tmp_path / "cert.pub", 60, 3600).next_attempt_at() is None
+
+
+def test_minimum_interval_after_success(tmp_path):
+    ledger = RenewalLedger(tmp_path / "cert.pub", 60, 3600)
+    ledger.record("renewed", 200)
+    attempt = ledger.attempts()[-1]
+    assert attempt.status_code == 200
+    assert ledger.next_attempt_at() == attempt.timestamp + 60
+
+
+def test_backs_off_exponentially(tmp_path):
+    ledger = RenewalLedger(tmp_path / "cert.pub", 0, 300)
+    delays = []
+    for _ in range(5):
+        ledger.record("failed", 500)
+        delays.append(ledger.next_attempt_at() - ledger.attempts()[-1].timestamp)
+    for failures, delay in enumerate(delays, 1):
+        backoff = min(300, BACKOFF_BASE * 2 ** (failures - 1))
+        assert backoff / 2 <= delay <= backoff
+    assert ledger.failures() == 5
+    ledger.record("renewed", 200)
+    assert ledger.failures() == 0
+    assert ledger.next_attempt_at() == ledger.attempts()[-1].timestamp
+
+
+def test_backoff_can_be_disabled(tmp_path):
+    ledger = RenewalLedger(tmp_path / "cert.pub", 10, 0)
+    ledger.record("failed")
+    assert ledger.next_attempt_at() == ledger.attempts()[-1].timestamp + 10
+
+
+def test_keeps_recent_attempts(tmp_path):
+    ledger = RenewalLedger(tmp_path / "cert.pub", 60, 3600)
+    for _ in range(HISTORY + 5):
+        ledger.record("failed", 403)
+    assert len(ledger.attempts()) == HISTORY
+
+
+def test_keeps_last_renewal(tmp_path):
+    ledger = RenewalLedger(tmp_path / "cert.pub", 60, 3600)
+    assert ledger.last_renewal() is None
+    ledger.record("renewed", 200)
+    renewed_at = ledger.attempts()[-1].timestamp
+    for _ in range(HISTORY + 5):
+        ledger.record("failed", 403)
+    assert len(ledger.attempts()) == HISTORY
+    assert ledger.last_renewal() == renewed_at
+    assert ledger.failures() == HISTORY - 1
+
+
+def test_ignores_corrupt_ledger(tmp_path):
+    ledger_path_for(tmp_path / "cert.pub").write_text("{")
+    assert RenewalLedger(tmp_path / "cert.pub", 60, 3600).attempts() == []
+
+
+@TEST_FILES
+@pytest.mark.usefixtures("no_permission_renewal_mock")
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_backs_off_after_failed_sign_request(
+    datafiles, mock_config, requests_mock, mocker
+):
+    exit_spy = mocker.spy(mock_config, "exit")
+    run_renew_workflow(mock_config)
+    run_renew_workflow(mock_config)
+    assert requests_mock.call_count == 1
+    assert exit_spy.call_count == 2
+    with ledger_path_for(Path(str(mock_config.ssh_host_cert_path))).open() as f:
+        assert [(entry["outcome"], entry["status_code"]) for entry in json.load(f)] == [
+            ("failed", 403)
+        ]
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_waits_minimum_interval_between_sign_requests(
+    datafiles, mock_config, requests_mock, mocker
+):
+    # Vault keeps issuing a certificate that is due for renewal
+    signed_key = mock_config.ssh_host_cert_path.read_text(encoding="utf-8")
+    requests_mock.post(
+        urlunparse(mock_config.addr) + "/v1/" + mock_config.ssh_sign_path,
+        json={"data": {"signed_key": signed_key}},
+    )
+    exit_spy = mocker.spy(mock_config, "exit")
+    run_renew_workflow(mock_config)
+    run_renew_workflow(mock_config)
+    assert requests_mock.call_count == 1
+    exit_spy.assert_not_called()
+    mock_config.sign_min_interval = 0
+    run_renew_workflow(mock_config)
+    assert requests_mock.call_count == 2
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_no_attempt_without_sign_request(datafiles, mock_config, requests_mock, mocker):
+    mock_config.ssh_principals = []
+    mocker.patch(
+        "vault_ssh_renew.principals.PrincipalResolver.resolve",
+        side_effect=RenewError("Could not determine any principals for the host"),
+    )
+    exit_spy = mocker.spy(mock_config, "exit")
+    run_renew_workflow(mock_config)
+    assert requests_mock.call_count == 0
+    assert exit_spy.call_count == 1
+    assert not ledger_path_for(Path(str(mock_config.ssh_host_cert_path))).exists()
@@ -0,0 +1,67 @@
+import shutil
+import threading
+import time
+
+import pytest
+
+from vault_ssh_renew.cli import run_renew_workflow
+from vault_ssh_renew.errors import RenewError
+from vault_ssh_renew.lock import CertificateLock
+from .conftest import TEST_FILES
+
+
+@TEST_FILES
+def test_times_out_while_locked(datafiles):
+    cert_path = datafiles / "rsa-cert.pub"
+    with CertificateLock(cert_path, 1):
+        lock = CertificateLock(cert_path, 0.2)
+        with pytest.raises(RenewError):
+            lock.acquire()
+        assert lock.contended
+    with CertificateLock(cert_path, 0.2) as lock:
+        assert not lock.contended
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_rechecks_after_waiting_for_lock(
+    datafiles, mock_config, success_renewal_mock, capsys
+):
+    mock_config.ssh_host_key_path = datafiles / "ed25519.pub"
+    mock_config.ssh_host_cert_path = datafiles / "ed25519-cert.pub"
+    lock = CertificateLock(mock_config.ssh_host_cert_path, 1).acquire()
+    worker = threading.Thread(target=run_renew_workflow, args=(mock_config,))
+    worker.start()
+    time.sleep(0.3)
+    # Another process installs a fresh certificate while holding the lock
+    shutil.copy(
+        str(datafiles / "ed25519-forever-cert.pub"),
+        str(mock_config.ssh_host_cert_path),
+    )
+    lock.release()
+    worker.join()
+    assert not success_renewal_mock.called
+    assert "renewed by another process" in capsys.readouterr().out
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_rechecks_after_taking_free_lock(
+    datafiles, mock_config, success_renewal_mock, mocker, capsys
+):
+    mock_config.ssh_host_key_path = datafiles / "ed25519.pub"
+    mock_config.ssh_host_cert_path = datafiles / "ed25519-cert.pub"
+    acquire = CertificateLock.acquire
+
+    def _acquire(lock):
+        # Another process renewed and released the lock just before
+        shutil.copy(
+            str(datafiles / "ed25519-forever-cert.pub"),
+            str(mock_config.ssh_host_cert_path),
+        )
+        return acquire(lock)
+
+    mocker.patch.object(CertificateLock, "acquire", _acquire)
+    run_renew_workflow(mock_config)
+    assert not success_renewal_mock.called
+    assert "renewed by another process" in capsys.readouterr().out
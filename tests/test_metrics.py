@@ -0,0 +1,115 @@
+import shutil
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+import pytest
+
+from vault_ssh_renew.cli import run_renew_workflow
+from vault_ssh_renew.metrics import METRICS, Metrics, MetricsServer
+from .conftest import TEST_FILES
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    METRICS.reset()
+    yield
+    METRICS.reset()
+
+
+def test_renders_exposition_format():
+    metrics = Metrics()
+    metrics.set("vault_ssh_renew_cert_not_after_timestamp_seconds", 5.0, cert='a"b')
+    metrics.inc("vault_ssh_renew_vault_responses_total", code="200")
+    metrics.inc("vault_ssh_renew_vault_responses_total", code="200")
+    metrics.observe("vault_ssh_renew_phase_duration_seconds", 0.02, phase="sign")
+    text = metrics.render()
+    assert "# TYPE vault_ssh_renew_cert_not_after_timestamp_seconds gauge" in text
+    assert 'vault_ssh_renew_cert_not_after_timestamp_seconds{cert="a\\"b"} 5.0' in text
+    assert 'vault_ssh_renew_vault_responses_total{code="200"} 2.0' in text
+    assert (
+        'vault_ssh_renew_phase_duration_seconds_bucket{phase="sign",le="0.01"} 0.0'
+        in text
+    )
+    assert (
+        'vault_ssh_renew_phase_duration_seconds_bucket{phase="sign",le="0.05"} 1.0'
+        in text
+    )
+    assert 'vault_ssh_renew_phase_duration_seconds_count{phase="sign"} 1.0' in text
+
+
+@TEST_FILES
+@pytest.mark.usefixtures("success_renewal_mock")
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_writes_textfile(datafiles, mock_config):
+    mock_config.metrics_textfile = str(datafiles / "vault-ssh-renew.prom")
+    run_renew_workflow(mock_config)
+    text = (datafiles / "vault-ssh-renew.prom").read_text(encoding="utf-8")
+    cert = str(mock_config.ssh_host_cert_path)
+    assert (
+        'vault_ssh_renew_cert_not_after_timestamp_seconds{cert="%s"} 1598213557.0'
+        % cert
+        in text
+    )
+    assert (
+        'vault_ssh_renew_checks_total{cert="%s",outcome="renewed"} 1.0' % cert in text
+    )
+    assert 'vault_ssh_renew_vault_responses_total{code="200"} 1.0' in text
+    for phase in ["read", "parse", "sign", "write", "hook"]:
+        assert 'phase_duration_seconds_count{phase="%s"}' % phase in text
+
+
+def test_replaces_textfile_atomically(tmp_path):
+    path = tmp_path / "vault-ssh-renew.prom"
+    Metrics().write_textfile(str(path))
+    assert path.stat().st_mode & 0o777 == 0o644
+    (tmp_path / "directory" / "file").mkdir(parents=True)
+    with pytest.raises(OSError):
+        Metrics().write_textfile(str(tmp_path / "directory"))
+    # The failure leaves no temporary file behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "directory",
+        "vault-ssh-renew.prom",
+    ]
+
+
+@TEST_FILES
+@pytest.mark.usefixtures("success_renewal_mock")
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_keeps_last_renewal_in_textfile(datafiles, mock_config):
+    mock_config.ssh_host_key_path = datafiles / "ed25519.pub"
+    mock_config.ssh_host_cert_path = datafiles / "ed25519-cert.pub"
+    mock_config.metrics_textfile = str(datafiles / "vault-ssh-renew.prom")
+    run_renew_workflow(mock_config)
+    # The next run finds a valid certificate and renews nothing
+    shutil.copy(
+        str(datafiles / "ed25519-forever-cert.pub"),
+        str(mock_config.ssh_host_cert_path),
+    )
+    METRICS.reset()
+    run_renew_workflow(mock_config)
+    text = (datafiles / "vault-ssh-renew.prom").read_text(encoding="utf-8")
+    cert = str(mock_config.ssh_host_cert_path)
+    assert 'cert="%s",outcome="not required"' % cert in text
+    assert (
+        'vault_ssh_renew_last_renewal_timestamp_seconds{cert="%s"} 1598184000.0' % cert
+        in text
+    )
+
+
+def test_serves_metrics_and_health():
+    metrics = Metrics()
+    metrics.inc("vault_ssh_renew_vault_responses_total", code="200")
+    server = MetricsServer(("127.0.0.1", 0), metrics).start()
+    try:
+        base = "http://127.0.0.1:%d" % server.port
+        assert (
+            b"vault_ssh_renew_vault_responses_total"
+            in urlopen(base + "/metrics").read()
+        )
+        assert urlopen(base + "/healthz").status == 200
+        metrics.healthy = False
+        with pytest.raises(HTTPError) as e:
+            urlopen(base + "/healthz")
+        assert e.value.code == 503
+    finally:
+        server.stop()
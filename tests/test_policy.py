@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+
+from vault_ssh_renew.policy import (
+    LifetimeFractionPolicy,
+    RenewalPolicy,
+    spread_fraction,
+)
+
+NOT_BEFORE = datetime(2020, 7, 22, tzinfo=timezone.utc)
+NOT_AFTER = datetime(2020, 8, 23, tzinfo=timezone.utc)
+
+
+def test_without_spread_renews_at_threshold():
+    policy = RenewalPolicy(timedelta(days=7))
+    assert policy.renew_at(NOT_BEFORE, NOT_AFTER) == NOT_AFTER - timedelta(days=7)
+
+
+def test_spread_is_stable_per_seed():
+    assert spread_fraction("a.example.com") == spread_fraction("a.example.com")
+    assert 0 <= spread_fraction("a.example.com") < 1
+
+
+def test_spreads_hosts_over_window():
+    due = NOT_AFTER - timedelta(days=7)
+    renewals = [
+        RenewalPolicy(
+            timedelta(days=7), timedelta(days=4), "host%d.example.com" % i
+        ).renew_at(NOT_BEFORE, NOT_AFTER)
+        for i in range(200)
+    ]
+    assert all(due - timedelta(days=4) <= when <= due for when in renewals)
+    assert len({when.date() for when in renewals}) == 4
+
+
+def test_never_renews_before_not_before():
+    for i in range(20):
+        policy = RenewalPolicy(
+            timedelta(days=7), timedelta(days=100), "host%d.example.com" % i
+        )
+        renew_at = policy.renew_at(NOT_BEFORE, NOT_AFTER)
+        assert NOT_BEFORE <= renew_at
+        assert policy.needs_renewal(NOT_BEFORE, NOT_AFTER, renew_at)
+
+
+def test_renews_not_yet_valid_certificates():
+    policy = RenewalPolicy(timedelta(days=7))
+    assert policy.needs_renewal(NOT_BEFORE, NOT_AFTER, NOT_BEFORE - timedelta(1))
+
+
+def test_renews_at_fraction_of_lifetime():
+    policy = LifetimeFractionPolicy(0.25)
+    assert policy.renew_at(NOT_BEFORE, NOT_AFTER) == NOT_AFTER - timedelta(days=8)
+    short_lived = NOT_BEFORE + timedelta(days=3)
+    assert policy.renew_at(NOT_BEFORE, short_lived) == short_lived - timedelta(hours=18)
+
+
+def test_fraction_respects_floor():
+    policy = LifetimeFractionPolicy(0.25, timedelta(days=1))
+    short_lived = NOT_BEFORE + timedelta(hours=8)
+    assert policy.renew_at(NOT_BEFORE, short_lived) == short_lived - timedelta(days=1)
+
+
+def test_detects_differing_principals():
+    policy = RenewalPolicy(timedelta(days=7), principals=["a.example.com", "a"])
+    assert not policy.principals_differ(("a", "a.example.com"))
+    assert policy.principals_differ(("a.example.com",))
+    assert not RenewalPolicy(timedelta(days=7)).principals_differ(("b",))
@@ -0,0 +1,121 @@
+import json
+import threading
+
+import pytest
+
+from vault_ssh_renew.cli import run_renew_workflow
+from vault_ssh_renew.errors import RenewError
+from vault_ssh_renew.principals import PrincipalResolver, _hosts, read_metadata
+from .conftest import TEST_FILES
+
+
+@pytest.fixture
+def metadata(tmp_path):
+    path = tmp_path / "instance-data.json"
+    path.write_text(
+        json.dumps({"v1": {"local_hostname": "node1.internal", "instance_id": "i-123"}})
+    )
+    return path
+
+
+def test_reads_cloud_init_metadata(metadata):
+    assert read_metadata(metadata) == ["node1.internal"]
+
+
+def test_reads_plain_metadata(tmp_path):
+    path = tmp_path / "names"
+    path.write_text("a.example.com\n\nb.example.com\n")
+    assert read_metadata(path) == ["a.example.com", "b.example.com"]
+    path.write_text('["c.example.com"]')
+    assert read_metadata(path) == ["c.example.com"]
+
+
+def test_reads_hosts_file(tmp_path, mocker):
+    mocker.patch("socket.gethostname", return_value="node1")
+    path = tmp_path / "hosts"
+    path.write_text(
+        "127.0.0.1 localhost\n"
+        "10.0.0.5 node1.example.com node1 node1.internal # comment\n"
+        "10.0.0.6 node2.example.com node2\n"
+    )
+    assert _hosts(str(path)) == ["node1.example.com", "node1.internal"]
+
+
+def test_combines_sources_in_order(metadata, mocker):
+    mocker.patch("socket.gethostname", return_value="node1")
+    mocker.patch("socket.getfqdn", return_value="node1.internal")
+    resolver = PrincipalResolver(("metadata", "hostname", "fqdn"), metadata)
+    assert resolver.resolve() == ["node1.internal", "node1"]
+
+
+def test_skips_failing_source(metadata, mocker, capsys):
+    mocker.patch("socket.gethostname", side_effect=OSError("no hostname"))
+    resolver = PrincipalResolver(("hostname", "metadata"), metadata)
+    assert resolver.resolve() == ["node1.internal"]
+    assert "Could not look up principals from hostname" in capsys.readouterr().err
+
+
+def test_caches_between_runs(tmp_path, mocker):
+    getfqdn = mocker.patch("socket.getfqdn", return_value="node1.example.com")
+    cache_path = tmp_path / "principals.json"
+    assert PrincipalResolver(cache_path=cache_path).resolve() == ["node1.example.com"]
+    assert PrincipalResolver(cache_path=cache_path).resolve() == ["node1.example.com"]
+    assert getfqdn.call_count == 1
+    # A different declaration of sources does not use the cached result
+    mocker.patch("socket.gethostname", return_value="node1")
+    assert PrincipalResolver(("hostname",), cache_path=cache_path).resolve() == [
+        "node1"
+    ]
+
+
+def test_resolves_again_after_ttl(tmp_path, mocker):
+    getfqdn = mocker.patch("socket.getfqdn", return_value="node1.example.com")
+    cache_path = tmp_path / "principals.json"
+    PrincipalResolver(ttl=0, cache_path=cache_path).resolve()
+    PrincipalResolver(ttl=0, cache_path=cache_path).resolve()
+    assert getfqdn.call_count == 2
+
+
+def test_times_out(tmp_path, mocker):
+    release = threading.Event()
+    mocker.patch("socket.getfqdn", side_effect=lambda: release.wait(5) and "late")
+    try:
+        with pytest.raises(RenewError):
+            PrincipalResolver(timeout=0.1).resolve()
+    finally:
+        release.set()
+
+
+def test_falls_back_to_stale_result(tmp_path, mocker):
+    cache_path = tmp_path / "principals.json"
+    mocker.patch("socket.getfqdn", return_value="node1.example.com")
+    PrincipalResolver(cache_path=cache_path).resolve()
+    mocker.patch("socket.getfqdn", return_value="")
+    assert PrincipalResolver(ttl=0, cache_path=cache_path).resolve() == [
+        "node1.example.com"
+    ]
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-07-22T23:00:00+0000")
+def test_no_lookup_without_renewal(datafiles, mock_config, mocker):
+    getfqdn = mocker.patch("socket.getfqdn")
+    mock_config.ssh_principals = ()
+    run_renew_workflow(mock_config)
+    assert not getfqdn.called
+
+
+@TEST_FILES
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_looks_up_principals_for_renewal(
+    datafiles, mock_config, success_renewal_mock, mocker
+):
+    mocker.patch("socket.getfqdn", return_value="node1.example.com")
+    mock_config.ssh_principals = ()
+    mock_config.cache_dir = datafiles / "cache"
+    run_renew_workflow(mock_config)
+    assert (
+        success_renewal_mock.last_request.json()["valid_principals"]
+        == "node1.example.com"
+    )
+    assert PrincipalResolver.from_config(mock_config).cached() == ["node1.example.com"]
@@ -0,0 +1,143 @@
+import http.client
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlunparse
+
+import pytest
+
+from vault_ssh_renew.relay import MAX_REQUEST_SIZE, SignRelay
+
+
+@pytest.fixture
+def sign_relay(mock_config):
+    relay = SignRelay(mock_config, ("127.0.0.1", 0), 4, 0).start()
+    yield relay
+    relay.stop()
+
+
+def _post(relay: SignRelay, path: str, payload, token="node") -> tuple:
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["X-Vault-Token"] = token
+    request = urllib.request.Request(
+        "http://127.0.0.1:%d%s" % (relay.port, path),
+        data=json.dumps(payload).encode("utf-8"),
+        headers=headers,
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.loads(response.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read().decode("utf-8"))
+
+
+def _upstream(requests_mock, mock_config, delay=0.0):
+    calls = []
+    lock = threading.Lock()
+
+    def _sign(request, context):
+        with lock:
+            calls.append(request.json())
+        time.sleep(delay)
+        return {"data": {"signed_key": "signed " + request.json()["public_key"]}}
+
+    requests_mock.post(
+        urlunparse(mock_config.addr) + "/v1/" + mock_config.ssh_sign_path, json=_sign
+    )
+    _capabilities(requests_mock, mock_config)
+    return calls
+
+
+def _capabilities(requests_mock, mock_config, tokens=("node",)):
+    def _check(request, context):
+        if request.headers.get("X-Vault-Token") not in tokens:
+            context.status_code = 403
+            return {"errors": ["permission denied"]}
+        return {"capabilities": ["update"], mock_config.ssh_sign_path: ["update"]}
+
+    return requests_mock.post(
+        urlunparse(mock_config.addr) + "/v1/sys/capabilities-self", json=_check
+    )
+
+
+def test_forwards_with_own_token(sign_relay, requests_mock, mock_config):
+    _upstream(requests_mock, mock_config)
+    payload = {"cert_type": "host", "public_key": "a", "valid_principals": "a"}
+    status, body = _post(sign_relay, "/v1/ssh/sign/host", payload)
+    assert status == 200
+    assert body["data"]["signed_key"] == "signed a"
+    assert requests_mock.last_request.headers["X-Vault-Token"] == mock_config.token
+
+
+def test_deduplicates_identical_requests(sign_relay, requests_mock, mock_config):
+    calls = _upstream(requests_mock, mock_config, delay=0.3)
+    payloads = [
+        {"cert_type": "host", "public_key": key, "valid_principals": "host"}
+        for key in ["a"] * 4 + ["b"]
+    ]
+    with ThreadPoolExecutor(len(payloads)) as pool:
+        results = list(
+            pool.map(lambda p: _post(sign_relay, "/v1/ssh/sign/host", p), payloads)
+        )
+    assert [body["data"]["signed_key"] for _, body in results] == ["signed a"] * 4 + [
+        "signed b"
+    ]
+    assert sorted(call["public_key"] for call in calls) == ["a", "b"]
+
+
+def test_rejects_other_paths(sign_relay, requests_mock, mock_config):
+    calls = _upstream(requests_mock, mock_config)
+    status, _ = _post(sign_relay, "/v1/ssh/sign/other", {"public_key": "a"})
+    assert status == 404
+    assert not calls
+
+
+@pytest.mark.parametrize(
+    "length, status",
+    [(None, 400), ("abc", 400), ("-1", 400), (str(MAX_REQUEST_SIZE + 1), 413)],
+)
+def test_rejects_invalid_content_length(
+    sign_relay, requests_mock, mock_config, length, status
+):
+    calls = _upstream(requests_mock, mock_config)
+    connection = http.client.HTTPConnection("127.0.0.1", sign_relay.port, timeout=5)
+    try:
+        connection.putrequest("POST", "/v1/ssh/sign/host")
+        connection.putheader("X-Vault-Token", "node")
+        if length is not None:
+            connection.putheader("Content-Length", length)
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == status
+        assert response.getheader("Connection") == "close"
+    finally:
+        connection.close()
+    assert not calls
+
+
+@pytest.mark.parametrize("token", [None, "stolen"])
+def test_rejects_unauthorized_tokens(sign_relay, requests_mock, mock_config, token):
+    calls = _upstream(requests_mock, mock_config)
+    payload = {"cert_type": "host", "public_key": "a", "valid_principals": "a"}
+    status, body = _post(sign_relay, "/v1/ssh/sign/host", payload, token)
+    assert status == 403
+    assert body == {"errors": ["permission denied"]}
+    assert not calls
+
+
+def test_caches_capabilities_per_token(sign_relay, requests_mock, mock_config):
+    _upstream(requests_mock, mock_config)
+    check = _capabilities(requests_mock, mock_config, ("node", "other"))
+    payload = {"cert_type": "host", "public_key": "a", "valid_principals": "a"}
+    for token in ["node", "node", "other"]:
+        status, _ = _post(sign_relay, "/v1/ssh/sign/host", payload, token)
+        assert status == 200
+    assert [request.headers["X-Vault-Token"] for request in check.request_history] == [
+        "node",
+        "other",
+    ]
+    assert check.last_request.json() == {"paths": [mock_config.ssh_sign_path]}
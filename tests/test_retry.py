@@ -0,0 +1,37 @@
+from vault_ssh_renew.retry import CircuitBreaker, RetryPolicy, parse_retry_after
+
+
+def test_backoff_is_capped_and_jittered():
+    policy = RetryPolicy(backoff_base=1.0, backoff_cap=4.0)
+    delays = [policy.backoff(attempt) for attempt in range(1, 10) for _ in range(20)]
+    assert all(0 <= delay <= 4.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_backoff_honours_retry_after():
+    assert RetryPolicy(backoff_cap=1.0).backoff(1, 10.0) == 10.0
+
+
+def test_parses_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_circuit_breaker_opens_and_half_opens(mocker):
+    monotonic = mocker.patch("vault_ssh_renew.retry.time.monotonic", return_value=0.0)
+    breaker = CircuitBreaker(threshold=2, reset_timeout=10.0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    monotonic.return_value = 11.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    monotonic.return_value = 22.0
+    assert breaker.allow()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
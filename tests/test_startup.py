@@ -0,0 +1,53 @@
+import json
+import subprocess
+import sys
+
+from .conftest import TEST_FILES
+
+# Modules that a run which finds the certificate still valid does not need
+DEFERRED_MODULES = [
+    "asyncio",
+    "concurrent.futures.process",
+    "ctypes",
+    "http.server",
+    "requests",
+    "subprocess",
+    "urllib3",
+    "vault_ssh_renew.audit",
+]
+
+SCRIPT = """
+import json, sys
+from vault_ssh_renew.cli import renew
+try:
+    renew.main(sys.argv[1:], standalone_mode=False)
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+@TEST_FILES
+def test_valid_certificate_does_not_load_http_stack(datafiles):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            SCRIPT,
+            str(datafiles / "ed25519.pub"),
+            str(datafiles / "ed25519-forever-cert.pub"),
+            "--ssh-principal",
+            "erichto.halbordnung.de",
+            "--ssh-sign-path",
+            "ssh/sign/host",
+            "--vault-token",
+            "token",
+            "--cache-dir",
+            str(datafiles / "cache"),
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    modules = set(json.loads(result.stdout.decode("utf-8").splitlines()[-1]))
+    assert "vault_ssh_renew.cli" in modules
+    assert modules.isdisjoint(DEFERRED_MODULES)
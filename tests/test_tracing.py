@@ -0,0 +1,100 @@
+import json
+import threading
+
+import pytest
+
+from vault_ssh_renew.cli import run_renew_workflow
+from vault_ssh_renew.tracing import NOOP_SPAN, TRACER, Tracer
+from .conftest import TEST_FILES
+
+
+@pytest.fixture
+def trace_file(tmpdir):
+    path = str(tmpdir / "trace.jsonl")
+    TRACER.configure(path)
+    yield path
+    TRACER.configure(None)
+
+
+def read_spans(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_disabled_tracer_returns_noop_span():
+    tracer = Tracer()
+    assert not tracer.enabled
+    assert tracer.span("anything", key="value") is NOOP_SPAN
+    func = lambda: None
+    assert tracer.wrap(func) is func
+
+
+def test_records_nested_spans(tmpdir):
+    path = str(tmpdir / "trace.jsonl")
+    tracer = Tracer()
+    tracer.configure(path)
+    with tracer.span("outer", a=1):
+        with tracer.span("inner") as inner:
+            inner.set_attribute("b", "c")
+    with pytest.raises(ValueError):
+        with tracer.span("failing"):
+            raise ValueError("broken")
+    tracer.close()
+    inner, outer, failing = read_spans(path)
+    assert inner["name"] == "inner"
+    assert inner["attributes"] == {"b": "c"}
+    assert inner["parent_span_id"] == outer["span_id"]
+    assert inner["trace_id"] == outer["trace_id"]
+    assert outer["parent_span_id"] is None
+    assert outer["attributes"] == {"a": 1}
+    assert outer["end_time_unix_nano"] >= outer["start_time_unix_nano"]
+    assert failing["status"] == "error"
+    assert failing["attributes"]["error"] == "ValueError: broken"
+    assert failing["trace_id"] != outer["trace_id"]
+
+
+def test_wrap_propagates_parent_to_threads(tmpdir):
+    path = str(tmpdir / "trace.jsonl")
+    tracer = Tracer()
+    tracer.configure(path)
+
+    def _work():
+        with tracer.span("child"):
+            pass
+
+    with tracer.span("parent"):
+        thread = threading.Thread(target=tracer.wrap(_work))
+        thread.start()
+        thread.join()
+    tracer.close()
+    child, parent = read_spans(path)
+    assert child["parent_span_id"] == parent["span_id"]
+
+
+@TEST_FILES
+@pytest.mark.usefixtures("success_renewal_mock")
+@pytest.mark.freeze_time("2020-08-23T12:00:00+0000")
+def test_traces_renewal_workflow(mock_config, trace_file):
+    run_renew_workflow(mock_config)
+    spans = read_spans(trace_file)
+    names = [span["name"] for span in spans]
+    for name in [
+        "cert.read",
+        "cert.parse",
+        "vault.request",
+        "vault.sign",
+        "cert.write",
+        "host_key",
+        "hook",
+        "renew",
+    ]:
+        assert name in names
+    by_id = {span["span_id"]: span for span in spans}
+    host_key = spans[names.index("host_key")]
+    assert host_key["attributes"]["outcome"] == "renewed"
+    assert by_id[host_key["parent_span_id"]]["name"] == "renew"
+    request = spans[names.index("vault.request")]
+    assert request["attributes"] == {"attempt": 1, "status_code": 200}
+    assert by_id[request["parent_span_id"]]["name"] == "vault.sign"
+    hook = spans[names.index("hook")]
+    assert hook["attributes"] == {"hook": "on_renew", "exit_status": 0}
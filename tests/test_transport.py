@@ -0,0 +1,101 @@
+import asyncio
+from urllib.parse import urlparse
+
+import pytest
+
+from vault_ssh_renew.aio import AsyncVaultConnection, AsyncVaultRenewer
+from vault_ssh_renew.auth import AgentToken, TokenSource
+from vault_ssh_renew.errors import RenewError
+from vault_ssh_renew.retry import RetryPolicy
+from vault_ssh_renew.util import base_url
+from vault_ssh_renew.vault import VaultConnection, VaultRenewer, create_session
+from .conftest import FakeVault
+
+
+@pytest.fixture
+def agent():
+    # Answers like a Vault Agent listening on a Unix domain socket
+    agent = FakeVault(unix=True)
+    yield agent
+    agent.close()
+
+
+def _renewer(addr, token, tmp_path, key, connection=None):
+    return VaultRenewer.build(
+        addr,
+        token,
+        "ssh/sign/host",
+        key,
+        ["a.example.com"],
+        tmp_path / ("%s-cert.pub" % key),
+        connection,
+    )
+
+
+def test_base_url():
+    assert base_url(urlparse("https://vault:8200")) == "https://vault:8200"
+    assert (
+        base_url(urlparse("unix:///run/vault/agent.sock"))
+        == "http+unix://%2Frun%2Fvault%2Fagent.sock"
+    )
+
+
+def test_signs_over_unix_socket(agent, tmp_path):
+    _renewer(agent.addr, "mytoken", tmp_path, "key").renew().write_certificate()
+    assert (tmp_path / "key-cert.pub").read_text() == "signed key"
+    assert agent.paths() == ["/v1/ssh/sign/host"]
+    assert agent.requests[0].token == "mytoken"
+
+
+def test_agent_token_omits_header(agent, tmp_path, mock_config):
+    mock_config.use_agent_token = True
+    tokens = TokenSource.from_config(mock_config)
+    assert isinstance(tokens, AgentToken)
+    tokens.call(
+        None, lambda token: _renewer(agent.addr, token, tmp_path, "key").renew()
+    )
+    assert agent.requests[0].token is None
+
+
+def test_reuses_connections(agent, tmp_path):
+    with VaultConnection(create_session(2)) as connection:
+        for key in ("a", "b", "c"):
+            _renewer(agent.addr, "mytoken", tmp_path, key, connection).renew()
+    assert len(agent.requests) == 3
+    assert agent.connections == 1
+
+
+def test_missing_socket(tmp_path):
+    connection = VaultConnection(policy=RetryPolicy(max_retries=0))
+    with pytest.raises(RenewError):
+        _renewer(
+            urlparse("unix://%s/missing.sock" % tmp_path),
+            "mytoken",
+            tmp_path,
+            "key",
+            connection,
+        ).renew()
+
+
+def test_async_signs_over_unix_socket(agent, tmp_path):
+    async def _main():
+        async with AsyncVaultConnection() as connection:
+            for key in ("a", "b"):
+                await AsyncVaultRenewer.build(
+                    agent.addr,
+                    "",
+                    "ssh/sign/host",
+                    key,
+                    ["a.example.com"],
+                    tmp_path / ("%s-cert.pub" % key),
+                    connection,
+                ).renew()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_main())
+    finally:
+        loop.close()
+    assert len(agent.requests) == 2
+    assert agent.connections == 1
+    assert agent.requests[0].token is None
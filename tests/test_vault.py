@@ -1,9 +1,13 @@
+from urllib.parse import urlunparse
+
 from hamcrest import assert_that, has_entries, all_of, contains_string
 import pytest
+import requests
 from requests import Request
 
 from vault_ssh_renew.errors import RenewError
-from vault_ssh_renew.vault import VaultRenewer
+from vault_ssh_renew.retry import CircuitBreaker, RetryPolicy
+from vault_ssh_renew.vault import VaultConnection, VaultRenewer, create_session
 
 
 def test_successfully_renews(mock_config, success_renewal_mock):
@@ -46,3 +50,68 @@ def test_raises_on_error(mock_config):
             mock_config.ssh_principals,
             mock_config.ssh_host_cert_path,
         ).renew().write_certificate()
+
+
+def _renew(mock_config, connection=None, public_key="bar"):
+    return VaultRenewer.build(
+        mock_config.addr,
+        mock_config.token,
+        mock_config.ssh_sign_path,
+        public_key,
+        mock_config.ssh_principals,
+        mock_config.ssh_host_cert_path,
+        connection,
+    ).renew()
+
+
+def _sign_url(mock_config):
+    return urlunparse(mock_config.addr) + "/v1/" + mock_config.ssh_sign_path
+
+
+def test_reuses_shared_session(mock_config, success_renewal_mock, mocker):
+    with VaultConnection(create_session(2)) as connection:
+        post = mocker.spy(connection.session, "post")
+        for public_key in ["bar", "baz"]:
+            _renew(mock_config, connection, public_key)
+    assert post.call_count == 2
+    assert success_renewal_mock.call_count == 2
+
+
+def test_retries_temporary_errors(mock_config, requests_mock, mocker):
+    sleep = mocker.patch("vault_ssh_renew.vault.time.sleep")
+    requests_mock.post(
+        _sign_url(mock_config),
+        [
+            {"status_code": 503, "headers": {"Retry-After": "2"}},
+            {"exc": requests.exceptions.ConnectTimeout},
+            {"json": {"data": {"signed_key": "foo"}}},
+        ],
+    )
+    _renew(mock_config).write_certificate()
+    assert requests_mock.call_count == 3
+    assert sleep.call_args_list[0][0][0] >= 2
+    assert requests_mock.request_history[0].timeout == (5.0, 30.0)
+    assert mock_config.ssh_host_cert_path.read_text("utf-8") == "foo"
+
+
+def test_gives_up_after_max_retries(mock_config, requests_mock, mocker):
+    mocker.patch("vault_ssh_renew.vault.time.sleep")
+    requests_mock.post(_sign_url(mock_config), status_code=429)
+    policy = RetryPolicy(max_retries=2)
+    with pytest.raises(RenewError):
+        _renew(mock_config, VaultConnection(policy=policy))
+    assert requests_mock.call_count == 3
+
+
+def test_circuit_breaker_stops_requests(mock_config, requests_mock, mocker):
+    mocker.patch("vault_ssh_renew.vault.time.sleep")
+    requests_mock.post(_sign_url(mock_config), exc=requests.exceptions.ConnectionError)
+    connection = VaultConnection(
+        policy=RetryPolicy(max_retries=10), breaker=CircuitBreaker(threshold=3)
+    )
+    with pytest.raises(RenewError):
+        _renew(mock_config, connection)
+    with pytest.raises(RenewError):
+        _renew(mock_config, connection)
+    assert requests_mock.call_count == 3
+    assert connection.breaker.is_open
@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+from vault_ssh_renew.watch import FileWatcher
+
+
+@pytest.fixture
+def files(tmpdir):
+    key = tmpdir / "ssh_host_ed25519_key.pub"
+    cert = tmpdir / "ssh_host_ed25519_key-cert.pub"
+    key.write("key")
+    cert.write("cert")
+    return key, cert
+
+
+@pytest.fixture
+def watched(files):
+    changed = threading.Event()
+    watcher = FileWatcher(lambda: files, changed.set, debounce=0.05).start()
+    yield changed
+    watcher.stop()
+
+
+def test_notices_changed_key(files, watched):
+    files[0].write("new key")
+    assert watched.wait(5)
+
+
+def test_notices_removed_cert(files, watched):
+    files[1].remove()
+    assert watched.wait(5)
+
+
+def test_notices_replaced_cert(files, watched, tmpdir):
+    replacement = tmpdir / "replacement"
+    replacement.write("new cert")
+    replacement.rename(files[1])
+    assert watched.wait(5)
+
+
+def test_ignores_unchanged_contents(files, watched, tmpdir):
+    files[0].write("key")
+    (tmpdir / "unrelated").write("data")
+    assert not watched.wait(0.5)
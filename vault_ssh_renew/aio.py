@@ -0,0 +1,397 @@
+"""
+An asyncio counterpart to the renewal API, for embedding renewals in asyncio based
+agents. Requests to Vault are made with non-blocking sockets over a shared pool of
+connections; only reading and writing files is offloaded to a thread.
+
+    async with AsyncVaultConnection() as connection:
+        status = await check_renewal_required(key_path, cert_path, limit)
+        if status.needs_renewal:
+            renewer = AsyncVaultRenewer.build(
+                addr, token, sign_path, status.public_key, principals, cert_path,
+                connection,
+            )
+            await (await renewer.renew()).write_certificate()
+
+Any of the coroutines can be cancelled. A connection whose request was cancelled is
+closed rather than reused. Spans are not traced, since the tracer follows threads
+rather than tasks.
+"""
+
+import asyncio
+import json
+import ssl
+import time
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Collection, Dict, List, Mapping, Optional, Tuple, Union
+from urllib.parse import ParseResult, unquote, urlparse
+
+from .auth import token_headers
+from .cache import StatusCache
+from .cert import HostCertificate, HostCertificateStatus
+from .errors import RenewError, TokenRejected, VaultResponseError
+from .install import install_file
+from .metrics import METRICS
+from .policy import RenewalPolicy
+from .retry import (
+    RETRYABLE_STATUS_CODES,
+    CircuitBreaker,
+    RetryPolicy,
+    parse_retry_after,
+)
+from .util import UNIX_SCHEME, base_url
+
+_Stream = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+_Origin = Tuple[str, str, int]
+
+
+class AsyncResponse:
+    status_code: int
+    headers: Dict[str, str]
+    content: bytes
+
+    def __init__(self, status_code: int, headers: Dict[str, str], content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class AsyncVaultConnection:
+    """
+    The asyncio counterpart of VaultConnection. Keeps up to `pool_size` HTTP/1.1
+    connections per Vault server open for reuse, and applies the same timeouts, retry
+    policy and circuit breaker. Redirects are not followed.
+    """
+
+    policy: RetryPolicy
+    breaker: CircuitBreaker
+
+    def __init__(
+        self,
+        pool_size: int = 4,
+        policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ):
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._pool_size = pool_size
+        self._ssl_context = ssl_context
+        self._idle: Dict[_Origin, List[_Stream]] = defaultdict(list)
+        self._slots: Dict[_Origin, asyncio.Semaphore] = {}
+
+    @classmethod
+    def from_config(
+        cls, config, pool_size: Optional[int] = None
+    ) -> "AsyncVaultConnection":
+        return cls(
+            pool_size if pool_size is not None else config.vault_pool_size,
+            RetryPolicy.from_config(config),
+            CircuitBreaker(config.vault_breaker_threshold),
+        )
+
+    async def close(self):
+        for streams in self._idle.values():
+            for _, writer in streams:
+                writer.close()
+        self._idle.clear()
+
+    async def __aenter__(self) -> "AsyncVaultConnection":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def post(
+        self, url: str, payload: Any, headers: Mapping[str, str]
+    ) -> AsyncResponse:
+        """
+        Send a request to Vault, retrying like VaultConnection.post
+        :return: The first response that is not a temporary failure, or the last
+            response received
+        :raises RenewError: If Vault could not be reached at all
+        """
+        policy = self.policy
+        for name, value in headers.items():
+            # Line breaks would end the header and inject others into the request
+            if any(c in "%s%s" % (name, value) for c in "\r\n"):
+                raise RenewError("Invalid value for HTTP header %r" % name)
+        body = json.dumps(payload).encode("utf-8")
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise RenewError("Vault is unavailable, not sending further requests")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RenewError("Deadline for Vault request exceeded")
+            retry_after = None
+            try:
+                response = await self._request(url, body, headers, deadline)
+            except (OSError, ValueError, asyncio.TimeoutError) as e:
+                METRICS.inc("vault_ssh_renew_vault_responses_total", code="error")
+                self.breaker.record_failure()
+                response = None
+                error = "Could not reach Vault: %s" % (str(e) or type(e).__name__)
+            else:
+                METRICS.inc(
+                    "vault_ssh_renew_vault_responses_total",
+                    code=str(response.status_code),
+                )
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
+                error = "Vault responded with status %d" % response.status_code
+            attempt += 1
+            delay = policy.backoff(attempt, retry_after)
+            if attempt > policy.max_retries or time.monotonic() + delay >= deadline:
+                if response is not None:
+                    return response
+                raise RenewError(error)
+            await asyncio.sleep(delay)
+
+    async def _request(
+        self, url: str, body: bytes, headers: Mapping[str, str], deadline: float
+    ) -> AsyncResponse:
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https", UNIX_SCHEME):
+            raise ValueError("Unsupported URL scheme %s" % parsed.scheme)
+        https = parsed.scheme == "https"
+        if parsed.scheme == UNIX_SCHEME:
+            origin = (parsed.scheme, unquote(parsed.netloc), 0)
+            host = "localhost"
+        else:
+            origin = (
+                parsed.scheme,
+                parsed.hostname,
+                parsed.port or (443 if https else 80),
+            )
+            host = parsed.netloc
+        if origin not in self._slots:
+            self._slots[origin] = asyncio.Semaphore(self._pool_size)
+        request = [
+            "POST %s HTTP/1.1"
+            % ((parsed.path or "/") + ("?" + parsed.query if parsed.query else "")),
+            "Host: %s" % host,
+            "Content-Type: application/json",
+            "Content-Length: %d" % len(body),
+        ]
+        request.extend("%s: %s" % item for item in headers.items())
+        data = ("\r\n".join(request) + "\r\n\r\n").encode("latin-1") + body
+        async with self._slots[origin]:
+            while True:
+                # Waiting for a slot and retrying on a stale connection take time too
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                reused = bool(self._idle[origin])
+                if reused:
+                    reader, writer = self._idle[origin].pop()
+                else:
+                    reader, writer = await asyncio.wait_for(
+                        self._connect(origin),
+                        min(self.policy.connect_timeout, remaining),
+                    )
+                reusable = False
+                try:
+                    writer.write(data)
+                    await writer.drain()
+                    response, reusable = await asyncio.wait_for(
+                        self._read_response(reader),
+                        min(self.policy.read_timeout, remaining),
+                    )
+                    return response
+                except (OSError, ValueError):
+                    # The server may have closed an idle connection in the meantime
+                    if not reused:
+                        raise
+                finally:
+                    if reusable and len(self._idle[origin]) < self._pool_size:
+                        self._idle[origin].append((reader, writer))
+                    else:
+                        writer.close()
+
+    def _connect(self, origin: _Origin):
+        scheme, host, port = origin
+        if scheme == UNIX_SCHEME:
+            return asyncio.open_unix_connection(host)
+        if scheme == "https" and self._ssl_context is None:
+            # Loading the CA certificates is expensive, so do it once per connection
+            # pool, and only if it is needed at all
+            self._ssl_context = ssl.create_default_context()
+        return asyncio.open_connection(
+            host, port, ssl=self._ssl_context if scheme == "https" else None
+        )
+
+    @staticmethod
+    async def _read_response(
+        reader: asyncio.StreamReader,
+    ) -> Tuple[AsyncResponse, bool]:
+        """
+        :return: The response, and whether the connection can be used again
+        """
+        try:
+            status_line = (await reader.readline()).decode("latin-1")
+            version, status, _ = (status_line.rstrip("\r\n") + " ").split(" ", 2)
+            status_code = int(status)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            reusable = (
+                version == "HTTP/1.1"
+                and headers.get("connection", "").lower() != "close"
+            )
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int((await reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        # Discard trailers
+                        while (await reader.readline()).strip():
+                            pass
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readexactly(2)
+                content = b"".join(chunks)
+            elif "content-length" in headers:
+                content = await reader.readexactly(int(headers["content-length"]))
+            else:
+                # The body ends where the server closes the connection
+                reusable = False
+                content = await reader.read()
+        except asyncio.IncompleteReadError:
+            raise ValueError("Connection closed before the response was complete")
+        return AsyncResponse(status_code, headers, content), reusable
+
+
+class AsyncVaultRenewer:
+    """
+    The asyncio counterpart of VaultRenewer
+    """
+
+    _url: str
+    _token: str
+    _public_key: str
+    _principals: Collection[str]
+    _cert_path: Path
+    _connection: Optional[AsyncVaultConnection]
+    _signed_key: Optional[str]
+
+    def __init__(
+        self,
+        addr: ParseResult,
+        token: str,
+        sign_path: str,
+        public_key: str,
+        principals: Collection[str],
+        cert_path: Path,
+        connection: Optional[AsyncVaultConnection] = None,
+    ):
+        self._url = base_url(addr) + "/v1/" + sign_path
+        self._token = token
+        self._public_key = public_key
+        self._principals = principals
+        self._cert_path = cert_path
+        self._connection = connection
+        self._signed_key = None
+
+    @classmethod
+    def build(
+        cls,
+        addr: ParseResult,
+        token: str,
+        sign_path: str,
+        public_key: str,
+        principals: Collection[str],
+        cert_path: Path,
+        connection: Optional[AsyncVaultConnection] = None,
+    ) -> "AsyncVaultRenewer":
+        """
+        :param connection: A shared connection owned by the caller. If omitted, a new
+            connection is made for the request.
+        """
+        return cls(
+            addr, token, sign_path, public_key, principals, cert_path, connection
+        )
+
+    async def renew(self) -> "AsyncVaultRenewer":
+        if self._connection is None:
+            async with AsyncVaultConnection(1) as connection:
+                return await self._renew(connection)
+        return await self._renew(self._connection)
+
+    async def _renew(self, connection: AsyncVaultConnection) -> "AsyncVaultRenewer":
+        response = await connection.post(
+            self._url,
+            {
+                "cert_type": "host",
+                "public_key": self._public_key,
+                "valid_principals": ",".join(self._principals),
+            },
+            token_headers(self._token),
+        )
+        if response.status_code == 403:
+            raise TokenRejected("Could not renew certificate: %s" % response.text)
+        if response.status_code != 200:
+            raise VaultResponseError(
+                "Could not renew certificate: %s" % response.text, response.status_code
+            )
+        try:
+            self._signed_key = response.json()["data"]["signed_key"]
+        except (ValueError, KeyError, TypeError):
+            raise RenewError("Unexpected response from Vault: %s" % response.text)
+        return self
+
+    async def write_certificate(self) -> bool:
+        """
+        Install the new certificate in a worker thread, see VaultRenewer
+        :return: Whether the certificate file was changed
+        """
+        assert self._signed_key is not None
+        return await asyncio.get_event_loop().run_in_executor(
+            None, install_file, self._cert_path, self._signed_key.encode("utf-8")
+        )
+
+
+async def check_renewal_required(
+    key_path: Path,
+    cert_path: Path,
+    limit: Union[timedelta, RenewalPolicy],
+    cache: Optional[StatusCache] = None,
+) -> HostCertificateStatus:
+    """
+    Read and parse a certificate in a worker thread
+    :param limit: The amount of lifetime the certificate should have left, or a
+        policy deciding when the certificate is due
+    """
+
+    def _check() -> HostCertificateStatus:
+        return (
+            HostCertificate.get(key_path, cert_path, cache)
+            .read()
+            .check_renewal_required(limit)
+        )
+
+    return await asyncio.get_event_loop().run_in_executor(None, _check)
+
+
+__all__ = [
+    "AsyncResponse",
+    "AsyncVaultConnection",
+    "AsyncVaultRenewer",
+    "check_renewal_required",
+]
@@ -0,0 +1,154 @@
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import Executor
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from .cert import decode_certificate
+from .errors import RenewError
+from .policy import RenewalPolicy
+
+CERT_SUFFIX = "-cert.pub"
+
+FIELDS = [
+    "path",
+    "type",
+    "serial",
+    "key_id",
+    "principals",
+    "valid_after",
+    "valid_before",
+    "needs_renewal",
+    "error",
+]
+
+# Number of certificates handed to a worker process at once. Large enough to amortize
+# the cost of passing work between processes, small enough to keep workers busy
+CHUNK_SIZE = 256
+
+
+def find_certificates(root: str) -> Iterator[str]:
+    """
+    Walk a directory tree and yield the paths of all certificate files, without
+    collecting the listing first
+    """
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            subdirectories = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.name.endswith(CERT_SUFFIX):
+                    yield entry.path
+        pending.extend(sorted(subdirectories, reverse=True))
+
+
+def audit_certificate(
+    path: str, policy: RenewalPolicy, now: datetime
+) -> Dict[str, Any]:
+    """
+    :return: A row describing the certificate, or the error encountered reading it
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            info = decode_certificate(f.read())
+    except (OSError, UnicodeDecodeError, RenewError) as e:
+        return {"path": path, "error": str(e)}
+    return {
+        "path": path,
+        "type": info.cert_type,
+        "serial": info.serial,
+        "key_id": info.key_id,
+        "principals": list(info.principals),
+        "valid_after": info.valid_after.isoformat(),
+        "valid_before": info.valid_before.isoformat(),
+        "needs_renewal": policy.needs_renewal(info.valid_after, info.valid_before, now),
+    }
+
+
+def _audit_chunk(
+    paths: List[str], policy: RenewalPolicy, now: datetime
+) -> List[Dict[str, Any]]:
+    return [audit_certificate(path, policy, now) for path in paths]
+
+
+def audit(
+    paths: Iterable[str],
+    policy: RenewalPolicy,
+    jobs: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    now: Optional[datetime] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Decode certificates in a pool of worker processes
+    :param paths: The certificate files, consumed lazily
+    :param policy: Decides whether a certificate needs renewal
+    :param jobs: The number of worker processes, defaults to the number of CPUs
+    :param executor: Use this executor instead of creating a process pool
+    :param now: The point in time to evaluate the certificates at
+    :return: A row for each certificate, in the order of `paths`. Only a bounded
+        number of chunks is in flight at any time, so memory use does not grow with
+        the number of certificates.
+    """
+    now = now or datetime.now(timezone.utc)
+    jobs = jobs or os.cpu_count() or 1
+    owned = executor is None
+    if owned:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        paths = iter(paths)
+        in_flight = deque()
+        while True:
+            while len(in_flight) < 2 * jobs:
+                chunk = list(islice(paths, CHUNK_SIZE))
+                if not chunk:
+                    break
+                in_flight.append(executor.submit(_audit_chunk, chunk, policy, now))
+            if not in_flight:
+                return
+            yield from in_flight.popleft().result()
+    finally:
+        if owned:
+            executor.shutdown()
+
+
+class JSONLinesWriter:
+    def __init__(self, output: TextIO):
+        self._output = output
+
+    def write(self, row: Dict[str, Any]):
+        self._output.write(json.dumps(row, sort_keys=True) + "\n")
+
+
+class CSVWriter:
+    def __init__(self, output: TextIO):
+        self._writer = csv.DictWriter(output, FIELDS)
+        self._writer.writeheader()
+
+    def write(self, row: Dict[str, Any]):
+        if "principals" in row:
+            row = dict(row, principals=",".join(row["principals"]))
+        self._writer.writerow(row)
+
+
+WRITERS = {"json": JSONLinesWriter, "csv": CSVWriter}
+
+__all__ = [
+    "CSVWriter",
+    "JSONLinesWriter",
+    "WRITERS",
+    "audit",
+    "audit_certificate",
+    "find_certificates",
+]
@@ -0,0 +1,457 @@
+import abc
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, TypeVar
+
+from .errors import RenewError, TokenRejected
+from .metrics import METRICS
+from .tracing import TRACER
+from .util import base_url, write_json_atomic
+
+if TYPE_CHECKING:
+    from .vault import VaultConnection
+
+T = TypeVar("T")
+
+AUTH_METHODS = ("token", "approle", "kubernetes")
+
+DEFAULT_KUBERNETES_JWT_PATH = "/var/run/secrets/kubernetes.io/serviceaccount/token"
+
+TOKEN_CACHE_FILE = "vault-token.json"
+
+# A token is renewed once less than this fraction of its lease is left, like the
+# Vault agent does
+RENEW_FRACTION = 1 / 3
+
+# A token that expires within this many seconds is not used for another request
+EXPIRY_MARGIN = 30.0
+
+
+class CachedToken:
+    """
+    A token obtained by logging in, with the lease it was issued with
+    """
+
+    token: str
+    lease_duration: int
+    renewable: bool
+    issued_at: float
+
+    def __init__(
+        self, token: str, lease_duration: int, renewable: bool, issued_at: float
+    ):
+        self.token = token
+        self.lease_duration = lease_duration
+        self.renewable = renewable
+        self.issued_at = issued_at
+
+    @classmethod
+    def from_auth(cls, auth: Dict[str, Any], now: float) -> "CachedToken":
+        """
+        :param auth: The auth section of a login or renew-self response
+        """
+        return cls(
+            auth["client_token"],
+            int(auth.get("lease_duration") or 0),
+            bool(auth.get("renewable")),
+            now,
+        )
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        """
+        :return: The point in time at which the token expires, or None if it does not
+        """
+        if not self.lease_duration:
+            return None
+        return self.issued_at + self.lease_duration
+
+    def usable(self, now: float) -> bool:
+        expires_at = self.expires_at
+        return expires_at is None or expires_at - now > EXPIRY_MARGIN
+
+    def renewal_due(self, now: float) -> bool:
+        expires_at = self.expires_at
+        return (
+            expires_at is not None
+            and expires_at - now < self.lease_duration * RENEW_FRACTION
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "token": self.token,
+            "lease_duration": self.lease_duration,
+            "renewable": self.renewable,
+            "issued_at": self.issued_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CachedToken":
+        return cls(
+            str(data["token"]),
+            int(data["lease_duration"]),
+            bool(data["renewable"]),
+            float(data["issued_at"]),
+        )
+
+
+class TokenCache:
+    """
+    Keeps the token of a login on disk, so that later runs can reuse it instead of
+    logging in again. The file is only readable by its owner, and a file that others
+    can read or that belongs to somebody else is ignored. Each entry is bound to the
+    Vault address and login it was obtained with.
+    """
+
+    _path: Path
+
+    def __init__(self, path: Path):
+        self._path = Path(str(path))
+
+    @classmethod
+    def from_config(cls, config) -> Optional["TokenCache"]:
+        if config.token_cache:
+            return cls(config.token_cache)
+        if config.cache_dir:
+            return cls(Path(config.cache_dir) / TOKEN_CACHE_FILE)
+        return None
+
+    def load(self, key: str) -> Optional[CachedToken]:
+        try:
+            with self._path.open("r", encoding="utf-8") as f:
+                st = os.fstat(f.fileno())
+                if st.st_mode & 0o077 or st.st_uid != os.getuid():
+                    return None
+                entry = json.load(f)
+            if entry["key"] != key:
+                return None
+            return CachedToken.from_dict(entry["token"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def store(self, key: str, token: CachedToken):
+        # Without the file, the next run logs in again
+        try:
+            write_json_atomic(self._path, {"key": key, "token": token.to_dict()}, 0o700)
+        except OSError:
+            pass
+
+    def clear(self):
+        try:
+            self._path.unlink()
+        except OSError:
+            pass
+
+
+class LoginMethod(abc.ABC):
+    """
+    A Vault auth method that logs in with credentials available on the host
+    """
+
+    name: str
+    mount: str
+
+    @abc.abstractmethod
+    def payload(self) -> Dict[str, str]:
+        ...
+
+    @property
+    @abc.abstractmethod
+    def identity(self) -> str:
+        """
+        What the login identifies as, to tell apart cached tokens of different logins
+        """
+
+    @property
+    def path(self) -> str:
+        return "auth/%s/login" % self.mount.strip("/")
+
+
+class AppRoleLogin(LoginMethod):
+    name = "approle"
+
+    def __init__(
+        self,
+        role_id: str,
+        secret_id_file: Optional[Path] = None,
+        mount: Optional[str] = None,
+    ):
+        """
+        :param secret_id_file: The file to read the secret ID from, if the role
+            requires one
+        """
+        self._role_id = role_id
+        self._secret_id_file = secret_id_file
+        self.mount = mount or self.name
+
+    def payload(self) -> Dict[str, str]:
+        payload = {"role_id": self._role_id}
+        if self._secret_id_file is not None:
+            payload["secret_id"] = _read_secret(self._secret_id_file)
+        return payload
+
+    @property
+    def identity(self) -> str:
+        return self._role_id
+
+
+class KubernetesLogin(LoginMethod):
+    name = "kubernetes"
+
+    def __init__(
+        self,
+        role: str,
+        jwt_path: Path = Path(DEFAULT_KUBERNETES_JWT_PATH),
+        mount: Optional[str] = None,
+    ):
+        self._role = role
+        self._jwt_path = jwt_path
+        self.mount = mount or self.name
+
+    def payload(self) -> Dict[str, str]:
+        # Projected service account tokens are rotated, so read it on every login
+        return {"role": self._role, "jwt": _read_secret(self._jwt_path)}
+
+    @property
+    def identity(self) -> str:
+        return self._role
+
+
+def _read_secret(path: Path) -> str:
+    with TRACER.span("token.read", path=str(path)):
+        try:
+            with open(str(path), "r") as f:
+                return f.readline().strip()
+        except OSError as e:
+            raise RenewError("Could not read %s: %s" % (path, e))
+
+
+def token_headers(token: str) -> Dict[str, str]:
+    """
+    :return: The headers authenticating a request with a token. Without a token, the
+        header is left out, so that a Vault Agent in between can add its own.
+    """
+    return {"X-Vault-Token": token} if token else {}
+
+
+class TokenSource(abc.ABC):
+    """
+    Provides the token to authenticate requests to Vault with
+    """
+
+    @abc.abstractmethod
+    def get(self, connection: Optional["VaultConnection"]) -> str:
+        """
+        :param connection: The connection to use for requests to Vault. If omitted, a
+            new connection is made if needed.
+        :raises RenewError: If no token could be obtained
+        """
+
+    @abc.abstractmethod
+    def invalidate(self, token: str) -> bool:
+        """
+        Forget a token that Vault rejected
+        :return: Whether another token can be obtained
+        """
+
+    def call(
+        self, connection: Optional["VaultConnection"], request: Callable[[str], T]
+    ) -> T:
+        """
+        Make a request with the current token. If Vault rejects the token and another
+        one can be obtained, the request is made once more with the new token.
+        """
+        token = self.get(connection)
+        try:
+            return request(token)
+        except TokenRejected:
+            if not self.invalidate(token):
+                raise
+        return request(self.get(connection))
+
+    @classmethod
+    def from_config(cls, config) -> "TokenSource":
+        if config.use_agent_token:
+            return AgentToken()
+        method: Optional[LoginMethod] = None
+        if config.auth_method == "approle":
+            if not config.approle_role_id:
+                raise RenewError("AppRole login requires a role ID")
+            method = AppRoleLogin(
+                config.approle_role_id,
+                config.approle_secret_id_file,
+                config.auth_mount,
+            )
+        elif config.auth_method == "kubernetes":
+            if not config.kubernetes_role:
+                raise RenewError("Kubernetes login requires a role")
+            method = KubernetesLogin(
+                config.kubernetes_role,
+                Path(config.kubernetes_jwt_path),
+                config.auth_mount,
+            )
+        if method is None:
+            return StaticToken(config.token)
+        return VaultLogin(base_url(config.addr), method, TokenCache.from_config(config))
+
+
+class StaticToken(TokenSource):
+    """
+    A token given in the configuration
+    """
+
+    def __init__(self, token: Optional[str]):
+        self._token = token
+
+    def get(self, connection: Optional["VaultConnection"]) -> str:
+        if not self._token:
+            raise RenewError("No Vault token given")
+        return self._token
+
+    def invalidate(self, token: str) -> bool:
+        return False
+
+
+class AgentToken(TokenSource):
+    """
+    No token at all, for requests sent through a Vault Agent that authenticates them
+    with the token of its auto-auth
+    """
+
+    def get(self, connection: Optional["VaultConnection"]) -> str:
+        return ""
+
+    def invalidate(self, token: str) -> bool:
+        return False
+
+
+class VaultLogin(TokenSource):
+    """
+    Logs in to Vault with an auth method and keeps the resulting token for as long as
+    it is valid, in memory and in an optional token cache. Once less than a third of
+    its lease is left, the token is renewed through renew-self. A new login only
+    happens when there is no usable token, or when Vault rejects or refuses to renew
+    the token.
+    """
+
+    _addr: str
+    _method: LoginMethod
+    _cache: Optional[TokenCache]
+    _token: Optional[CachedToken]
+
+    def __init__(
+        self, addr: str, method: LoginMethod, cache: Optional[TokenCache] = None
+    ):
+        self._addr = addr
+        self._method = method
+        self._cache = cache
+        self._key = "%s %s %s" % (addr, method.mount, method.identity)
+        self._token = None
+        self._lock = threading.Lock()
+
+    def get(self, connection: Optional["VaultConnection"]) -> str:
+        with self._lock:
+            now = time.time()
+            token = self._token
+            if token is None and self._cache is not None:
+                token = self._cache.load(self._key)
+            if token is not None and token.usable(now):
+                if not token.renewal_due(now):
+                    METRICS.inc("vault_ssh_renew_vault_tokens_total", outcome="cached")
+                    self._token = token
+                    return token.token
+                if token.renewable:
+                    renewed = self._renew(connection, token)
+                    if renewed is not None:
+                        return renewed.token
+            return self._login(connection).token
+
+    def invalidate(self, token: str) -> bool:
+        with self._lock:
+            if self._token is not None and self._token.token == token:
+                self._token = None
+                if self._cache is not None:
+                    self._cache.clear()
+        return True
+
+    def _remember(self, token: CachedToken):
+        self._token = token
+        if self._cache is not None:
+            self._cache.store(self._key, token)
+
+    @staticmethod
+    def _post(
+        connection: Optional["VaultConnection"],
+        url: str,
+        payload: Any,
+        headers: Dict[str, str],
+    ):
+        if connection is None:
+            from .vault import VaultConnection
+
+            with VaultConnection() as connection:
+                return connection.post(url, payload, headers)
+        return connection.post(url, payload, headers)
+
+    def _login(self, connection: Optional["VaultConnection"]) -> CachedToken:
+        url = "%s/v1/%s" % (self._addr, self._method.path)
+        with TRACER.span("vault.login", method=self._method.name):
+            response = self._post(connection, url, self._method.payload(), {})
+            if response.status_code != 200:
+                METRICS.inc("vault_ssh_renew_vault_tokens_total", outcome="failed")
+                raise RenewError("Could not log in to Vault: %s" % response.text)
+            try:
+                token = CachedToken.from_auth(response.json()["auth"], time.time())
+            except (ValueError, KeyError, TypeError):
+                raise RenewError("Unexpected response from Vault: %s" % response.text)
+        METRICS.inc("vault_ssh_renew_vault_tokens_total", outcome="login")
+        self._remember(token)
+        return token
+
+    def _renew(
+        self, connection: Optional["VaultConnection"], token: CachedToken
+    ) -> Optional[CachedToken]:
+        """
+        :return: The renewed token, or None if it could not be renewed
+        """
+        url = "%s/v1/auth/token/renew-self" % self._addr
+        with TRACER.span("vault.renew_token") as span:
+            try:
+                response = self._post(
+                    connection, url, {}, {"X-Vault-Token": token.token}
+                )
+            except RenewError:
+                response = None
+            span.set_attribute(
+                "status_code", response.status_code if response is not None else None
+            )
+            if response is None or response.status_code != 200:
+                return None
+            try:
+                auth = response.json()["auth"]
+                # renew-self does not repeat the token
+                auth.setdefault("client_token", token.token)
+                renewed = CachedToken.from_auth(auth, time.time())
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return None
+        METRICS.inc("vault_ssh_renew_vault_tokens_total", outcome="renewed")
+        self._remember(renewed)
+        return renewed
+
+
+__all__ = [
+    "AUTH_METHODS",
+    "AgentToken",
+    "AppRoleLogin",
+    "CachedToken",
+    "KubernetesLogin",
+    "LoginMethod",
+    "StaticToken",
+    "TokenCache",
+    "TokenSource",
+    "VaultLogin",
+    "token_headers",
+]
@@ -0,0 +1,82 @@
+import enum
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, List, NamedTuple, Tuple
+
+from .tracing import TRACER
+
+HOST_KEY_GLOB = "ssh_host_*_key.pub"
+
+
+class KeyPair(NamedTuple):
+    key_path: Path
+    cert_path: Path
+
+
+class RenewOutcome(enum.Enum):
+    NOT_REQUIRED = "not required"
+    RENEWED = "renewed"
+    FAILED = "failed"
+
+
+def cert_path_for(key_path: Path) -> Path:
+    """
+    Derive the conventional certificate location for a public key, i.e.
+    /etc/ssh/ssh_host_rsa_key.pub becomes /etc/ssh/ssh_host_rsa_key-cert.pub
+    """
+    name = key_path.name
+    if name.endswith(".pub"):
+        name = name[: -len(".pub")]
+    return key_path.with_name(name + "-cert.pub")
+
+
+def discover_host_keys(directory: Path) -> List[KeyPair]:
+    """
+    Find all SSH host public keys in a directory
+    :param directory: The directory to search, usually /etc/ssh
+    :return: The key/certificate pairs, sorted by key path
+    """
+    return [
+        KeyPair(key_path, cert_path_for(key_path))
+        for key_path in sorted(Path(str(directory)).glob(HOST_KEY_GLOB))
+    ]
+
+
+def resolve_key_pairs(config) -> List[KeyPair]:
+    """
+    Determine the key/certificate pairs to process for a configuration. Explicitly
+    specified pairs take precedence over discovery, which in turn takes precedence
+    over the single key/certificate pair given as arguments.
+    """
+    if config.host_key_pairs:
+        return [KeyPair(Path(key), Path(cert)) for key, cert in config.host_key_pairs]
+    if config.all_host_keys:
+        return discover_host_keys(Path(str(config.ssh_host_key_path)).parent)
+    return [KeyPair(config.ssh_host_key_path, config.ssh_host_cert_path)]
+
+
+def run_batch(
+    func: Callable[[KeyPair], RenewOutcome], pairs: Iterable[KeyPair], concurrency: int
+) -> List[Tuple[KeyPair, RenewOutcome]]:
+    """
+    Process a number of key pairs using a shared pool of worker threads
+    :param func: Invoked for every key pair, must not raise
+    :param pairs: The key pairs to process
+    :param concurrency: The maximum number of key pairs processed at the same time
+    :return: The outcome for each key pair, in the order they were supplied
+    """
+    pairs = list(pairs)
+    if len(pairs) <= 1 or concurrency <= 1:
+        return [(pair, func(pair)) for pair in pairs]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(pairs))) as pool:
+        return list(zip(pairs, pool.map(TRACER.wrap(func), pairs)))
+
+
+__all__ = [
+    "KeyPair",
+    "RenewOutcome",
+    "cert_path_for",
+    "discover_host_keys",
+    "resolve_key_pairs",
+    "run_batch",
+]
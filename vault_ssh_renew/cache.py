@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .util import write_json_atomic
+
+StatKey = List[int]
+
+
+def stat_key(path: Path) -> Optional[StatKey]:
+    """
+    Identify a particular version of a file. Replacing the file (e.g. through an atomic
+    rename) or modifying it in place changes the result.
+    :return: The inode, size and modification time of the file, or None if it does not exist
+    """
+    try:
+        st = os.stat(str(path))
+    except FileNotFoundError:
+        return None
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+class StatusCache:
+    """
+    Remembers the decoded fields of certificates, keyed by the stat information of the
+    certificate and its public key, so that unchanged certificates do not need to be
+    read and parsed again.
+    """
+
+    _directory: Path
+
+    def __init__(self, directory: Path):
+        self._directory = Path(str(directory))
+
+    @classmethod
+    def from_config(cls, config) -> Optional["StatusCache"]:
+        return cls(config.cache_dir) if config.cache_dir else None
+
+    def _entry_path(self, cert_path: Path) -> Path:
+        name = os.path.abspath(str(cert_path))
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:12]
+        return self._directory / ("%s-%s.status" % (os.path.basename(name), digest))
+
+    def lookup(
+        self, key_path: Path, cert_path: Path, key_stat: StatKey, cert_stat: StatKey
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Find the fields of an unchanged certificate
+        :return: The fields as stored, or None if the certificate is not cached or has
+            changed
+        """
+        try:
+            with self._entry_path(cert_path).open("r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if (
+                entry["key_path"] != os.path.abspath(str(key_path))
+                or entry["key"] != key_stat
+                or entry["cert"] != cert_stat
+            ):
+                return None
+            return entry["info"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def store(
+        self,
+        key_path: Path,
+        cert_path: Path,
+        key_stat: StatKey,
+        cert_stat: StatKey,
+        info: Dict[str, Any],
+    ):
+        """
+        :param info: The fields of the certificate, as JSON serializable values
+        """
+        entry = {
+            "key_path": os.path.abspath(str(key_path)),
+            "key": key_stat,
+            "cert": cert_stat,
+            "info": info,
+        }
+        # The cache is an optimisation only, failing to write it is not an error
+        try:
+            write_json_atomic(self._entry_path(cert_path), entry)
+        except OSError:
+            pass
+
+
+__all__ = ["StatusCache", "stat_key"]
@@ -1,12 +1,18 @@
 import abc
-import base64
+import binascii
 from datetime import timedelta, datetime, timezone
 from pathlib import Path
-from typing import Optional, cast, Tuple, Dict, Type
-
-from paramiko import Message
+from typing import Any, Optional, cast, Tuple, Dict, Type, Union
 
+from .cache import StatusCache, stat_key
 from .errors import RenewError
+from .policy import RenewalPolicy
+from .tracing import TRACER
+from .wire import WireReader
+
+# valid_before is commonly set to the maximum uint64 to mark certificates that
+# never expire, which is beyond what datetime can represent.
+_FOREVER = datetime.max.replace(tzinfo=timezone.utc)
 
 
 class HostCertificateInit(abc.ABC):
@@ -21,10 +27,13 @@ class HostCertificateInit(abc.ABC):
 
 class HostCertificateValidate(abc.ABC):
     @abc.abstractmethod
-    def check_renewal_required(self, limit: timedelta) -> "HostCertificateStatus":
+    def check_renewal_required(
+        self, limit: Union[timedelta, RenewalPolicy]
+    ) -> "HostCertificateStatus":
         """
         Parse the certificate to find out whether it needs to be renewed
-        :param limit: The amount of lifetime the certificate should have left
+        :param limit: The amount of lifetime the certificate should have left, or a
+            policy deciding when the certificate is due
         :return:
         """
         ...
@@ -32,50 +41,175 @@ class HostCertificateValidate(abc.ABC):
 
 class HostCertificateStatus:
     needs_renewal: bool
-
-    def __init__(self, parent: "HostCertificate", needs_renewal: bool):
+    not_before: Optional[datetime]
+    not_after: Optional[datetime]
+    renew_at: Optional[datetime]
+    key_mismatch: bool
+    principals_mismatch: bool
+    info: Optional["CertificateInfo"]
+
+    def __init__(
+        self,
+        parent: "HostCertificate",
+        needs_renewal: bool,
+        not_before: Optional[datetime] = None,
+        not_after: Optional[datetime] = None,
+        renew_at: Optional[datetime] = None,
+        key_mismatch: bool = False,
+        principals_mismatch: bool = False,
+        info: Optional["CertificateInfo"] = None,
+    ):
         self._parent = parent
         self.needs_renewal = needs_renewal
+        self.not_before = not_before
+        self.not_after = not_after
+        self.renew_at = renew_at
+        self.key_mismatch = key_mismatch
+        self.principals_mismatch = principals_mismatch
+        self.info = info
+
+    @classmethod
+    def evaluate(
+        cls,
+        parent: "HostCertificate",
+        limit: Union[timedelta, RenewalPolicy],
+        info: "CertificateInfo",
+        key_mismatch: bool = False,
+    ) -> "HostCertificateStatus":
+        """
+        :param info: The decoded certificate
+        :param key_mismatch: Whether the certificate was issued for a different key than
+            the current host key, in which case it is renewed regardless of its validity
+        """
+        policy = RenewalPolicy.coerce(limit)
+        now = datetime.now(timezone.utc)
+        not_before, not_after = info.valid_after, info.valid_before
+        principals_mismatch = policy.principals_differ(info.principals)
+        return cls(
+            parent,
+            key_mismatch
+            or principals_mismatch
+            or policy.needs_renewal(not_before, not_after, now),
+            not_before,
+            not_after,
+            policy.renew_at(not_before, not_after),
+            key_mismatch,
+            principals_mismatch,
+            info,
+        )
 
     @property
     def public_key(self) -> str:
-        return self._parent.public_key
+        return self._parent.get_public_key()
 
 
 class HostCertificate:
 
     _key_path: Path
     _cert_path: Path
+    _cache: Optional[StatusCache]
     public_key: Optional[str]
     cert_type: Optional[str]
-    cert_data: Optional[Message]
+    cert_data: Optional[WireReader]
 
-    def __init__(self, key_path: Path, cert_path: Path):
+    def __init__(
+        self, key_path: Path, cert_path: Path, cache: Optional[StatusCache] = None
+    ):
         self._key_path = key_path
         self._cert_path = cert_path
+        self._cache = cache
+        self._key_stat = None
+        self._cert_stat = None
         self.public_key = None
 
     @classmethod
-    def get(cls, key_path: Path, cert_path: Path) -> HostCertificateInit:
-        return cast(HostCertificateInit, cls(key_path, cert_path))
+    def get(
+        cls, key_path: Path, cert_path: Path, cache: Optional[StatusCache] = None
+    ) -> HostCertificateInit:
+        return cast(HostCertificateInit, cls(key_path, cert_path, cache))
 
     def read(self) -> HostCertificateValidate:
+        with TRACER.span("cert.read", cert=str(self._cert_path)) as span:
+            validate = self._read()
+            span.set_attribute(
+                "cached", isinstance(validate, CachedHostCertificateValidate)
+            )
+        return validate
+
+    def _read(self) -> HostCertificateValidate:
+        if self._cache is not None:
+            self._key_stat = stat_key(self._key_path)
+            self._cert_stat = stat_key(self._cert_path)
+            if self._key_stat is not None and self._cert_stat is not None:
+                cached = self._cache.lookup(
+                    self._key_path, self._cert_path, self._key_stat, self._cert_stat
+                )
+                info = CertificateInfo.from_dict(cached) if cached else None
+                if info is not None:
+                    self.cert_type = info.cert_type
+                    return CachedHostCertificateValidate(self, info)
         self.public_key = self._key_path.read_text(encoding="utf-8")
         if not self._cert_path.exists():
             return HostCertificateStatusNoCert(self, True)
-        certificate_contents = self._cert_path.read_text(encoding="utf-8").split(" ")
-        if len(certificate_contents) != 2:
-            raise RenewError("Invalid certificate file")
-        self.cert_type = certificate_contents[0]
-        self.cert_data = Message(base64.b64decode(certificate_contents[1]))
+        self.cert_type, self.cert_data = split_certificate(
+            self._cert_path.read_text(encoding="utf-8")
+        )
         return SomeHostCertificateValidate.factor(self)
 
+    def get_public_key(self) -> str:
+        if self.public_key is None:
+            self.public_key = self._key_path.read_text(encoding="utf-8")
+        return self.public_key
+
+    def matches_key(self, key_fields: memoryview) -> bool:
+        """
+        Compare the public key embedded in the certificate to the host key
+        :param key_fields: The type specific public key fields of the certificate
+        """
+        fields = self.get_public_key().split()
+        if len(fields) < 2:
+            raise RenewError("Invalid public key file")
+        try:
+            blob = binascii.a2b_base64(fields[1])
+        except binascii.Error:
+            raise RenewError("Invalid public key encoding")
+        key = WireReader(blob)
+        key.skip_string()  # key type
+        return blob[key.offset :] == key_fields
+
+    def remember(self, info: "CertificateInfo"):
+        """
+        Record the decoded certificate in the status cache, if any
+        """
+        if self._cache is None or self._key_stat is None or self._cert_stat is None:
+            return
+        self._cache.store(
+            self._key_path,
+            self._cert_path,
+            self._key_stat,
+            self._cert_stat,
+            info.to_dict(),
+        )
+
 
 class HostCertificateStatusNoCert(HostCertificateStatus, HostCertificateValidate):
-    def check_renewal_required(self, limit: timedelta) -> "HostCertificateStatus":
+    def check_renewal_required(
+        self, limit: Union[timedelta, RenewalPolicy]
+    ) -> "HostCertificateStatus":
         return self
 
 
+class CachedHostCertificateValidate(HostCertificateValidate):
+    def __init__(self, parent: HostCertificate, info: "CertificateInfo"):
+        self._parent = parent
+        self._info = info
+
+    def check_renewal_required(
+        self, limit: Union[timedelta, RenewalPolicy]
+    ) -> "HostCertificateStatus":
+        return HostCertificateStatus.evaluate(self._parent, limit, self._info)
+
+
 CERT_TYPE_MAP: Dict[str, Type["SomeHostCertificateValidate"]] = {}
 
 
@@ -95,41 +229,166 @@ def register_for(*cert_types: str):
     return _register
 
 
+class CertificateInfo:
+    """
+    The fields of a certificate that matter for deciding about its renewal
+    """
+
+    __slots__ = (
+        "cert_type",
+        "serial",
+        "key_id",
+        "principals",
+        "valid_after",
+        "valid_before",
+    )
+
+    cert_type: str
+    serial: int
+    key_id: str
+    principals: Tuple[str, ...]
+    valid_after: datetime
+    valid_before: datetime
+
+    def __init__(
+        self,
+        cert_type: str,
+        serial: int,
+        key_id: str,
+        principals: Tuple[str, ...],
+        valid_after: datetime,
+        valid_before: datetime,
+    ):
+        self.cert_type = cert_type
+        self.serial = serial
+        self.key_id = key_id
+        self.principals = principals
+        self.valid_after = valid_after
+        self.valid_before = valid_before
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "cert_type": self.cert_type,
+            "serial": self.serial,
+            "key_id": self.key_id,
+            "principals": list(self.principals),
+            "valid_after": self.valid_after.timestamp(),
+            "valid_before": self.valid_before.timestamp(),
+        }
+
+    @classmethod
+    def from_dict(cls, fields: Dict[str, Any]) -> Optional["CertificateInfo"]:
+        """
+        :return: The certificate described by the output of to_dict, or None if the
+            fields are invalid
+        """
+        try:
+            return cls(
+                fields["cert_type"],
+                fields["serial"],
+                fields["key_id"],
+                tuple(fields["principals"]),
+                SomeHostCertificateValidate._as_datetime(fields["valid_after"]),
+                SomeHostCertificateValidate._as_datetime(fields["valid_before"]),
+            )
+        except (KeyError, TypeError):
+            return None
+
+
+def split_certificate(contents: str) -> Tuple[str, WireReader]:
+    """
+    Split the contents of a certificate file into the certificate type and the
+    decoded certificate. A trailing comment, as written by ssh-keygen, is ignored.
+    """
+    fields = contents.split()
+    if len(fields) not in (2, 3):
+        raise RenewError("Invalid certificate file")
+    if fields[0] not in CERT_TYPE_MAP:
+        raise RenewError("Unsupported certificate type %s" % fields[0])
+    try:
+        return fields[0], WireReader(binascii.a2b_base64(fields[1]))
+    except binascii.Error:
+        raise RenewError("Invalid certificate encoding")
+
+
+def decode_certificate(contents: str) -> CertificateInfo:
+    """
+    Decode the contents of a certificate file without reference to a host key
+    """
+    cert_type, msg = split_certificate(contents)
+    if msg.get_text() != cert_type:
+        raise RenewError("Certificate type mismatch in certificate")
+    return CERT_TYPE_MAP[cert_type](None).get_info(msg, cert_type)
+
+
 class SomeHostCertificateValidate(HostCertificateValidate, abc.ABC):
-    def __init__(self, parent: HostCertificate):
+    key_fields: Optional[memoryview]
+
+    def __init__(self, parent: Optional[HostCertificate]):
         self._parent = parent
+        self.key_fields = None
 
     @classmethod
     def factor(cls, parent: HostCertificate) -> "SomeHostCertificateValidate":
         return CERT_TYPE_MAP[parent.cert_type](parent)
 
     @abc.abstractmethod
-    def get_limits(self, msg: Message) -> Tuple[datetime, datetime]:
+    def skip_public_key(self, msg: WireReader):
         """
-        Implemented by subclasses. Receives the cert message with the initial field consumed
-        :return: The not before and not after timestamps of the message (as aware datetimes)
+        Implemented by subclasses. Skips over the type specific public key fields
+        :param msg: The certificate reader, positioned after the nonce
         """
         ...
 
-    @staticmethod
-    def _as_datetime_tuple(a: int, b: int) -> Tuple[datetime, datetime]:
-        return (
-            datetime.fromtimestamp(a, timezone.utc),
-            datetime.fromtimestamp(b, timezone.utc),
+    def get_info(self, msg: WireReader, cert_type: str) -> CertificateInfo:
+        """
+        Receives the cert message with the initial field consumed and reads as far as
+        the validity interval. Extensions, options and the signature are not decoded.
+        :return: The fields of the certificate, with the timestamps as aware datetimes
+        """
+        msg.skip_string()  # nonce
+        start = msg.offset
+        self.skip_public_key(msg)
+        self.key_fields = msg.since(start)
+        serial = msg.get_uint64()
+        msg.skip(4)  # type
+        key_id = msg.get_text()
+        packed = WireReader(msg.get_string())
+        principals = []
+        while packed.remaining:
+            principals.append(packed.get_text())
+        not_before, not_after = self._as_datetime_tuple(
+            msg.get_uint64(), msg.get_uint64()
+        )
+        return CertificateInfo(
+            cert_type, serial, key_id, tuple(principals), not_before, not_after
         )
 
-    def check_renewal_required(self, limit: timedelta) -> "HostCertificateStatus":
-        cert = self._parent.cert_data
-        embedded_type = cert.get_string().decode("ascii")
-        if embedded_type != self._parent.cert_type:
-            raise RenewError("Certificate type mismatch in certificate")
+    @staticmethod
+    def _as_datetime(value: float) -> datetime:
+        try:
+            return datetime.fromtimestamp(value, timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return _FOREVER
 
-        not_before, not_after = self.get_limits(cert)
-        print(not_after)
-        now = datetime.now(timezone.utc)
-        return HostCertificateStatus(
-            self._parent, now < not_before or (not_after - now) <= limit
-        )
+    @classmethod
+    def _as_datetime_tuple(cls, a: int, b: int) -> Tuple[datetime, datetime]:
+        return cls._as_datetime(a), cls._as_datetime(b)
+
+    def check_renewal_required(
+        self, limit: Union[timedelta, RenewalPolicy]
+    ) -> "HostCertificateStatus":
+        with TRACER.span("cert.parse", type=self._parent.cert_type):
+            cert = self._parent.cert_data
+            embedded_type = cert.get_text()
+            if embedded_type != self._parent.cert_type:
+                raise RenewError("Certificate type mismatch in certificate")
+
+            info = self.get_info(cert, embedded_type)
+            key_mismatch = not self._parent.matches_key(self.key_fields)
+        if not key_mismatch:
+            self._parent.remember(info)
+        return HostCertificateStatus.evaluate(self._parent, limit, info, key_mismatch)
 
 
 # What follows are decoding classes for the SSH certificates according to
@@ -138,30 +397,14 @@ class SomeHostCertificateValidate(HostCertificateValidate, abc.ABC):
 
 @register_for("ssh-rsa-cert-v01@openssh.com")
 class RSACertificateValidate(SomeHostCertificateValidate):
-    def get_limits(self, msg: Message) -> Tuple[datetime, datetime]:
-        _nonce = msg.get_string()
-        _e = msg.get_mpint()
-        _n = msg.get_mpint()
-        _serial = msg.get_int64()
-        _key_type = msg.get_int()
-        _key_id = msg.get_string()
-        _principals = msg.get_list()
-        return self._as_datetime_tuple(msg.get_int64(), msg.get_int64())
+    def skip_public_key(self, msg: WireReader):
+        msg.skip_string(2)  # e, n
 
 
 @register_for("ssh-dss-cert-v01@openssh.com")
 class DSACertificateValidate(SomeHostCertificateValidate):
-    def get_limits(self, msg: Message) -> Tuple[datetime, datetime]:
-        _nonce = msg.get_string()
-        _p = msg.get_mpint()
-        _q = msg.get_mpint()
-        _g = msg.get_mpint()
-        _y = msg.get_mpint()
-        _serial = msg.get_int64()
-        _key_type = msg.get_int()
-        _key_id = msg.get_string()
-        _principals = msg.get_list()
-        return self._as_datetime_tuple(msg.get_int64(), msg.get_int64())
+    def skip_public_key(self, msg: WireReader):
+        msg.skip_string(4)  # p, q, g, y
 
 
 @register_for(
@@ -170,27 +413,19 @@ class DSACertificateValidate(SomeHostCertificateValidate):
     "ecdsa-sha2-nistp521-cert-v01@openssh.com",
 )
 class ECDSACertificateValidate(SomeHostCertificateValidate):
-    def get_limits(self, msg: Message) -> Tuple[datetime, datetime]:
-        _nonce = msg.get_string()
-        _curve = msg.get_string()
-        _public_key = msg.get_string()
-        _serial = msg.get_int64()
-        _key_type = msg.get_int()
-        _key_id = msg.get_string()
-        _principals = msg.get_list()
-        return self._as_datetime_tuple(msg.get_int64(), msg.get_int64())
+    def skip_public_key(self, msg: WireReader):
+        msg.skip_string(2)  # curve, public key
 
 
 @register_for("ssh-ed25519-cert-v01@openssh.com")
 class Ed25519CertificateValidate(SomeHostCertificateValidate):
-    def get_limits(self, msg: Message) -> Tuple[datetime, datetime]:
-        _nonce = msg.get_string()
-        _pk = msg.get_string()
-        _serial = msg.get_int64()
-        _key_type = msg.get_int()
-        _key_id = msg.get_string()
-        _principals = msg.get_list()
-        return self._as_datetime_tuple(msg.get_int64(), msg.get_int64())
+    def skip_public_key(self, msg: WireReader):
+        msg.skip_string()  # pk
 
 
-__all__ = ["HostCertificate"]
+__all__ = [
+    "CertificateInfo",
+    "HostCertificate",
+    "decode_certificate",
+    "split_certificate",
+]
@@ -1,21 +1,302 @@
-import socket
-from datetime import timedelta
-import os
+import signal
+import sys
+import threading
+import time
 import traceback
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from urllib.parse import urlparse
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
 
 import click
 
+from vault_ssh_renew.auth import AUTH_METHODS, DEFAULT_KUBERNETES_JWT_PATH, TokenSource
+from vault_ssh_renew.batch import KeyPair, RenewOutcome, resolve_key_pairs, run_batch
+from vault_ssh_renew.cache import StatusCache
 from vault_ssh_renew.config import Config
-from vault_ssh_renew.errors import RenewError
-from vault_ssh_renew.cert import HostCertificate
-from vault_ssh_renew.util import URLParameterType
-from vault_ssh_renew.vault import VaultRenewer
+from vault_ssh_renew.errors import RenewError, VaultResponseError
+from vault_ssh_renew.hooks import HookEvent, HookRunner
+from vault_ssh_renew.ledger import RenewalLedger
+from vault_ssh_renew.lock import CertificateLock
+from vault_ssh_renew.metrics import METRICS, parse_listen_address, write_textfile
+from vault_ssh_renew.policy import LifetimeFractionPolicy, RenewalPolicy
+from vault_ssh_renew.principals import (
+    DEFAULT_METADATA_PATH,
+    PRINCIPAL_SOURCES,
+    PrincipalResolver,
+)
+from vault_ssh_renew.cert import HostCertificate, HostCertificateStatus
+from vault_ssh_renew.tracing import TRACER
+from vault_ssh_renew.util import FractionParameterType, URLListParameterType
+
+# Most runs find that no certificate is due, so modules that are only needed for
+# renewing (requests in particular) or for other modes are imported where they are
+# used. tests/test_startup.py checks that they stay out of the common path.
+if TYPE_CHECKING:
+    from vault_ssh_renew.vault import VaultConnection, VaultRenewDone
 
 DEFAULT_VAULT_ADDR = "http://127.0.0.1:8200"
 
 
+def configure_tracing(_ctx, _param, value: Optional[str]) -> Optional[str]:
+    TRACER.configure(value)
+    return value
+
+
+vault_addr_option = click.option(
+    "-a",
+    "--vault-addr",
+    envvar="VAULT_ADDR",
+    type=URLListParameterType(),
+    default=DEFAULT_VAULT_ADDR,
+    help="Address under which Vault can be reached. Several addresses of the same "
+    "cluster can be given, separated by commas. The fastest healthy one is then "
+    "used, failing over to the others. unix:///path/to/socket connects to a Unix "
+    "domain socket, e.g. of a Vault Agent.",
+)
+
+vault_token_option = click.option(
+    "-t",
+    "--vault-token",
+    default=Config.token_from_env,
+    help="Token for authentication against Vault. Required unless another auth "
+    "method is used.",
+)
+
+
+def auth_options(f):
+    """
+    The options for logging in to Vault instead of using a given token
+    """
+    options = [
+        click.option(
+            "--auth-method",
+            envvar="VAULT_SSH_AUTH_METHOD",
+            type=click.Choice(AUTH_METHODS),
+            default="token",
+            help="How to authenticate against Vault. With approle or kubernetes, the "
+            "tool logs in itself and renews the resulting token while it is in use.",
+            show_default=True,
+        ),
+        click.option(
+            "--auth-mount",
+            envvar="VAULT_SSH_AUTH_MOUNT",
+            help="The path the auth method is mounted at. Defaults to the name of the "
+            "method.",
+        ),
+        click.option(
+            "--approle-role-id",
+            envvar="VAULT_SSH_APPROLE_ROLE_ID",
+            help="The role ID to log in with AppRole.",
+        ),
+        click.option(
+            "--approle-secret-id-file",
+            envvar="VAULT_SSH_APPROLE_SECRET_ID_FILE",
+            type=click.Path(dir_okay=False),
+            help="The file to read the AppRole secret ID from.",
+        ),
+        click.option(
+            "--kubernetes-role",
+            envvar="VAULT_SSH_KUBERNETES_ROLE",
+            help="The role to log in with Kubernetes auth.",
+        ),
+        click.option(
+            "--kubernetes-jwt-path",
+            envvar="VAULT_SSH_KUBERNETES_JWT_PATH",
+            type=click.Path(dir_okay=False),
+            default=DEFAULT_KUBERNETES_JWT_PATH,
+            help="The service account token to log in with Kubernetes auth.",
+            show_default=True,
+        ),
+        click.option(
+            "--use-agent-token",
+            envvar="VAULT_SSH_USE_AGENT_TOKEN",
+            is_flag=True,
+            type=bool,
+            default=False,
+            help="Send requests without a token, for a Vault Agent at the Vault "
+            "address that adds the token of its auto-auth.",
+        ),
+        click.option(
+            "--token-cache",
+            envvar="VAULT_SSH_TOKEN_CACHE",
+            type=click.Path(dir_okay=False),
+            help="The file to keep the token obtained by logging in between runs. "
+            "Defaults to vault-token.json in the cache directory.",
+        ),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def check_credentials(config: Config):
+    """
+    :raises click.UsageError: If the options do not allow to authenticate against Vault
+    """
+    if config.use_agent_token:
+        return
+    if config.auth_method == "token" and not config.token:
+        raise click.UsageError("Missing option '-t' / '--vault-token'.")
+    if config.auth_method == "approle" and not config.approle_role_id:
+        raise click.UsageError("AppRole auth requires --approle-role-id.")
+    if config.auth_method == "kubernetes" and not config.kubernetes_role:
+        raise click.UsageError("Kubernetes auth requires --kubernetes-role.")
+
+
+ssh_sign_path_option = click.option(
+    "-p",
+    "--ssh-sign-path",
+    envvar="VAULT_SSH_SIGN_PATH",
+    help="The path to the signing endpoint, usually <secret mountpoint>/sign/<role name>.",
+    required=True,
+)
+
+renewal_threshold_option = click.option(
+    "-w",
+    "--renewal-threshold-days",
+    envvar="VAULT_SSH_RENEWAL_THRESHOLD_DAYS",
+    type=int,
+    default=7,
+    help="When the certificate is valid for less then this many days, renew it.",
+    show_default=True,
+)
+
+renewal_spread_option = click.option(
+    "--renewal-spread-days",
+    envvar="VAULT_SSH_RENEWAL_SPREAD_DAYS",
+    type=float,
+    default=0,
+    help="Spread renewals over this many days before the renewal threshold. Each "
+    "host renews at a fixed offset derived from its principals, so that "
+    "certificates issued at the same time are not all renewed at once.",
+    show_default=True,
+)
+
+renewal_fraction_option = click.option(
+    "--renewal-fraction",
+    envvar="VAULT_SSH_RENEWAL_FRACTION",
+    type=FractionParameterType(),
+    help="Renew a certificate once less than this fraction of its total lifetime "
+    "is left, e.g. 0.33. Takes the place of --renewal-threshold-days, so that short "
+    "and long lived certificates are both renewed in time.",
+)
+
+renewal_floor_option = click.option(
+    "--renewal-floor-hours",
+    envvar="VAULT_SSH_RENEWAL_FLOOR_HOURS",
+    type=float,
+    default=1.0,
+    help="With --renewal-fraction, renew a certificate at the latest when it is "
+    "valid for less than this many hours.",
+    show_default=True,
+)
+
+check_principals_option = click.option(
+    "--check-principals/--no-check-principals",
+    envvar="VAULT_SSH_CHECK_PRINCIPALS",
+    default=True,
+    help="Renew a certificate that was issued for other principals than the ones "
+    "requested, regardless of its validity.",
+    show_default=True,
+)
+
+cache_dir_option = click.option(
+    "--cache-dir",
+    envvar="VAULT_SSH_CACHE_DIR",
+    type=click.Path(file_okay=False),
+    help="Directory in which to cache the validity of certificates between runs, "
+    "e.g. /var/cache/vault-ssh-renew. Unchanged certificates are then not parsed "
+    "again.",
+)
+
+vault_pool_size_option = click.option(
+    "--vault-pool-size",
+    envvar="VAULT_SSH_POOL_SIZE",
+    type=int,
+    default=4,
+    help="The number of connections to Vault to keep open for reuse.",
+    show_default=True,
+)
+
+vault_keep_alive_option = click.option(
+    "--vault-keep-alive/--no-vault-keep-alive",
+    envvar="VAULT_SSH_KEEP_ALIVE",
+    default=True,
+    help="Whether to reuse connections to Vault between requests.",
+    show_default=True,
+)
+
+vault_connect_timeout_option = click.option(
+    "--vault-connect-timeout",
+    envvar="VAULT_SSH_CONNECT_TIMEOUT",
+    type=float,
+    default=5.0,
+    help="Seconds to wait for a connection to Vault to be established.",
+    show_default=True,
+)
+
+vault_read_timeout_option = click.option(
+    "--vault-read-timeout",
+    envvar="VAULT_SSH_READ_TIMEOUT",
+    type=float,
+    default=30.0,
+    help="Seconds to wait for Vault to respond to a request.",
+    show_default=True,
+)
+
+vault_deadline_option = click.option(
+    "--vault-deadline",
+    envvar="VAULT_SSH_DEADLINE",
+    type=float,
+    default=120.0,
+    help="The maximum number of seconds to spend on a sign request, including "
+    "retries.",
+    show_default=True,
+)
+
+vault_max_retries_option = click.option(
+    "--vault-max-retries",
+    envvar="VAULT_SSH_MAX_RETRIES",
+    type=int,
+    default=3,
+    help="How often to retry a sign request that failed with a connection error or "
+    "a temporary error (429, 5xx).",
+    show_default=True,
+)
+
+vault_breaker_threshold_option = click.option(
+    "--vault-breaker-threshold",
+    envvar="VAULT_SSH_BREAKER_THRESHOLD",
+    type=int,
+    default=5,
+    help="Stop sending requests to Vault for a minute after this many consecutive "
+    "failures. 0 disables the circuit breaker.",
+    show_default=True,
+)
+
+trace_file_option = click.option(
+    "--trace-file",
+    envvar="VAULT_SSH_TRACE_FILE",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    is_eager=True,
+    expose_value=False,
+    callback=configure_tracing,
+    help="Append a JSON line with the duration and outcome of each step of the "
+    "renewal to this file, or - for stdout.",
+)
+
+debug_option = click.option(
+    "-d",
+    "--debug",
+    envvar="VAULT_SSH_DEBUG",
+    is_flag=True,
+    type=bool,
+    help="Turn on debug output.",
+    default=False,
+)
+
+
 @click.command()
 @click.argument(
     "ssh-host-key-path",
@@ -29,50 +310,141 @@ DEFAULT_VAULT_ADDR = "http://127.0.0.1:8200"
     type=click.Path(),
     default=Path("/etc/ssh/ssh_host_rsa_key-cert.pub"),
 )
+@vault_addr_option
+@vault_token_option
+@auth_options
+@ssh_sign_path_option
 @click.option(
-    "-a",
-    "--vault-addr",
-    envvar="VAULT_ADDR",
-    type=URLParameterType(),
-    default=urlparse(DEFAULT_VAULT_ADDR),
-    help="Address under which Vault can be reached.",
+    "--ssh-principal",
+    envvar="VAULT_SSH_PRINCIPALS",
+    help="The principals to request for the certificate. Defaults to the principals "
+    "found by the principal sources. This option may be specified more than once or "
+    "supplied via the VAULT_SSH_PRINCIPALS environment variable, with individual "
+    "entries separated by spaces.",
+    multiple=True,
 )
 @click.option(
-    "-t",
-    "--vault-token",
-    default=Config.token_from_env,
-    help="Token for authentication against Vault.",
-    required=True,
+    "--principal-source",
+    "principal_sources",
+    envvar="VAULT_SSH_PRINCIPAL_SOURCES",
+    type=click.Choice(sorted(PRINCIPAL_SOURCES)),
+    multiple=True,
+    default=["fqdn"],
+    help="Where to find the principals of the host if none are given, in order: "
+    + "; ".join("%s: %s" % item for item in sorted(PRINCIPAL_SOURCES.items()))
+    + ". They are only looked up when a certificate is signed. This option may be "
+    "specified more than once.",
+    show_default=True,
 )
 @click.option(
-    "-p",
-    "--ssh-sign-path",
-    envvar="VAULT_SSH_SIGN_PATH",
-    help="The path to the signing endpoint, usually <secret mountpoint>/sign/<role name>.",
-    required=True,
+    "--principal-metadata-path",
+    envvar="VAULT_SSH_PRINCIPAL_METADATA_PATH",
+    type=click.Path(dir_okay=False),
+    default=DEFAULT_METADATA_PATH,
+    help="The instance metadata file for the metadata principal source. cloud-init "
+    "instance data, a JSON list or one name per line.",
+    show_default=True,
 )
 @click.option(
-    "--ssh-principal",
-    envvar="VAULT_SSH_PRINCIPALS",
-    help="The principals to request for the certificate. Defaults to the FQDN of the host. "
-    "This option may be specified more than once or supplied via the VAULT_SSH_PRINCIPALS "
-    "environment variable, with individual entries separated by spaces.",
+    "--principal-timeout",
+    envvar="VAULT_SSH_PRINCIPAL_TIMEOUT",
+    type=float,
+    default=5.0,
+    help="Seconds after which looking up the principals of the host is given up.",
+    show_default=True,
+)
+@click.option(
+    "--principal-cache-ttl",
+    envvar="VAULT_SSH_PRINCIPAL_CACHE_TTL",
+    type=float,
+    default=3600.0,
+    help="Seconds for which looked up principals are reused, also between runs with "
+    "a cache directory.",
+    show_default=True,
+)
+@renewal_threshold_option
+@renewal_spread_option
+@renewal_fraction_option
+@renewal_floor_option
+@check_principals_option
+@click.option(
+    "--all-host-keys",
+    envvar="VAULT_SSH_ALL_HOST_KEYS",
+    is_flag=True,
+    type=bool,
+    help="Renew certificates for all ssh_host_*_key.pub files in the directory of the "
+    "host key.",
+    default=False,
+)
+@click.option(
+    "--host-key-pair",
+    type=(click.Path(), click.Path()),
     multiple=True,
-    default=lambda: [socket.getfqdn(),],
+    help="A host key and certificate path to process. This option may be specified "
+    "more than once and takes precedence over the key and certificate arguments.",
 )
 @click.option(
-    "-w",
-    "--renewal-threshold-days",
-    envvar="VAULT_SSH_RENEWAL_THRESHOLD_DAYS",
+    "-j",
+    "--concurrency",
+    envvar="VAULT_SSH_CONCURRENCY",
     type=int,
-    default=7,
-    help="When the certificate is valid for less then this many days, renew it.",
+    default=4,
+    help="The maximum number of certificates to request from Vault in parallel.",
     show_default=True,
 )
+@cache_dir_option
+@vault_pool_size_option
+@vault_keep_alive_option
+@vault_connect_timeout_option
+@vault_read_timeout_option
+@vault_deadline_option
+@vault_max_retries_option
+@vault_breaker_threshold_option
+@click.option(
+    "--daemon",
+    envvar="VAULT_SSH_DAEMON",
+    is_flag=True,
+    type=bool,
+    help="Keep running and renew each certificate when it reaches the renewal "
+    "threshold instead of exiting after one check.",
+    default=False,
+)
+@click.option(
+    "--watch",
+    envvar="VAULT_SSH_WATCH",
+    is_flag=True,
+    type=bool,
+    help="Implies --daemon. Also check the certificates as soon as a host key or "
+    "certificate is changed, replaced or removed, using inotify.",
+    default=False,
+)
+@click.option(
+    "--retry-interval",
+    envvar="VAULT_SSH_RETRY_INTERVAL",
+    type=int,
+    default=900,
+    help="In daemon mode, the number of seconds to wait before retrying a failed "
+    "renewal.",
+    show_default=True,
+)
+@click.option(
+    "--metrics-textfile",
+    envvar="VAULT_SSH_METRICS_TEXTFILE",
+    type=click.Path(dir_okay=False),
+    help="Write Prometheus metrics to this file after each run, e.g. for the "
+    "node_exporter textfile collector.",
+)
+@click.option(
+    "--metrics-listen",
+    envvar="VAULT_SSH_METRICS_LISTEN",
+    metavar="[HOST]:PORT",
+    help="Serve Prometheus metrics on /metrics and a health check on /healthz at "
+    "this address while running, mostly useful in daemon mode.",
+)
 @click.option(
     "--on-renew",
     envvar="VAULT_SSH_ON_RENEW",
-    help="Hook script to execute when renewal succeeds.",
+    help="Hook script to execute when a certificate was renewed.",
 )
 @click.option(
     "--on-failure",
@@ -80,71 +452,630 @@ DEFAULT_VAULT_ADDR = "http://127.0.0.1:8200"
     help="Hook script to execute when renewal fails.",
 )
 @click.option(
-    "-d",
-    "--debug",
-    envvar="VAULT_SSH_DEBUG",
-    is_flag=True,
-    type=bool,
-    help="Turn on debug output.",
-    default=False,
+    "--hook-timeout",
+    envvar="VAULT_SSH_HOOK_TIMEOUT",
+    type=float,
+    default=60.0,
+    help="Seconds after which a hook script that has not finished is killed.",
+    show_default=True,
+)
+@click.option(
+    "--lock-timeout",
+    envvar="VAULT_SSH_LOCK_TIMEOUT",
+    type=float,
+    default=300.0,
+    help="Seconds to wait for another process renewing the same certificate.",
+    show_default=True,
 )
+@click.option(
+    "--sign-min-interval",
+    envvar="VAULT_SSH_SIGN_MIN_INTERVAL",
+    type=float,
+    default=60.0,
+    help="The minimum number of seconds between two sign requests for the same "
+    "certificate, also across restarts.",
+    show_default=True,
+)
+@click.option(
+    "--sign-backoff-cap",
+    envvar="VAULT_SSH_SIGN_BACKOFF_CAP",
+    type=float,
+    default=3600.0,
+    help="After failed sign requests, wait exponentially longer before the next "
+    "one, up to this many seconds. 0 disables the backoff.",
+    show_default=True,
+)
+@trace_file_option
+@debug_option
 def renew(**kwargs):
     """
     Renew the hosts SSH certificate using the specified Vault server. By default, it will
     read the RSA host key from /etc/ssh/ssh_host_rsa_key.pub and write the certificate to
     /etc/ssh/ssh_host_rsa_key-cert.pub. ECDSA and Ed25519 keys are also supported.
+    Certificates for several host keys can be renewed in one run by passing
+    --all-host-keys or --host-key-pair.
 
     All options can also be supplied using environment variables with a `VAULT_SSH_` prefix,
     except for the token and address options, which use the customary environment variables
     `VAULT_ADDR` and `VAULT_TOKEN`. The Vault token can also be read from the file specified
-    by the `VAULT_TOKEN_FILE` environment variable.
+    by the `VAULT_TOKEN_FILE` environment variable, or obtained by logging in with AppRole
+    or Kubernetes auth.
     """
     kwargs["ssh_principals"] = kwargs.pop("ssh_principal")
-    run_renew_workflow(Config(**kwargs))
+    kwargs["host_key_pairs"] = kwargs.pop("host_key_pair")
+    config = Config(**kwargs)
+    check_credentials(config)
+    run_renew_workflow(config)
 
 
 def run_renew_workflow(config: Config):
+    server = None
+    if config.metrics_listen:
+        from vault_ssh_renew.metrics import MetricsServer
+
+        server = MetricsServer(parse_listen_address(config.metrics_listen)).start()
+    try:
+        if config.daemon or config.watch:
+            from vault_ssh_renew.daemon import RenewalDaemon
+
+            return RenewalDaemon(config, renew_all).run()
+        success = renew_all(config, resolve_key_pairs(config))
+        METRICS.healthy = success
+        if config.metrics_textfile:
+            write_textfile(config)
+    finally:
+        if server is not None:
+            server.stop()
+    if not success:
+        return config.exit(1)
+
+
+def renew_all(
+    config: Config,
+    pairs: List[KeyPair],
+    connection: Optional["VaultConnection"] = None,
+    hooks: Optional[HookRunner] = None,
+) -> bool:
+    """
+    Renew the certificates for a number of host keys and run the hooks
+    :param config: The configuration to use
+    :param pairs: The host keys and certificates to process
+    :param connection: The connection to use for Vault requests. If omitted, one is
+        created for the duration of the call.
+    :param hooks: The runner to submit hooks to, which runs them in the background.
+        If omitted, the hooks have finished when the call returns.
+    :return: Whether all certificates were processed successfully
+    """
+    with TRACER.span("renew", host_keys=len(pairs)) as span:
+        if hooks is None:
+            hooks = HookRunner(config.hook_timeout, config.debug)
+            success = _renew_all(config, pairs, connection, hooks)
+            hooks.wait()
+        else:
+            success = _renew_all(config, pairs, connection, hooks)
+        span.set_attribute("success", success)
+    return success
+
+
+def _renew_all(
+    config: Config,
+    pairs: List[KeyPair],
+    connection: Optional["VaultConnection"],
+    hooks: HookRunner,
+) -> bool:
+    if not pairs:
+        click.echo(click.style("No host keys found", fg="red"), err=True)
+        if config.on_failure_hook:
+            hooks.submit(HookEvent("on_failure", config.on_failure_hook))
+        return False
+
+    shared = _SharedResources(config)
+
+    def _renew(pair: KeyPair) -> RenewOutcome:
+        with TRACER.span("host_key", cert=str(pair.cert_path)) as span:
+            outcome = renew_host_key(
+                config,
+                pair,
+                len(pairs) > 1,
+                connection,
+                shared.get,
+                shared.tokens,
+                shared.principals,
+            )
+            span.set_attribute("outcome", outcome.value)
+        return outcome
+
+    try:
+        results = run_batch(_renew, pairs, config.concurrency)
+    finally:
+        shared.close()
+    failed = [pair for pair, outcome in results if outcome == RenewOutcome.FAILED]
+    renewed = [pair for pair, outcome in results if outcome == RenewOutcome.RENEWED]
+    if failed and config.on_failure_hook:
+        event = HookEvent("on_failure", config.on_failure_hook)
+        event.failed.extend(str(pair.cert_path) for pair in failed)
+        hooks.submit(event)
+    # Only reload when a certificate changed, even if others failed to renew
+    if renewed and config.on_renew_hook:
+        event = HookEvent("on_renew", config.on_renew_hook)
+        policy = RenewalPolicy.from_config(config)
+        for pair in renewed:
+            event.renewed[str(pair.cert_path)] = certificate_validity(pair, policy)
+        hooks.submit(event)
+    return not failed
+
+
+class _SharedResources:
+    """
+    What the certificates of a run share for their sign requests. The Vault
+    connection is created on first use, so that runs in which no certificate is due
+    do not load the HTTP stack. The token source and the principal resolver are
+    shared as well, so that a run logs in and resolves principals at most once.
+    """
+
+    tokens: TokenSource
+    principals: PrincipalResolver
+
+    def __init__(self, config: Config):
+        self._config = config
+        self._connection: Optional["VaultConnection"] = None
+        self._lock = threading.Lock()
+        self.tokens = TokenSource.from_config(config)
+        self.principals = PrincipalResolver.from_config(config)
+
+    def get(self) -> "VaultConnection":
+        with self._lock:
+            if self._connection is None:
+                from vault_ssh_renew.vault import VaultConnection
+
+                self._connection = VaultConnection.from_config(self._config)
+            return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+
+
+def certificate_validity(
+    pair: KeyPair, policy: RenewalPolicy
+) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    :return: The validity interval of a certificate, or None if it cannot be read
+    """
     try:
         status = (
-            HostCertificate.get(config.ssh_host_key_path, config.ssh_host_cert_path)
+            HostCertificate.get(pair.key_path, pair.cert_path)
             .read()
-            .check_renewal_required(timedelta(days=config.renewal_threshold_days))
-        )
-    except RenewError:
-        click.echo(
-            click.style("An error occurred when checking certificate status", fg="red"),
-            err=True,
+            .check_renewal_required(policy)
         )
+    except (OSError, RenewError):
+        return None, None
+    return status.not_before, status.not_after
+
+
+def renew_host_key(
+    config: Config,
+    pair: KeyPair,
+    qualify: bool,
+    connection: Optional["VaultConnection"] = None,
+    connect: Optional[Callable[[], "VaultConnection"]] = None,
+    tokens: Optional[TokenSource] = None,
+    principals: Optional[PrincipalResolver] = None,
+) -> RenewOutcome:
+    """
+    Check a single host key and request a new certificate for it if required. The
+    renewal happens under a host wide lock for the certificate, and the certificate
+    is checked again once the lock is held, so that concurrent runs do not sign twice.
+    :param config: The configuration to use
+    :param pair: The host key and certificate to process
+    :param qualify: Whether to prefix messages with the certificate path
+    :param connection: The connection to use for Vault requests
+    :param connect: If no connection is given, called to obtain one once a renewal is
+        required
+    :param tokens: Provides the token for the sign request. If omitted, the token is
+        determined from the configuration.
+    :param principals: Resolves the principals to request if none are configured
+    :return: What happened to the certificate
+    """
+
+    def _echo(message: str, err=False, **styles):
+        if qualify:
+            message = "%s: %s" % (pair.cert_path, message)
+        click.echo(click.style(message, **styles), err=err)
+
+    def _failed(message: str) -> RenewOutcome:
+        _echo(message, err=True, fg="red")
         if config.debug:
             traceback.print_exc()
-        if config.on_failure_hook:
-            os.system(config.on_failure_hook)
-        return config.exit(1)
+        METRICS.inc("vault_ssh_renew_checks_total", cert=label, outcome="failed")
+        return RenewOutcome.FAILED
+
+    def _not_required(message: str) -> RenewOutcome:
+        _echo(message, fg="green")
+        METRICS.inc("vault_ssh_renew_checks_total", cert=label, outcome="not required")
+        return RenewOutcome.NOT_REQUIRED
+
+    def _deferred(ledger: RenewalLedger, next_attempt: float) -> RenewOutcome:
+        METRICS.inc("vault_ssh_renew_checks_total", cert=label, outcome="deferred")
+        when = datetime.fromtimestamp(next_attempt, timezone.utc).isoformat()
+        failures = ledger.failures()
+        if failures:
+            # Still a failure, the certificate is due and was not renewed
+            _echo(
+                "Backing off after failed sign requests (%d in a row), next attempt "
+                "at %s" % (failures, when),
+                err=True,
+                fg="red",
+            )
+            return RenewOutcome.FAILED
+        _echo("Signed recently, next attempt at %s" % when, fg="yellow")
+        return RenewOutcome.NOT_REQUIRED
+
+    label = str(pair.cert_path)
+    policy = RenewalPolicy.from_config(config)
+    try:
+        status = check_host_key(config, pair, policy)
+    except (OSError, RenewError):
+        return _failed("An error occurred when checking certificate status")
     if not status.needs_renewal:
-        click.echo(click.style("No renewal required", fg="green"))
-        return
+        return _not_required("No renewal required")
+    lock = CertificateLock(pair.cert_path, config.lock_timeout)
     try:
-        VaultRenewer.build(
-            config.addr,
-            config.token,
-            config.ssh_sign_path,
-            status.public_key,
-            config.ssh_principals,
-            config.ssh_host_cert_path,
-        ).renew().write_certificate()
+        with METRICS.time("lock"):
+            lock.acquire()
     except RenewError:
+        return _failed("Could not lock the certificate for renewal")
+    try:
+        if lock.contended:
+            METRICS.inc("vault_ssh_renew_lock_contended_total", cert=label)
+            _echo(
+                "Waited %.1fs for another renewal of the certificate" % lock.waited,
+                fg="yellow",
+            )
+        # Another process may have renewed the certificate between the first check
+        # and taking the lock, even if the lock was free by then
+        try:
+            status = check_host_key(config, pair, policy)
+        except (OSError, RenewError):
+            return _failed("An error occurred when checking certificate status")
+        if not status.needs_renewal:
+            return _not_required("Certificate was renewed by another process")
+        ledger = RenewalLedger.from_config(config, pair.cert_path)
+        next_attempt = ledger.next_attempt_at()
+        if next_attempt is not None and time.time() < next_attempt:
+            return _deferred(ledger, next_attempt)
+        if status.key_mismatch:
+            _echo("Certificate does not match the host key", fg="yellow")
+        if status.principals_mismatch:
+            _echo(
+                "Certificate principals differ from the requested principals",
+                fg="yellow",
+            )
+        from vault_ssh_renew.vault import VaultRenewer
+
+        # Only sign requests count as attempts in the ledger
+        sent = False
+
+        def _sign(token: str) -> "VaultRenewDone":
+            nonlocal sent
+            sent = True
+            return VaultRenewer.build(
+                config.addr,
+                token,
+                config.ssh_sign_path,
+                status.public_key,
+                requested,
+                pair.cert_path,
+                connection,
+            ).renew()
+
+        try:
+            if connection is None and connect is not None:
+                connection = connect()
+            if tokens is None:
+                tokens = TokenSource.from_config(config)
+            requested = config.ssh_principals
+            if not requested:
+                if principals is None:
+                    principals = PrincipalResolver.from_config(config)
+                with METRICS.time("principals"):
+                    requested = principals.resolve()
+            with METRICS.time("sign"):
+                renewer = tokens.call(connection, _sign)
+        except (OSError, RenewError) as e:
+            if sent:
+                ledger.record(
+                    "failed",
+                    e.status_code if isinstance(e, VaultResponseError) else None,
+                )
+            return _failed("An error occurred when renewing the certificate")
+        try:
+            with METRICS.time("write"):
+                changed = renewer.write_certificate()
+        except (OSError, RenewError):
+            return _failed("An error occurred when renewing the certificate")
+        ledger.record("renewed" if changed else "unchanged", 200)
+    finally:
+        lock.release()
+    if not changed:
+        # Nothing to reload, the certificate on disk is already the issued one
+        _echo("Certificate unchanged", fg="green")
+        METRICS.inc("vault_ssh_renew_checks_total", cert=label, outcome="unchanged")
+        return RenewOutcome.NOT_REQUIRED
+    _echo("Certificate renewed", fg="green", bold=True)
+    METRICS.inc("vault_ssh_renew_checks_total", cert=label, outcome="renewed")
+    METRICS.set(
+        "vault_ssh_renew_last_renewal_timestamp_seconds", time.time(), cert=label
+    )
+    try:
+        # Record the validity of the new certificate
+        check_host_key(config, pair, policy)
+    except (OSError, RenewError):
+        pass
+    return RenewOutcome.RENEWED
+
+
+def check_host_key(
+    config: Config, pair: KeyPair, policy: RenewalPolicy
+) -> HostCertificateStatus:
+    """
+    Read and parse a certificate, recording its validity in the metrics
+    """
+    label = str(pair.cert_path)
+    # Taken from the ledger, so that it is also reported by runs that did not renew
+    last_renewal = RenewalLedger.from_config(config, pair.cert_path).last_renewal()
+    if last_renewal is not None:
+        METRICS.set(
+            "vault_ssh_renew_last_renewal_timestamp_seconds", last_renewal, cert=label
+        )
+    with METRICS.time("read"):
+        validate = HostCertificate.get(
+            pair.key_path, pair.cert_path, StatusCache.from_config(config)
+        ).read()
+    with METRICS.time("parse"):
+        status = validate.check_renewal_required(policy)
+    METRICS.set("vault_ssh_renew_last_check_timestamp_seconds", time.time(), cert=label)
+    if status.not_after is not None:
+        METRICS.set(
+            "vault_ssh_renew_cert_not_before_timestamp_seconds",
+            status.not_before.timestamp(),
+            cert=label,
+        )
+        METRICS.set(
+            "vault_ssh_renew_cert_not_after_timestamp_seconds",
+            status.not_after.timestamp(),
+            cert=label,
+        )
+        METRICS.set(
+            "vault_ssh_renew_cert_renew_at_timestamp_seconds",
+            status.renew_at.timestamp(),
+            cert=label,
+        )
+    return status
+
+
+@click.command()
+@click.argument("inventory", type=click.Path(exists=True, dir_okay=False))
+@vault_addr_option
+@vault_token_option
+@auth_options
+@ssh_sign_path_option
+@renewal_threshold_option
+@renewal_spread_option
+@renewal_fraction_option
+@renewal_floor_option
+@check_principals_option
+@click.option(
+    "-j",
+    "--concurrency",
+    envvar="VAULT_SSH_CONCURRENCY",
+    type=int,
+    default=32,
+    help="The maximum number of hosts to process in parallel.",
+    show_default=True,
+)
+@click.option(
+    "--qps",
+    envvar="VAULT_SSH_QPS",
+    type=float,
+    default=20.0,
+    help="The maximum number of sign requests per second sent to Vault. "
+    "0 disables the limit.",
+    show_default=True,
+)
+@cache_dir_option
+@vault_pool_size_option
+@vault_keep_alive_option
+@vault_connect_timeout_option
+@vault_read_timeout_option
+@vault_deadline_option
+@vault_max_retries_option
+@vault_breaker_threshold_option
+@trace_file_option
+@debug_option
+def fleet(inventory, concurrency, qps, **kwargs):
+    """
+    Renew the SSH certificates of many hosts listed in an INVENTORY file. Each line of
+    the inventory contains the path to a host's public key, the path to its certificate
+    and the principals to request, separated by whitespace. Lines starting with # are
+    ignored.
+    """
+    from vault_ssh_renew.fleet import FleetRenewer, print_progress, read_inventory
+
+    config = Config(
+        None, None, ssh_principals=(), on_renew=None, on_failure=None, **kwargs
+    )
+    check_credentials(config)
+    try:
+        entries = list(read_inventory(Path(inventory)))
+    except RenewError as e:
+        click.echo(click.style(str(e), fg="red"), err=True)
+        return config.exit(1)
+    results = FleetRenewer(config, concurrency, qps).run(entries, print_progress)
+    counts = Counter(outcome for _, outcome in results)
+    click.echo(
+        click.style(
+            "%d hosts: %d renewed, %d not due, %d failed"
+            % (
+                len(results),
+                counts[RenewOutcome.RENEWED],
+                counts[RenewOutcome.NOT_REQUIRED],
+                counts[RenewOutcome.FAILED],
+            ),
+            fg="red" if counts[RenewOutcome.FAILED] else "green",
+        )
+    )
+    if counts[RenewOutcome.FAILED]:
+        return config.exit(1)
+
+
+@click.command()
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@renewal_threshold_option
+@renewal_fraction_option
+@renewal_floor_option
+@click.option(
+    "-f",
+    "--format",
+    "output_format",
+    type=click.Choice(["csv", "json"]),
+    default="json",
+    help="Write one JSON object per line, or CSV with a header.",
+    show_default=True,
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w", encoding="utf-8"),
+    default="-",
+    help="The file to write the results to.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    help="The number of worker processes. Defaults to the number of CPUs.",
+)
+def audit(
+    directory,
+    renewal_threshold_days,
+    renewal_fraction,
+    renewal_floor_hours,
+    output_format,
+    output,
+    jobs,
+):
+    """
+    Report the validity of all SSH certificates (*-cert.pub files) below DIRECTORY,
+    including whether they need renewal according to the renewal threshold. The
+    exit status is 1 if any certificate could not be read.
+    """
+    from vault_ssh_renew.audit import (
+        WRITERS,
+        audit as audit_certificates,
+        find_certificates,
+    )
+
+    if renewal_fraction is not None:
+        policy = LifetimeFractionPolicy(
+            renewal_fraction, timedelta(hours=renewal_floor_hours)
+        )
+    else:
+        policy = RenewalPolicy(timedelta(days=renewal_threshold_days))
+    writer = WRITERS[output_format](output)
+    errors = 0
+    for row in audit_certificates(find_certificates(directory), policy, jobs):
+        writer.write(row)
+        if "error" in row:
+            errors += 1
+    if errors:
         click.echo(
-            click.style("An error occurred when renewing the certificate", fg="red"),
+            click.style("%d certificates could not be read" % errors, fg="red"),
             err=True,
         )
-        if config.debug:
-            traceback.print_exc()
-        if config.on_failure_hook:
-            os.system(config.on_failure_hook)
-        return config.exit(1)
-    click.echo(click.style("Certificate renewed", fg="green", bold=True))
-    if config.on_renew_hook:
-        os.system(config.on_renew_hook)
+        sys.exit(1)
+
+
+@click.command()
+@click.option(
+    "-l",
+    "--listen",
+    envvar="VAULT_SSH_RELAY_LISTEN",
+    metavar="[HOST]:PORT",
+    default="127.0.0.1:8201",
+    help="The address to accept sign requests on.",
+    show_default=True,
+)
+@vault_addr_option
+@vault_token_option
+@auth_options
+@ssh_sign_path_option
+@click.option(
+    "-j",
+    "--concurrency",
+    envvar="VAULT_SSH_CONCURRENCY",
+    type=int,
+    default=8,
+    help="The maximum number of sign requests forwarded to Vault at a time.",
+    show_default=True,
+)
+@click.option(
+    "--qps",
+    envvar="VAULT_SSH_QPS",
+    type=float,
+    default=20.0,
+    help="The maximum number of sign requests per second forwarded to Vault. "
+    "0 disables the limit.",
+    show_default=True,
+)
+@vault_pool_size_option
+@vault_keep_alive_option
+@vault_connect_timeout_option
+@vault_read_timeout_option
+@vault_deadline_option
+@vault_max_retries_option
+@vault_breaker_threshold_option
+@click.option(
+    "--metrics-listen",
+    envvar="VAULT_SSH_METRICS_LISTEN",
+    metavar="[HOST]:PORT",
+    help="Serve Prometheus metrics on /metrics and a health check on /healthz at "
+    "this address.",
+)
+@trace_file_option
+@debug_option
+def relay(listen, concurrency, qps, metrics_listen, **kwargs):
+    """
+    Relay sign requests from the nodes of a cluster to Vault. Nodes use the relay by
+    setting VAULT_ADDR to its address. The relay authenticates to Vault with its own
+    token, forwards identical requests only once and limits the rate of requests
+    sent to Vault. Requests are only forwarded if the token sent by the node may use
+    the sign path.
+    """
+    from vault_ssh_renew.metrics import MetricsServer
+    from vault_ssh_renew.relay import SignRelay
+
+    config = Config(
+        None, None, ssh_principals=(), on_renew=None, on_failure=None, **kwargs
+    )
+    check_credentials(config)
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopped.set())
+    server = None
+    if metrics_listen:
+        server = MetricsServer(parse_listen_address(metrics_listen)).start()
+    sign_relay = SignRelay(
+        config, parse_listen_address(listen), concurrency, qps
+    ).start()
+    click.echo("Relaying sign requests to Vault on %s" % listen)
+    try:
+        while not stopped.wait(1):
+            pass
+    finally:
+        sign_relay.stop()
+        if server is not None:
+            server.stop()
 
 
 if __name__ == "__main__":
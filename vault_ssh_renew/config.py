@@ -1,19 +1,64 @@
 import sys
 from pathlib import Path
 import os
-from typing import Collection, Optional
+from typing import Collection, List, Optional, Sequence, Tuple, Union
 from urllib.parse import ParseResult
 
+from .auth import DEFAULT_KUBERNETES_JWT_PATH
+from .principals import DEFAULT_METADATA_PATH
+from .tracing import TRACER
+
+
+def _as_path(path: Optional[Union[str, Path]]) -> Optional[Path]:
+    return Path(path) if path is not None else None
+
 
 class Config:
 
     addr: ParseResult
-    token: str
+    addrs: List[ParseResult]
+    token: Optional[str]
+    auth_method: str
+    auth_mount: Optional[str]
+    approle_role_id: Optional[str]
+    approle_secret_id_file: Optional[Path]
+    kubernetes_role: Optional[str]
+    kubernetes_jwt_path: Path
+    token_cache: Optional[Path]
+    use_agent_token: bool
+    principal_sources: Sequence[str]
+    principal_metadata_path: Path
+    principal_timeout: float
+    principal_cache_ttl: float
+    sign_min_interval: float
+    sign_backoff_cap: float
     renewal_threshold_days: int
+    renewal_spread_days: float
+    renewal_fraction: Optional[float]
+    renewal_floor_hours: float
+    check_principals: bool
+    lock_timeout: float
     ssh_sign_path: str
     ssh_principals: Collection[str]
     ssh_host_key_path: Path
     ssh_host_cert_path: Path
+    host_key_pairs: Sequence[Tuple[Path, Path]]
+    all_host_keys: bool
+    concurrency: int
+    cache_dir: Optional[Path]
+    vault_pool_size: int
+    vault_keep_alive: bool
+    vault_connect_timeout: float
+    vault_read_timeout: float
+    vault_deadline: float
+    vault_max_retries: int
+    vault_breaker_threshold: int
+    daemon: bool
+    metrics_textfile: Optional[str]
+    metrics_listen: Optional[str]
+    retry_interval: int
+    hook_timeout: float
+    watch: bool
     on_renew_hook: Optional[str]
     on_failure_hook: Optional[str]
     debug: bool
@@ -22,18 +67,59 @@ class Config:
         self,
         ssh_host_key_path: Path,
         ssh_host_cert_path: Path,
-        vault_addr: ParseResult,
-        vault_token: str,
+        vault_addr: Union[ParseResult, Sequence[ParseResult]],
+        vault_token: Optional[str],
         ssh_sign_path: str,
         ssh_principals: Collection[str],
         renewal_threshold_days: int,
         on_renew: Optional[str],
         on_failure: Optional[str],
         debug: bool,
+        host_key_pairs: Sequence[Tuple[Path, Path]] = (),
+        renewal_spread_days: float = 0,
+        all_host_keys: bool = False,
+        concurrency: int = 4,
+        cache_dir: Optional[Path] = None,
+        vault_pool_size: int = 4,
+        vault_keep_alive: bool = True,
+        vault_connect_timeout: float = 5.0,
+        vault_read_timeout: float = 30.0,
+        vault_deadline: float = 120.0,
+        vault_max_retries: int = 3,
+        vault_breaker_threshold: int = 5,
+        daemon: bool = False,
+        retry_interval: int = 900,
+        metrics_textfile: Optional[str] = None,
+        metrics_listen: Optional[str] = None,
+        hook_timeout: float = 60.0,
+        watch: bool = False,
+        renewal_fraction: Optional[float] = None,
+        renewal_floor_hours: float = 1.0,
+        check_principals: bool = True,
+        lock_timeout: float = 300.0,
+        auth_method: str = "token",
+        auth_mount: Optional[str] = None,
+        approle_role_id: Optional[str] = None,
+        approle_secret_id_file: Optional[Path] = None,
+        kubernetes_role: Optional[str] = None,
+        kubernetes_jwt_path: Path = Path(DEFAULT_KUBERNETES_JWT_PATH),
+        token_cache: Optional[Path] = None,
+        use_agent_token: bool = False,
+        principal_sources: Sequence[str] = ("fqdn",),
+        principal_metadata_path: Path = Path(DEFAULT_METADATA_PATH),
+        principal_timeout: float = 5.0,
+        principal_cache_ttl: float = 3600.0,
+        sign_min_interval: float = 60.0,
+        sign_backoff_cap: float = 3600.0,
     ):
-        self.addr = vault_addr
-        self.ssh_host_key_path = ssh_host_key_path
-        self.ssh_host_cert_path = ssh_host_cert_path
+        # Several addresses may be given for the nodes of a cluster
+        if isinstance(vault_addr, ParseResult):
+            vault_addr = [vault_addr]
+        self.addrs = list(vault_addr)
+        self.addr = self.addrs[0]
+        # click passes paths given on the command line as strings
+        self.ssh_host_key_path = _as_path(ssh_host_key_path)
+        self.ssh_host_cert_path = _as_path(ssh_host_cert_path)
         self.token = vault_token
         self.ssh_sign_path = ssh_sign_path
         self.ssh_principals = ssh_principals
@@ -41,6 +127,42 @@ class Config:
         self.on_renew_hook = on_renew
         self.on_failure_hook = on_failure
         self.debug = debug
+        self.host_key_pairs = host_key_pairs
+        self.renewal_spread_days = renewal_spread_days
+        self.all_host_keys = all_host_keys
+        self.concurrency = concurrency
+        self.cache_dir = cache_dir
+        self.vault_pool_size = vault_pool_size
+        self.vault_keep_alive = vault_keep_alive
+        self.vault_connect_timeout = vault_connect_timeout
+        self.vault_read_timeout = vault_read_timeout
+        self.vault_deadline = vault_deadline
+        self.vault_max_retries = vault_max_retries
+        self.vault_breaker_threshold = vault_breaker_threshold
+        self.daemon = daemon
+        self.retry_interval = retry_interval
+        self.metrics_textfile = metrics_textfile
+        self.metrics_listen = metrics_listen
+        self.hook_timeout = hook_timeout
+        self.watch = watch
+        self.renewal_fraction = renewal_fraction
+        self.renewal_floor_hours = renewal_floor_hours
+        self.check_principals = check_principals
+        self.lock_timeout = lock_timeout
+        self.auth_method = auth_method
+        self.auth_mount = auth_mount
+        self.approle_role_id = approle_role_id
+        self.approle_secret_id_file = _as_path(approle_secret_id_file)
+        self.kubernetes_role = kubernetes_role
+        self.kubernetes_jwt_path = _as_path(kubernetes_jwt_path)
+        self.token_cache = _as_path(token_cache)
+        self.use_agent_token = use_agent_token
+        self.principal_sources = principal_sources
+        self.principal_metadata_path = _as_path(principal_metadata_path)
+        self.principal_timeout = principal_timeout
+        self.principal_cache_ttl = principal_cache_ttl
+        self.sign_min_interval = sign_min_interval
+        self.sign_backoff_cap = sign_backoff_cap
 
     @staticmethod
     def exit(return_code: int):
@@ -53,8 +175,9 @@ class Config:
             token = os.environ["VAULT_TOKEN"]
             os.environ["VAULT_TOKEN"] = ""
         if "VAULT_TOKEN_FILE" in os.environ:
-            with open(os.environ["VAULT_TOKEN_FILE"], "r") as f:
-                token = f.readline().strip()
+            with TRACER.span("token.read", path=os.environ["VAULT_TOKEN_FILE"]):
+                with open(os.environ["VAULT_TOKEN_FILE"], "r") as f:
+                    token = f.readline().strip()
         return token
 
 
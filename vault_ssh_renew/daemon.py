@@ -0,0 +1,177 @@
+import signal
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import click
+
+from .batch import KeyPair, resolve_key_pairs
+from .cache import StatusCache
+from .cert import HostCertificate
+from .config import Config
+from .errors import RenewError
+from .hooks import HookRunner
+from .ledger import RenewalLedger
+from .metrics import METRICS, write_textfile
+from .policy import RenewalPolicy
+from .vault import VaultConnection
+from .watch import FileWatcher
+
+# Even when no certificate is due, wake up once a day to pick up certificates
+# and keys that were changed behind our back.
+MAX_SLEEP = timedelta(days=1)
+
+
+class RenewalDaemon:
+    """
+    Keeps renewing the host certificates for as long as the process runs. After each
+    pass, the certificates are parsed again and the daemon sleeps until the earliest
+    of them is due for renewal according to the renewal policy. SIGHUP triggers an
+    immediate check, SIGTERM and SIGINT stop the daemon. The connection to Vault,
+    including its pooled HTTP session and circuit breaker, lives as long as the daemon,
+    and hooks run in the background so that a slow hook does not delay the next pass.
+
+    In watch mode, the directories of the host keys and certificates are watched as
+    well, and a check runs as soon as a key or certificate was changed, replaced or
+    removed.
+    """
+
+    _config: Config
+    _renew: Callable[
+        [Config, List[KeyPair], Optional[VaultConnection], Optional[HookRunner]], bool
+    ]
+    _connection: Optional[VaultConnection]
+
+    def __init__(
+        self,
+        config: Config,
+        renew: Callable[
+            [Config, List[KeyPair], Optional[VaultConnection], Optional[HookRunner]],
+            bool,
+        ],
+    ):
+        self._config = config
+        self._renew = renew
+        self._connection = None
+        self._hooks = HookRunner(config.hook_timeout, config.debug)
+        self._wakeup = threading.Event()
+        self._stopping = False
+
+    def run(self):
+        handled = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+        previous = {signum: signal.signal(signum, self._handle) for signum in handled}
+        self._connection = VaultConnection.from_config(self._config)
+        watcher = None
+        try:
+            if self._config.watch:
+                watcher = self._start_watcher()
+            while not self._stopping:
+                self._wakeup.clear()
+                if watcher is not None:
+                    # Changes made while the certificates are checked, including our
+                    # own renewals, cause another check right away
+                    watcher.reset()
+                delay = self.run_once()
+                if self._stopping:
+                    break
+                click.echo(
+                    "Next check at %s"
+                    % (
+                        datetime.now(timezone.utc) + timedelta(seconds=delay)
+                    ).isoformat()
+                )
+                self._wakeup.wait(delay)
+        finally:
+            if watcher is not None:
+                watcher.stop()
+            self._connection.close()
+            self._connection = None
+            # Give a reload triggered by the last pass the chance to complete
+            self._hooks.wait(self._config.hook_timeout)
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def _start_watcher(self) -> Optional[FileWatcher]:
+        def _paths() -> List[Path]:
+            return [path for pair in resolve_key_pairs(self._config) for path in pair]
+
+        def _changed():
+            click.echo("Host key or certificate changed, checking certificates")
+            self._wakeup.set()
+
+        try:
+            return FileWatcher(_paths, _changed).start()
+        except RenewError as e:
+            click.echo(
+                click.style("Not watching for changes: %s" % e, fg="red"), err=True
+            )
+            return None
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    def run_once(self) -> float:
+        """
+        Check and renew all certificates once
+        :return: The number of seconds until the next check is due
+        """
+        token = Config.token_from_env()
+        if token:
+            self._config.token = token
+        pairs = resolve_key_pairs(self._config)
+        success = self._renew(self._config, pairs, self._connection, self._hooks)
+        METRICS.healthy = success
+        if self._config.metrics_textfile:
+            write_textfile(self._config)
+        deadline = self.next_deadline(pairs)
+        now = datetime.now(timezone.utc)
+        if not success or deadline is None or deadline <= now:
+            return float(self._config.retry_interval)
+        return min(deadline - now, MAX_SLEEP).total_seconds()
+
+    def next_deadline(self, pairs: List[KeyPair]) -> Optional[datetime]:
+        """
+        Find the point in time at which the first of the certificates needs renewal.
+        Certificates that are already due, e.g. because they do not match the host key,
+        are due as soon as their ledger allows another sign request.
+        :return: The deadline, or None if any certificate could not be inspected
+        """
+        policy = RenewalPolicy.from_config(self._config)
+        cache = StatusCache.from_config(self._config)
+        now = datetime.now(timezone.utc)
+        deadlines = []
+        for pair in pairs:
+            try:
+                status = (
+                    HostCertificate.get(pair.key_path, pair.cert_path, cache)
+                    .read()
+                    .check_renewal_required(policy)
+                )
+            except (OSError, RenewError):
+                return None
+            if status.needs_renewal:
+                next_attempt = RenewalLedger.from_config(
+                    self._config, pair.cert_path
+                ).next_attempt_at()
+                deadlines.append(
+                    max(now, datetime.fromtimestamp(next_attempt, timezone.utc))
+                    if next_attempt is not None
+                    else now
+                )
+                continue
+            if status.renew_at is None:
+                return None
+            deadlines.append(status.renew_at)
+        return min(deadlines) if deadlines else None
+
+    def _handle(self, signum, _frame):
+        if signum == signal.SIGHUP:
+            click.echo("Received SIGHUP, checking certificates")
+            self._wakeup.set()
+        else:
+            self.stop()
+
+
+__all__ = ["RenewalDaemon"]
@@ -0,0 +1,165 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import ParseResult, urlparse
+
+import requests
+
+from .tracing import TRACER
+from .util import base_url, write_json_atomic
+
+HEALTH_PATH = "/v1/sys/health?standbyok=true&perfstandbyok=true"
+
+STATE_FILE = "vault-endpoint.json"
+
+
+def _base_of(url: str) -> str:
+    parsed = urlparse(url)
+    return "%s://%s" % (parsed.scheme, parsed.netloc)
+
+
+class Endpoints:
+    """
+    A set of Vault endpoints for the same cluster, e.g. the individual nodes or several
+    load balancers. Requests go to the preferred endpoint, which is the last one that
+    answered successfully. If none is known, the endpoints are probed through the
+    health endpoint, and the healthy endpoint with the lowest latency is preferred.
+    An endpoint that fails is moved to the end of the list, so that the next attempt
+    fails over to another one.
+
+    When a standby node redirects a request to the active node, the active node is
+    preferred from then on, saving the redirect on later requests. With a
+    `state_path`, the preferred endpoint is remembered between runs, so that the next
+    run does not need to probe.
+    """
+
+    _order: List[str]
+    _state_path: Optional[Path]
+    _probe_timeout: float
+
+    def __init__(
+        self,
+        addrs: Sequence[ParseResult],
+        state_path: Optional[Path] = None,
+        probe_timeout: float = 5.0,
+    ):
+        self._configured = [base_url(addr) for addr in addrs]
+        self._order = list(self._configured)
+        self._state_path = state_path
+        self._probe_timeout = probe_timeout
+        self._known = False
+        self._lock = threading.Lock()
+
+    def route(self, url: str) -> Optional[Tuple[str, str]]:
+        """
+        :param url: A URL below one of the configured endpoints
+        :return: The configured endpoint and the remainder of the URL, or None if the
+            URL does not belong to any of the endpoints
+        """
+        for endpoint in self._configured:
+            if url.startswith(endpoint):
+                return endpoint, url[len(endpoint) :]
+        return None
+
+    def select(self, session: requests.Session) -> str:
+        """
+        :return: The endpoint to send the next request to
+        """
+        with self._lock:
+            if not self._known:
+                self._known = True
+                preferred = self._load_state()
+                if preferred is not None:
+                    self._prefer(preferred)
+                else:
+                    self._order = self._probe(session)
+            return self._order[0]
+
+    def report_failure(self, endpoint: str):
+        with self._lock:
+            if endpoint in self._order and len(self._order) > 1:
+                self._order.remove(endpoint)
+                self._order.append(endpoint)
+
+    def report_success(self, endpoint: str, response: requests.Response):
+        """
+        Record the endpoint as preferred, or the active node it redirected to
+        """
+        if response.history:
+            endpoint = _base_of(response.url)
+        with self._lock:
+            changed = self._order[0] != endpoint
+            self._prefer(endpoint)
+        if changed:
+            self._save_state(endpoint)
+
+    def _prefer(self, endpoint: str):
+        if endpoint in self._order:
+            self._order.remove(endpoint)
+        self._order.insert(0, endpoint)
+
+    def _probe(self, session: requests.Session) -> List[str]:
+        """
+        :return: The endpoints ordered by their latency, unhealthy endpoints last
+        """
+
+        def _measure(endpoint: str) -> float:
+            start = time.monotonic()
+            try:
+                response = session.get(
+                    endpoint.rstrip("/") + HEALTH_PATH,
+                    timeout=self._probe_timeout,
+                    allow_redirects=False,
+                )
+            except requests.RequestException:
+                return float("inf")
+            if response.status_code != 200:
+                return float("inf")
+            return time.monotonic() - start
+
+        with TRACER.span("vault.probe", endpoints=len(self._order)) as span:
+            with ThreadPoolExecutor(max_workers=len(self._order)) as pool:
+                latencies: Dict[str, float] = dict(
+                    zip(self._order, pool.map(TRACER.wrap(_measure), self._order))
+                )
+            order = sorted(self._order, key=lambda endpoint: latencies[endpoint])
+            span.set_attribute("selected", order[0])
+        return order
+
+    def _load_state(self) -> Optional[str]:
+        if self._state_path is None:
+            return None
+        try:
+            with self._state_path.open("r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state["endpoints"] != self._configured:
+                return None
+            return state["preferred"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_state(self, preferred: str):
+        if self._state_path is None:
+            return
+        state = {"endpoints": self._configured, "preferred": preferred}
+        # The preferred endpoint is only remembered to save a failover
+        try:
+            write_json_atomic(self._state_path, state)
+        except OSError:
+            pass
+
+    @classmethod
+    def from_config(cls, config) -> Optional["Endpoints"]:
+        """
+        :return: The endpoints, or None if only a single address is configured
+        """
+        if len(config.addrs) < 2:
+            return None
+        state_path = Path(config.cache_dir) / STATE_FILE if config.cache_dir else None
+        return cls(config.addrs, state_path, config.vault_connect_timeout)
+
+
+__all__ = ["Endpoints"]
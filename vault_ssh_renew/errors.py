@@ -1,2 +1,23 @@
 class RenewError(Exception):
     pass
+
+
+class VaultResponseError(RenewError):
+    """
+    Vault answered a request with an error status
+    """
+
+    status_code: int
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TokenRejected(VaultResponseError):
+    """
+    Vault refused the token of a request, e.g. because it expired or was revoked
+    """
+
+    def __init__(self, message: str, status_code: int = 403):
+        super().__init__(message, status_code)
@@ -0,0 +1,186 @@
+import asyncio
+import shlex
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+import click
+
+from .auth import TokenSource
+from .batch import RenewOutcome
+from .cache import StatusCache
+from .cert import HostCertificate, HostCertificateStatus
+from .config import Config
+from .errors import RenewError
+from .policy import RenewalPolicy
+from .tracing import TRACER
+from .vault import VaultConnection, VaultRenewer
+
+
+class FleetEntry(NamedTuple):
+    key_path: Path
+    cert_path: Path
+    principals: Tuple[str, ...]
+
+
+def read_inventory(path: Path) -> Iterator[FleetEntry]:
+    """
+    Read an inventory of host keys. Each non-empty line that does not start with a #
+    contains the path to the public key, the path to the certificate and one or more
+    principals, separated by whitespace.
+    """
+    with open(str(path), "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            fields = shlex.split(line, comments=True)
+            if not fields:
+                continue
+            if len(fields) < 3:
+                raise RenewError(
+                    "%s:%d: Expected key path, certificate path and principals"
+                    % (path, number)
+                )
+            yield FleetEntry(Path(fields[0]), Path(fields[1]), tuple(fields[2:]))
+
+
+class RateLimiter:
+    """
+    Spaces out callers so that no more than `rate` of them proceed per second
+    """
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self._interval:
+            return
+        async with self._lock:
+            loop = asyncio.get_event_loop()
+            delay = self._next - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next = max(self._next, loop.time()) + self._interval
+
+
+class FleetRenewer:
+    """
+    Checks and renews the certificates of many hosts. File access and Vault requests
+    are blocking, so they are dispatched to a thread pool while asyncio bounds the
+    number of hosts in flight and the rate of sign requests. All sign requests share
+    one Vault connection with at least as many pooled HTTP connections as hosts in
+    flight.
+    """
+
+    _config: Config
+    _concurrency: int
+    _qps: float
+
+    def __init__(self, config: Config, concurrency: int, qps: float):
+        self._config = config
+        self._concurrency = concurrency
+        self._qps = qps
+        self._cache = StatusCache.from_config(config)
+        self._tokens = TokenSource.from_config(config)
+        self._connection = None
+
+    def check(self, entry: FleetEntry) -> HostCertificateStatus:
+        return (
+            HostCertificate.get(entry.key_path, entry.cert_path, self._cache)
+            .read()
+            .check_renewal_required(
+                RenewalPolicy.from_config(self._config, entry.principals)
+            )
+        )
+
+    def sign(self, entry: FleetEntry, status: HostCertificateStatus) -> bool:
+        """
+        :return: Whether the certificate was changed
+        """
+
+        def _sign(token: str):
+            return VaultRenewer.build(
+                self._config.addr,
+                token,
+                self._config.ssh_sign_path,
+                status.public_key,
+                entry.principals,
+                entry.cert_path,
+                self._connection,
+            ).renew()
+
+        return self._tokens.call(self._connection, _sign).write_certificate()
+
+    def run(
+        self,
+        entries: List[FleetEntry],
+        progress: Optional[Callable[[Counter, int], None]] = None,
+    ) -> List[Tuple[FleetEntry, RenewOutcome]]:
+        """
+        Process all entries of the inventory
+        :param entries: The hosts to process
+        :param progress: Invoked with the outcome counts whenever an entry completes
+        :return: The outcome for each entry, in inventory order
+        """
+        loop = asyncio.new_event_loop()
+        self._connection = VaultConnection.from_config(
+            self._config, max(self._config.vault_pool_size, self._concurrency)
+        )
+        try:
+            with TRACER.span("fleet", hosts=len(entries)):
+                return loop.run_until_complete(self._run(loop, entries, progress))
+        finally:
+            self._connection.close()
+            self._connection = None
+            loop.close()
+
+    async def _run(self, loop, entries, progress):
+        semaphore = asyncio.Semaphore(self._concurrency)
+        limiter = RateLimiter(self._qps)
+        counts = Counter()
+
+        async def _process(entry: FleetEntry) -> RenewOutcome:
+            async with semaphore:
+                outcome = await self._process(loop, pool, limiter, entry)
+            counts[outcome] += 1
+            if progress:
+                progress(counts, len(entries))
+            return outcome
+
+        with ThreadPoolExecutor(max_workers=self._concurrency) as pool:
+            outcomes = await asyncio.gather(*[_process(entry) for entry in entries])
+        return list(zip(entries, outcomes))
+
+    async def _process(self, loop, pool, limiter, entry: FleetEntry) -> RenewOutcome:
+        try:
+            status = await loop.run_in_executor(pool, TRACER.wrap(self.check), entry)
+            if not status.needs_renewal:
+                return RenewOutcome.NOT_REQUIRED
+            await limiter.wait()
+            changed = await loop.run_in_executor(
+                pool, TRACER.wrap(self.sign), entry, status
+            )
+        except (OSError, RenewError):
+            click.echo(
+                click.style("%s: renewal failed" % entry.cert_path, fg="red"), err=True
+            )
+            if self._config.debug:
+                traceback.print_exc()
+            return RenewOutcome.FAILED
+        return RenewOutcome.RENEWED if changed else RenewOutcome.NOT_REQUIRED
+
+
+def print_progress(counts: Counter, total: int):
+    done = sum(counts.values())
+    step = max(1, total // 20)
+    if done % step == 0 or done == total:
+        click.echo(
+            "[%d/%d] renewed: %d, failed: %d"
+            % (done, total, counts[RenewOutcome.RENEWED], counts[RenewOutcome.FAILED]),
+            err=True,
+        )
+
+
+__all__ = ["FleetEntry", "FleetRenewer", "RateLimiter", "read_inventory"]
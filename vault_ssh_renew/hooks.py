@@ -0,0 +1,193 @@
+import os
+import signal
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import click
+
+from .metrics import METRICS
+from .tracing import TRACER
+
+if TYPE_CHECKING:
+    import subprocess
+
+
+class HookEvent:
+    """
+    A pending invocation of a hook, together with the certificates it concerns
+    """
+
+    kind: str
+    command: str
+    renewed: Dict[str, Tuple[Optional[datetime], Optional[datetime]]]
+    failed: List[str]
+
+    def __init__(self, kind: str, command: str):
+        self.kind = kind
+        self.command = command
+        self.renewed = OrderedDict()
+        self.failed = []
+
+    def merge(self, other: "HookEvent"):
+        self.renewed.update(other.renewed)
+        self.failed.extend(path for path in other.failed if path not in self.failed)
+
+    def environment(self) -> Dict[str, str]:
+        """
+        :return: The variables describing the event to the hook
+        """
+        env = {
+            "VAULT_SSH_HOOK": self.kind,
+            "VAULT_SSH_RENEWED_CERTS": os.pathsep.join(self.renewed),
+            "VAULT_SSH_FAILED_CERTS": os.pathsep.join(self.failed),
+        }
+        if len(self.renewed) == 1:
+            ((path, (not_before, not_after)),) = self.renewed.items()
+            env["VAULT_SSH_CERT_PATH"] = path
+            if not_before is not None and not_after is not None:
+                env["VAULT_SSH_CERT_NOT_BEFORE"] = not_before.isoformat()
+                env["VAULT_SSH_CERT_NOT_AFTER"] = not_after.isoformat()
+        return env
+
+
+class HookRunner:
+    """
+    Runs hooks one at a time on a background thread, so that a slow hook does not hold
+    up renewals. Commands are split into arguments like a shell would, but are not run
+    through a shell. A hook that does not finish within the timeout is killed, together
+    with any processes it started.
+
+    An event for a hook that is still waiting to run is merged into the waiting one, so
+    that several renewals in quick succession cause a single reload of sshd.
+    """
+
+    _timeout: float
+    _debug: bool
+
+    def __init__(self, timeout: float, debug: bool = False):
+        self._timeout = timeout
+        self._debug = debug
+        self._pending: "OrderedDict[Tuple[str, str], HookEvent]" = OrderedDict()
+        self._running = False
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, event: HookEvent):
+        key = (event.kind, event.command)
+        with self._condition:
+            if key in self._pending:
+                self._pending[key].merge(event)
+            else:
+                self._pending[key] = event
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all submitted hooks have run
+        :return: False if hooks were still pending when the timeout expired
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._running, timeout
+            )
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                _, event = self._pending.popitem(last=False)
+                self._running = True
+            try:
+                self.run(event)
+            finally:
+                with self._condition:
+                    self._running = False
+                    self._condition.notify_all()
+
+    def run(self, event: HookEvent) -> Optional[int]:
+        """
+        Run a hook in the calling thread
+        :return: The exit status of the hook, or None if it could not be run or timed out
+        """
+        with TRACER.span("hook", hook=event.kind) as span, METRICS.time("hook"):
+            status = self._execute(event)
+            span.set_attribute("exit_status", status)
+        return status
+
+    def _execute(self, event: HookEvent) -> Optional[int]:
+        # Only needed when a hook actually runs
+        import shlex
+        import subprocess
+
+        env = dict(os.environ)
+        env.update(event.environment())
+        try:
+            process = subprocess.Popen(
+                shlex.split(event.command),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                env=env,
+                universal_newlines=True,
+                start_new_session=True,
+            )
+        except (OSError, ValueError) as e:
+            click.echo(
+                click.style("Could not run %s hook: %s" % (event.kind, e), fg="red"),
+                err=True,
+            )
+            return None
+        # The timer kills the whole process group, which also closes the output pipe
+        # if the hook left processes running in the background
+        timed_out = threading.Event()
+        timer = threading.Timer(self._timeout, self._kill, (process, timed_out))
+        timer.start()
+        try:
+            output, _ = process.communicate()
+        finally:
+            timer.cancel()
+        if timed_out.is_set():
+            click.echo(
+                click.style(
+                    "The %s hook did not finish within %ss and was killed"
+                    % (event.kind, self._timeout),
+                    fg="red",
+                ),
+                err=True,
+            )
+            self._echo_output(output)
+            return None
+        if process.returncode != 0:
+            click.echo(
+                click.style(
+                    "The %s hook failed with exit status %d"
+                    % (event.kind, process.returncode),
+                    fg="red",
+                ),
+                err=True,
+            )
+            self._echo_output(output)
+        elif self._debug:
+            self._echo_output(output)
+        return process.returncode
+
+    @staticmethod
+    def _kill(process: "subprocess.Popen", timed_out: threading.Event):
+        timed_out.set()
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def _echo_output(output: str):
+        if output:
+            click.echo(output.rstrip("\n"), err=True)
+
+
+__all__ = ["HookEvent", "HookRunner"]
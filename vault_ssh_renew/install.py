@@ -0,0 +1,79 @@
+import os
+import stat
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Optional
+
+from .errors import RenewError
+
+# The mode of newly created certificates, like ssh-keygen would write them
+DEFAULT_MODE = 0o644
+
+
+def _read_existing(path: Path) -> Optional[bytes]:
+    try:
+        with open(str(path), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def install_file(path: Path, data: bytes) -> bool:
+    """
+    Atomically replace a file with new contents, unless it already has these contents.
+    The new contents are written to a temporary file in the same directory, which
+    receives the mode and ownership of the file it replaces and is synced to disk
+    before it is renamed over the file. The directory is synced afterwards, so that
+    the file is either completely old or completely new after a crash.
+    :return: Whether the file was changed
+    :raises RenewError: If the file could not be replaced atomically
+    """
+    path = Path(str(path))
+    try:
+        if _read_existing(path) == data:
+            return False
+        try:
+            existing = os.stat(str(path))
+        except FileNotFoundError:
+            existing = None
+        directory = str(path.parent)
+        with NamedTemporaryFile(
+            dir=directory, prefix=".%s." % path.name, delete=False
+        ) as tmp:
+            try:
+                tmp.write(data)
+                tmp.flush()
+                if existing is None:
+                    os.fchmod(tmp.fileno(), DEFAULT_MODE)
+                else:
+                    os.fchmod(tmp.fileno(), stat.S_IMODE(existing.st_mode))
+                    created = os.fstat(tmp.fileno())
+                    if (created.st_uid, created.st_gid) != (
+                        existing.st_uid,
+                        existing.st_gid,
+                    ):
+                        os.fchown(tmp.fileno(), existing.st_uid, existing.st_gid)
+                os.fsync(tmp.fileno())
+            except OSError:
+                os.unlink(tmp.name)
+                raise
+        try:
+            os.replace(tmp.name, str(path))
+        except OSError:
+            os.unlink(tmp.name)
+            raise
+        _fsync_directory(directory)
+    except OSError as e:
+        raise RenewError("Could not install %s: %s" % (path, e))
+    return True
+
+
+__all__ = ["install_file"]
@@ -0,0 +1,142 @@
+import json
+import socket
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .policy import spread_fraction
+from .util import write_json_atomic
+
+# The number of attempts kept per certificate
+HISTORY = 10
+
+# The delay after the first failed attempt, doubled with each further failure
+BACKOFF_BASE = 60.0
+
+
+def ledger_path_for(cert_path: Path) -> Path:
+    """
+    Like the lock file, the ledger lives next to the certificate, so that it survives
+    restarts of containers that mount the directory
+    """
+    return cert_path.with_name("." + cert_path.name + ".ledger")
+
+
+class Attempt(NamedTuple):
+    timestamp: float
+    outcome: str
+    status_code: Optional[int]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "timestamp": self.timestamp,
+            "outcome": self.outcome,
+            "status_code": self.status_code,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Attempt":
+        status_code = data.get("status_code")
+        return cls(
+            float(data["timestamp"]),
+            str(data["outcome"]),
+            int(status_code) if status_code is not None else None,
+        )
+
+    @property
+    def failed(self) -> bool:
+        return self.outcome == "failed"
+
+
+class RenewalLedger:
+    """
+    The recent sign attempts for a certificate, with their outcome and the status
+    Vault answered with. Before another attempt, at least `min_interval` seconds
+    have to pass since the last one. After consecutive failures, the interval grows
+    exponentially up to `backoff_cap` seconds, at a stable per-host fraction between
+    half and all of it, so that a failing fleet does not retry in lockstep. Restarts
+    and crash loops therefore do not multiply the requests sent to Vault.
+    """
+
+    _path: Path
+    _min_interval: float
+    _backoff_cap: float
+
+    def __init__(self, cert_path: Path, min_interval: float, backoff_cap: float):
+        self._path = ledger_path_for(Path(str(cert_path)))
+        self._min_interval = min_interval
+        self._backoff_cap = backoff_cap
+
+    @classmethod
+    def from_config(cls, config, cert_path: Path) -> "RenewalLedger":
+        return cls(cert_path, config.sign_min_interval, config.sign_backoff_cap)
+
+    def attempts(self) -> List[Attempt]:
+        try:
+            with self._path.open("r", encoding="utf-8") as f:
+                return [Attempt.from_dict(entry) for entry in json.load(f)]
+        except (OSError, ValueError, KeyError, TypeError):
+            return []
+
+    def failures(self, attempts: Optional[List[Attempt]] = None) -> int:
+        """
+        :return: The number of failed attempts since the last successful one
+        """
+        if attempts is None:
+            attempts = self.attempts()
+        count = 0
+        for attempt in reversed(attempts):
+            if not attempt.failed:
+                break
+            count += 1
+        return count
+
+    def last_renewal(self) -> Optional[float]:
+        """
+        :return: The time of the last attempt that installed a new certificate, or
+            None if there was none
+        """
+        for attempt in reversed(self.attempts()):
+            if attempt.outcome == "renewed":
+                return attempt.timestamp
+        return None
+
+    def next_attempt_at(self) -> Optional[float]:
+        """
+        :return: The point in time from which another attempt may be made, or None if
+            there were no attempts
+        """
+        attempts = self.attempts()
+        if not attempts:
+            return None
+        delay = self._min_interval
+        failures = self.failures(attempts)
+        if failures and self._backoff_cap > 0:
+            backoff = min(self._backoff_cap, BACKOFF_BASE * 2 ** (failures - 1))
+            fraction = spread_fraction(
+                "%s:%s:%d" % (socket.gethostname(), self._path, failures)
+            )
+            delay = max(delay, backoff * (0.5 + fraction / 2))
+        return attempts[-1].timestamp + delay
+
+    def record(self, outcome: str, status_code: Optional[int] = None):
+        """
+        :param outcome: renewed, unchanged or failed
+        :param status_code: The status Vault answered the sign request with, if any
+        """
+        attempts = self.attempts()
+        kept = attempts[-(HISTORY - 1) :]
+        renewals = [attempt for attempt in attempts if attempt.outcome == "renewed"]
+        if renewals and renewals[-1] not in kept:
+            # Keep the last renewal, which the metrics report, past a run of failures
+            kept = [renewals[-1]] + kept[1:]
+        attempts = kept
+        attempts.append(Attempt(time.time(), outcome, status_code))
+        # Failing to write the ledger must not fail the renewal
+        try:
+            write_json_atomic(self._path, [attempt.to_dict() for attempt in attempts])
+        except OSError:
+            pass
+
+
+__all__ = ["Attempt", "RenewalLedger", "ledger_path_for"]
@@ -0,0 +1,89 @@
+import fcntl
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from .errors import RenewError
+from .tracing import TRACER
+
+# How often to try again while another process holds the lock
+POLL_INTERVAL = 0.1
+
+
+def lock_path_for(cert_path: Path) -> Path:
+    """
+    The lock file lives next to the certificate, so that it is shared by everything
+    that can replace the certificate, including containers mounting the directory
+    """
+    return cert_path.with_name("." + cert_path.name + ".lock")
+
+
+class CertificateLock:
+    """
+    An advisory lock (flock) serializing renewals of one certificate across all
+    processes on the host. It is released when the process exits, even if it crashes.
+    """
+
+    _path: Path
+    _timeout: float
+    contended: bool
+    waited: float
+
+    def __init__(self, cert_path: Path, timeout: float):
+        """
+        :param timeout: The number of seconds to wait for another process to release
+            the lock
+        """
+        self._path = lock_path_for(Path(str(cert_path)))
+        self._timeout = timeout
+        self._fd: Optional[int] = None
+        self.contended = False
+        self.waited = 0.0
+
+    def acquire(self) -> "CertificateLock":
+        """
+        :raises RenewError: If the lock file cannot be opened or the lock was not
+            released in time
+        """
+        with TRACER.span("lock", lock=str(self._path)) as span:
+            try:
+                fd = os.open(str(self._path), os.O_RDWR | os.O_CREAT, 0o600)
+            except OSError as e:
+                raise RenewError("Could not open lock file %s: %s" % (self._path, e))
+            start = time.monotonic()
+            try:
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        self.contended = True
+                    if time.monotonic() - start >= self._timeout:
+                        raise RenewError(
+                            "Timed out waiting for another renewal of %s"
+                            % self._path.name
+                        )
+                    time.sleep(POLL_INTERVAL)
+            except BaseException:
+                os.close(fd)
+                raise
+            self.waited = time.monotonic() - start
+            self._fd = fd
+            span.set_attribute("contended", self.contended)
+        return self
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "CertificateLock":
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+__all__ = ["CertificateLock", "lock_path_for"]
@@ -0,0 +1,266 @@
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+from .util import write_atomic
+
+# Upper bounds of the duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+DESCRIPTIONS = {
+    "vault_ssh_renew_cert_not_before_timestamp_seconds": (
+        "gauge",
+        "Start of the validity interval of the certificate.",
+    ),
+    "vault_ssh_renew_cert_not_after_timestamp_seconds": (
+        "gauge",
+        "End of the validity interval of the certificate.",
+    ),
+    "vault_ssh_renew_cert_renew_at_timestamp_seconds": (
+        "gauge",
+        "Point in time at which the certificate is due for renewal.",
+    ),
+    "vault_ssh_renew_last_check_timestamp_seconds": (
+        "gauge",
+        "Time of the last check of the certificate.",
+    ),
+    "vault_ssh_renew_last_renewal_timestamp_seconds": (
+        "gauge",
+        "Time of the last successful renewal of the certificate.",
+    ),
+    "vault_ssh_renew_checks_total": ("counter", "Certificate checks by outcome."),
+    "vault_ssh_renew_lock_contended_total": (
+        "counter",
+        "Renewals that waited for another process renewing the same certificate.",
+    ),
+    "vault_ssh_renew_relay_requests_total": (
+        "counter",
+        "Sign requests received by the relay, by whether they were forwarded.",
+    ),
+    "vault_ssh_renew_vault_tokens_total": (
+        "counter",
+        "Tokens used for Vault requests, by whether they were cached, renewed or "
+        "obtained by logging in.",
+    ),
+    "vault_ssh_renew_vault_responses_total": (
+        "counter",
+        "Responses received from Vault by HTTP status code.",
+    ),
+    "vault_ssh_renew_phase_duration_seconds": (
+        "histogram",
+        "Duration of the phases of the renewal workflow.",
+    ),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '%s="%s"'
+            % (
+                key,
+                value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+            )
+            for key, value in pairs
+        )
+        + "}"
+    )
+
+
+class Metrics:
+    """
+    A minimal metrics registry that renders the Prometheus text exposition format.
+    Updates only touch a dictionary under a lock, so they are cheap enough to be made
+    on every check.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, List[float]]] = {}
+        self.healthy = True
+
+    @staticmethod
+    def _key(labels: Dict[str, str]) -> Labels:
+        return tuple(sorted(labels.items()))
+
+    def set(self, name: str, value: float, **labels: str):
+        with self._lock:
+            self._values.setdefault(name, {})[self._key(labels)] = value
+
+    def inc(self, name: str, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # Bucket counts followed by the sum and the total count
+            data = series.setdefault(key, [0.0] * (len(DURATION_BUCKETS) + 2))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(
+                "vault_ssh_renew_phase_duration_seconds",
+                time.perf_counter() - start,
+                phase=phase,
+            )
+
+    def get(self, name: str, **labels: str) -> Optional[float]:
+        with self._lock:
+            return self._values.get(name, {}).get(self._key(labels))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+        self.healthy = True
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted(set(self._values) | set(self._histograms)):
+                kind, description = DESCRIPTIONS.get(name, ("untyped", name))
+                lines.append("# HELP %s %s" % (name, description))
+                lines.append("# TYPE %s %s" % (name, kind))
+                for labels, value in sorted(self._values.get(name, {}).items()):
+                    lines.append("%s%s %r" % (name, _format_labels(labels), value))
+                for labels, data in sorted(self._histograms.get(name, {}).items()):
+                    for bound, count in zip(DURATION_BUCKETS, data):
+                        lines.append(
+                            "%s_bucket%s %r"
+                            % (name, _format_labels(labels, ("le", repr(bound))), count)
+                        )
+                    lines.append(
+                        "%s_bucket%s %r"
+                        % (name, _format_labels(labels, ("le", "+Inf")), data[-1])
+                    )
+                    lines.append(
+                        "%s_sum%s %r" % (name, _format_labels(labels), data[-2])
+                    )
+                    lines.append(
+                        "%s_count%s %r" % (name, _format_labels(labels), data[-1])
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """
+        Atomically write the metrics to a file for the node_exporter textfile collector
+        """
+        write_atomic(Path(path), self.render(), 0o644)
+
+
+METRICS = Metrics()
+
+
+def write_textfile(config):
+    """
+    Write the global metrics to the text file configured, reporting but not raising
+    errors
+    """
+    try:
+        METRICS.write_textfile(config.metrics_textfile)
+    except OSError:
+        click.echo(click.style("Could not write metrics", fg="red"), err=True)
+        if config.debug:
+            traceback.print_exc()
+
+
+def create_http_server(address: Tuple[str, int], handler: type):
+    """
+    Create an HTTP server that handles each request in a thread. http.server is
+    imported here, since most runs do not serve anything.
+    """
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    return _ThreadingHTTPServer(address, handler)
+
+
+class MetricsServer:
+    """
+    Serves /metrics and /healthz over HTTP from a background thread
+    """
+
+    def __init__(self, address: Tuple[str, int], metrics: Metrics = METRICS):
+        from http.server import BaseHTTPRequestHandler
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    status, body = 200, metrics.render()
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/healthz":
+                    status = 200 if metrics.healthy else 503
+                    body = "ok\n" if metrics.healthy else "unhealthy\n"
+                    content_type = "text/plain; charset=utf-8"
+                else:
+                    status, body, content_type = 404, "not found\n", "text/plain"
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = create_http_server(address, _Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "MetricsServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def parse_listen_address(value: str) -> Tuple[str, int]:
+    """
+    Parse an address of the form [host]:port
+    """
+    host, _, port = value.rpartition(":")
+    return host.strip("[]"), int(port)
+
+
+__all__ = [
+    "METRICS",
+    "Metrics",
+    "MetricsServer",
+    "create_http_server",
+    "parse_listen_address",
+    "write_textfile",
+]
@@ -0,0 +1,139 @@
+import hashlib
+import socket
+from datetime import datetime, timedelta
+from typing import Collection, FrozenSet, Iterable, Optional, Union
+
+from .principals import PrincipalResolver
+
+
+def spread_fraction(seed: str) -> float:
+    """
+    Map a seed to a stable value in [0, 1). Unlike hash(), the result does not change
+    between processes or hosts.
+    """
+    digest = hashlib.sha256(seed.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+class RenewalPolicy:
+    """
+    Decides when a certificate is due for renewal. A certificate is renewed once less
+    than `threshold` of its lifetime is left. With a `spread`, each host renews up to
+    `spread` earlier than that, at an offset derived from a stable seed (usually its
+    principals), so that certificates issued at the same time are not all renewed on
+    the same day.
+
+    If `principals` is given, a certificate that was issued for a different set of
+    principals is renewed regardless of its validity.
+    """
+
+    threshold: timedelta
+    spread: timedelta
+    seed: str
+    principals: Optional[FrozenSet[str]]
+
+    def __init__(
+        self,
+        threshold: timedelta,
+        spread: timedelta = timedelta(0),
+        seed: str = "",
+        principals: Optional[Iterable[str]] = None,
+    ):
+        self.threshold = threshold
+        self.spread = spread
+        self.seed = seed
+        self.principals = frozenset(principals) if principals is not None else None
+
+    @classmethod
+    def from_config(cls, config, principals: Collection[str] = None) -> "RenewalPolicy":
+        """
+        Build the policy selected by the configuration
+        :param principals: The principals to request, if different from the ones in
+            the configuration
+        """
+        if principals is None:
+            principals = config.ssh_principals
+        if not principals:
+            # Principals are only looked up for sign requests, so compare with the
+            # ones found last, if any, and seed the spread with the hostname
+            principals = PrincipalResolver.from_config(config).cached()
+            seed = socket.gethostname()
+        else:
+            seed = ",".join(sorted(principals))
+        spread = timedelta(days=config.renewal_spread_days)
+        requested = principals if config.check_principals else None
+        if config.renewal_fraction is not None:
+            return LifetimeFractionPolicy(
+                config.renewal_fraction,
+                timedelta(hours=config.renewal_floor_hours),
+                spread,
+                seed,
+                requested,
+            )
+        return cls(
+            timedelta(days=config.renewal_threshold_days), spread, seed, requested
+        )
+
+    @classmethod
+    def coerce(cls, limit: Union[timedelta, "RenewalPolicy"]) -> "RenewalPolicy":
+        return limit if isinstance(limit, RenewalPolicy) else cls(limit)
+
+    def required_lifetime(self, not_before: datetime, not_after: datetime) -> timedelta:
+        """
+        Subclasses may override this to make the threshold depend on the certificate
+        :return: The lifetime a certificate needs to have left to not be renewed
+        """
+        return self.threshold
+
+    def renew_at(self, not_before: datetime, not_after: datetime) -> datetime:
+        """
+        :return: The point in time at which the certificate should be renewed
+        """
+        due = not_after - self.required_lifetime(not_before, not_after)
+        if self.spread > timedelta(0):
+            offset = self.spread * spread_fraction(self.seed)
+            # Never schedule the renewal before the certificate became valid
+            due = max(min(due, not_before), due - offset)
+        return due
+
+    def needs_renewal(
+        self, not_before: datetime, not_after: datetime, now: datetime
+    ) -> bool:
+        return now < not_before or now >= self.renew_at(not_before, not_after)
+
+    def principals_differ(self, principals: Collection[str]) -> bool:
+        """
+        :param principals: The principals a certificate was issued for
+        :return: Whether they differ from the requested principals
+        """
+        return self.principals is not None and self.principals != frozenset(principals)
+
+
+class LifetimeFractionPolicy(RenewalPolicy):
+    """
+    Renews a certificate once less than a fraction of its total lifetime is left, so
+    that short and long lived certificates are both renewed in time without being
+    renewed on every run. The `floor` is the lifetime a certificate should have left
+    at least, however short it was issued for.
+    """
+
+    fraction: float
+    floor: timedelta
+
+    def __init__(
+        self,
+        fraction: float,
+        floor: timedelta = timedelta(0),
+        spread: timedelta = timedelta(0),
+        seed: str = "",
+        principals: Optional[Iterable[str]] = None,
+    ):
+        super().__init__(floor, spread, seed, principals)
+        self.fraction = fraction
+        self.floor = floor
+
+    def required_lifetime(self, not_before: datetime, not_after: datetime) -> timedelta:
+        return max((not_after - not_before) * self.fraction, self.floor)
+
+
+__all__ = ["LifetimeFractionPolicy", "RenewalPolicy", "spread_fraction"]
@@ -0,0 +1,290 @@
+import ipaddress
+import json
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import click
+
+from .errors import RenewError
+from .tracing import TRACER
+from .util import write_json_atomic
+
+PRINCIPALS_CACHE_FILE = "principals.json"
+
+DEFAULT_METADATA_PATH = "/run/cloud-init/instance-data.json"
+
+HOSTS_PATH = "/etc/hosts"
+
+IF_INET6_PATH = "/proc/net/if_inet6"
+
+# ioctl to read the IPv4 address of a network interface
+SIOCGIFADDR = 0x8915
+
+
+def _hostname() -> List[str]:
+    return [socket.gethostname()]
+
+
+def _fqdn() -> List[str]:
+    # May block on reverse DNS lookups, hence the timeout of the resolver
+    return [socket.getfqdn()]
+
+
+def _hosts(path: str = HOSTS_PATH) -> List[str]:
+    """
+    The fully qualified names that /etc/hosts lists for this host, i.e. on the lines
+    that also list its hostname
+    """
+    hostname = socket.gethostname().split(".")[0]
+    names: List[str] = []
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                fields = line.split("#", 1)[0].split()[1:]
+                if not any(name.split(".")[0] == hostname for name in fields):
+                    continue
+                names.extend(name for name in fields if "." in name)
+    except OSError:
+        pass
+    return names
+
+
+def _ipv4_addresses() -> List[str]:
+    import fcntl
+    import struct
+
+    addresses = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, name in socket.if_nameindex():
+            try:
+                packed = fcntl.ioctl(
+                    sock.fileno(),
+                    SIOCGIFADDR,
+                    struct.pack("256s", name[:15].encode("utf-8")),
+                )
+            except OSError:
+                # No IPv4 address on this interface
+                continue
+            addresses.append(socket.inet_ntoa(packed[20:24]))
+    return addresses
+
+
+def _ipv6_addresses(path: str = IF_INET6_PATH) -> List[str]:
+    addresses = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 6:
+                    addresses.append(
+                        str(ipaddress.IPv6Address(bytes.fromhex(fields[0])))
+                    )
+    except (OSError, ValueError):
+        pass
+    return addresses
+
+
+def _addresses() -> List[str]:
+    """
+    The global IPv4 and IPv6 addresses of the network interfaces
+    """
+    addresses = []
+    for address in _ipv4_addresses() + _ipv6_addresses():
+        ip = ipaddress.ip_address(address)
+        if not (ip.is_loopback or ip.is_link_local or ip.is_unspecified):
+            addresses.append(address)
+    return addresses
+
+
+def read_metadata(path: Path) -> List[str]:
+    """
+    Read principals from an instance metadata file. This is either the instance data
+    written by cloud-init, whose local and public hostnames are used, a JSON list of
+    names, or a text file with one name per line.
+    """
+    try:
+        with open(str(path), "r", encoding="utf-8") as f:
+            text = f.read()
+    except OSError:
+        return []
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return [line.strip() for line in text.splitlines() if line.strip()]
+    if isinstance(data, list):
+        return [str(name) for name in data]
+    if isinstance(data, dict):
+        v1 = data.get("v1") or {}
+        return [
+            str(v1[key])
+            for key in ("local_hostname", "public_hostname")
+            if isinstance(v1, dict) and v1.get(key)
+        ]
+    return []
+
+
+PRINCIPAL_SOURCES: Dict[str, str] = {
+    "hostname": "The hostname as returned by gethostname()",
+    "fqdn": "The fully qualified domain name, which may require DNS lookups",
+    "hosts": "The fully qualified names listed for the hostname in /etc/hosts",
+    "addresses": "The global IP addresses of the network interfaces",
+    "metadata": "The hostnames in the instance metadata file",
+}
+
+
+class PrincipalResolver:
+    """
+    Determines the principals to request for the host when none are configured. The
+    sources are consulted in the declared order and their results concatenated,
+    without duplicates. Resolution happens on the first sign request of a run, in a
+    thread that is abandoned after `timeout` seconds, so that a broken resolver does
+    not block the run indefinitely.
+
+    The result is cached for `ttl` seconds, in memory and, with a `cache_path`, on
+    disk for later runs. If resolution fails or times out, a cached result is used
+    even if it is older.
+    """
+
+    _sources: Sequence[str]
+    _metadata_path: Path
+    _timeout: float
+    _ttl: float
+    _cache_path: Optional[Path]
+
+    def __init__(
+        self,
+        sources: Sequence[str] = ("fqdn",),
+        metadata_path: Path = Path(DEFAULT_METADATA_PATH),
+        timeout: float = 5.0,
+        ttl: float = 3600.0,
+        cache_path: Optional[Path] = None,
+    ):
+        unknown = [source for source in sources if source not in PRINCIPAL_SOURCES]
+        if unknown:
+            raise RenewError("Unknown principal sources: %s" % ", ".join(unknown))
+        self._sources = list(sources)
+        self._metadata_path = metadata_path
+        self._timeout = timeout
+        self._ttl = ttl
+        self._cache_path = cache_path
+        self._cached: Optional[Dict] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "PrincipalResolver":
+        return cls(
+            config.principal_sources,
+            Path(config.principal_metadata_path),
+            config.principal_timeout,
+            config.principal_cache_ttl,
+            (
+                Path(config.cache_dir) / PRINCIPALS_CACHE_FILE
+                if config.cache_dir
+                else None
+            ),
+        )
+
+    def _key(self) -> List[str]:
+        return self._sources + [str(self._metadata_path)]
+
+    def _source(self, name: str) -> Callable[[], List[str]]:
+        if name == "metadata":
+            return lambda: read_metadata(self._metadata_path)
+        return {
+            "hostname": _hostname,
+            "fqdn": _fqdn,
+            "hosts": _hosts,
+            "addresses": _addresses,
+        }[name]
+
+    def cached(self) -> Optional[List[str]]:
+        """
+        :return: The principals of the last resolution, however old, or None if they
+            were never resolved
+        """
+        with self._lock:
+            entry = self._load()
+        return list(entry["principals"]) if entry is not None else None
+
+    def resolve(self) -> List[str]:
+        """
+        :return: The principals of the host
+        :raises RenewError: If no principals could be determined
+        """
+        with self._lock:
+            entry = self._load()
+            if entry is not None and time.time() - entry["resolved_at"] < self._ttl:
+                return list(entry["principals"])
+            with TRACER.span("principals.resolve", sources=",".join(self._sources)):
+                try:
+                    principals = self._resolve()
+                except RenewError:
+                    if entry is None:
+                        raise
+                    return list(entry["principals"])
+            self._store(principals)
+            return principals
+
+    def _resolve(self) -> List[str]:
+        result: Dict[str, List[str]] = {}
+
+        def _run():
+            names: List[str] = []
+            for source in self._sources:
+                try:
+                    found = self._source(source)()
+                except Exception as e:
+                    # The other sources may still find the principals
+                    click.echo(
+                        click.style(
+                            "Could not look up principals from %s: %s" % (source, e),
+                            fg="yellow",
+                        ),
+                        err=True,
+                    )
+                    continue
+                for name in found:
+                    if name and name not in names:
+                        names.append(name)
+            result["names"] = names
+
+        thread = threading.Thread(target=TRACER.wrap(_run), daemon=True)
+        thread.start()
+        thread.join(self._timeout)
+        if thread.is_alive():
+            raise RenewError(
+                "Resolving principals took longer than %gs" % self._timeout
+            )
+        if not result.get("names"):
+            raise RenewError("Could not determine any principals for the host")
+        return result["names"]
+
+    def _load(self) -> Optional[Dict]:
+        if self._cached is None and self._cache_path is not None:
+            try:
+                with self._cache_path.open("r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                if entry["key"] == self._key() and entry["principals"]:
+                    self._cached = {
+                        "principals": [str(name) for name in entry["principals"]],
+                        "resolved_at": float(entry["resolved_at"]),
+                    }
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        return self._cached
+
+    def _store(self, principals: List[str]):
+        self._cached = {"principals": principals, "resolved_at": time.time()}
+        if self._cache_path is None:
+            return
+        # The principals are only cached to save time
+        try:
+            write_json_atomic(self._cache_path, dict(self._cached, key=self._key()))
+        except OSError:
+            pass
+
+
+__all__ = ["PRINCIPAL_SOURCES", "PrincipalResolver", "read_metadata"]
@@ -0,0 +1,323 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .auth import TokenSource, token_headers
+from .errors import RenewError, TokenRejected
+from .metrics import METRICS, create_http_server
+from .tracing import TRACER
+from .util import base_url
+from .vault import VaultConnection
+
+# Answered on the health endpoint, so that the relay can be listed among several
+# Vault addresses
+HEALTH = {"initialized": True, "sealed": False, "standby": False}
+
+# How long the capabilities of a client token are trusted before Vault is asked again
+CAPABILITIES_TTL = 300.0
+
+# The number of client tokens whose capabilities are kept
+MAX_CACHED_TOKENS = 4096
+
+# Capabilities that allow a token to use the sign path
+SIGN_CAPABILITIES = frozenset(["create", "update", "root"])
+
+# The largest request body accepted, far more than a public key and its principals
+MAX_REQUEST_SIZE = 1024 * 1024
+
+
+class BlockingRateLimiter:
+    """
+    Spaces out callers so that no more than `rate` of them proceed per second. The
+    threaded counterpart of the fleet's RateLimiter.
+    """
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self._interval:
+            return
+        with self._lock:
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next = max(self._next, time.monotonic()) + self._interval
+
+
+class _Call:
+    """
+    A request to Vault in flight, which identical requests wait for. Unless the
+    request completes, its result is an error response.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Tuple[int, bytes]] = (500, b"")
+
+
+def _error(status: int, message: str) -> Tuple[int, bytes]:
+    return status, json.dumps({"errors": [message]}).encode("utf-8")
+
+
+class SignRelay:
+    """
+    A local HTTP service that accepts sign requests in the format of the Vault SSH
+    secrets engine and forwards them to Vault with its own token, over one pooled
+    connection. Forwarded requests are limited in number and rate, and identical
+    requests (same public key and principals) that arrive while one is in flight
+    receive its response instead of being forwarded again.
+
+    Only requests with a client token that may use the sign path are forwarded. The
+    relay asks Vault for the capabilities of each client token and caches the answer
+    for a few minutes, so that a node costs Vault one extra request per interval.
+    """
+
+    _path: str
+    _url: str
+    _tokens: TokenSource
+    _connection: VaultConnection
+
+    def __init__(
+        self,
+        config,
+        address: Tuple[str, int],
+        concurrency: int,
+        qps: float,
+        connection: Optional[VaultConnection] = None,
+    ):
+        """
+        :param config: The configuration for the upstream Vault
+        :param address: The host and port to listen on
+        :param concurrency: The maximum number of requests forwarded at a time
+        :param qps: The maximum number of requests forwarded per second, 0 for none
+        """
+        self._sign_path = config.ssh_sign_path.strip("/")
+        self._path = "/v1/" + self._sign_path
+        self._url = base_url(config.addr) + "/v1/" + config.ssh_sign_path
+        self._capabilities_url = base_url(config.addr) + "/v1/sys/capabilities-self"
+        self._tokens = TokenSource.from_config(config)
+        self._connection = (
+            connection
+            if connection is not None
+            else VaultConnection.from_config(
+                config, max(config.vault_pool_size, concurrency)
+            )
+        )
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._limiter = BlockingRateLimiter(qps)
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, _Call] = {}
+        self._capabilities: Dict[str, Tuple[bool, float]] = {}
+        relay = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path.split("?")[0] == "/v1/sys/health":
+                    self._respond(200, json.dumps(HEALTH).encode("utf-8"))
+                else:
+                    self._respond(*_error(404, "not found"))
+
+            def do_POST(self):
+                if self.path.split("?")[0] != relay._path:
+                    self._reject(404, "not found")
+                    return
+                try:
+                    length = int(self.headers["Content-Length"])
+                except (TypeError, ValueError):
+                    length = -1
+                if length < 0:
+                    self._reject(400, "missing or invalid Content-Length")
+                    return
+                if length > MAX_REQUEST_SIZE:
+                    self._reject(413, "request body too large")
+                    return
+                body = self.rfile.read(length)
+                try:
+                    payload = json.loads(body.decode("utf-8"))
+                except ValueError:
+                    self._respond(*_error(400, "invalid request body"))
+                    return
+                denied = relay.authorize(self._client_token())
+                if denied is not None:
+                    self._respond(*denied)
+                    return
+                self._respond(*relay.sign(payload))
+
+            def _client_token(self) -> Optional[str]:
+                token = self.headers.get("X-Vault-Token")
+                authorization = self.headers.get("Authorization", "")
+                if not token and authorization.startswith("Bearer "):
+                    token = authorization[len("Bearer ") :]
+                return token
+
+            def _reject(self, status: int, message: str):
+                # The body is left unread, so the connection cannot be used again
+                self._respond(*_error(status, message), close=True)
+
+            def _respond(self, status: int, data: bytes, close: bool = False):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if close:
+                    self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = create_http_server(address, _Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def authorize(self, token: Optional[str]) -> Optional[Tuple[int, bytes]]:
+        """
+        Check that a client token may use the sign path
+        :return: The error response to send if the request must not be forwarded
+        """
+        if not token:
+            METRICS.inc("vault_ssh_renew_relay_requests_total", outcome="denied")
+            return _error(403, "permission denied")
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._capabilities.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            allowed = cached[0]
+        else:
+            # Concurrent requests with the same token wait for a single check
+            denied, _ = self._single_flight(
+                "token:" + key, lambda: self._check(token, key)
+            )
+            return denied
+        if not allowed:
+            METRICS.inc("vault_ssh_renew_relay_requests_total", outcome="denied")
+            return _error(403, "permission denied")
+        return None
+
+    def _check(self, token: str, key: str) -> Optional[Tuple[int, bytes]]:
+        try:
+            allowed = self._may_sign(token)
+        except RenewError as e:
+            METRICS.inc("vault_ssh_renew_relay_requests_total", outcome="error")
+            return _error(502, str(e))
+        with self._lock:
+            if len(self._capabilities) >= MAX_CACHED_TOKENS:
+                self._capabilities.clear()
+            self._capabilities[key] = (allowed, time.monotonic() + CAPABILITIES_TTL)
+        if not allowed:
+            METRICS.inc("vault_ssh_renew_relay_requests_total", outcome="denied")
+            return _error(403, "permission denied")
+        return None
+
+    def _may_sign(self, token: str) -> bool:
+        with TRACER.span("relay.capabilities") as span:
+            response = self._connection.post(
+                self._capabilities_url,
+                {"paths": [self._sign_path]},
+                token_headers(token),
+            )
+            span.set_attribute("status_code", response.status_code)
+        if response.status_code in (400, 401, 403):
+            # Unknown, expired or revoked token
+            return False
+        if response.status_code != 200:
+            raise RenewError(
+                "Vault answered the capabilities check with status %d"
+                % response.status_code
+            )
+        try:
+            data = response.json()
+            data = data.get("data") or data
+            capabilities = set(data.get(self._sign_path, data.get("capabilities", [])))
+        except (ValueError, AttributeError, TypeError):
+            raise RenewError("Invalid response to the capabilities check")
+        return "deny" not in capabilities and bool(capabilities & SIGN_CAPABILITIES)
+
+    def sign(self, payload: Any) -> Tuple[int, bytes]:
+        """
+        Forward a sign request, or wait for an identical one in flight
+        :return: The status code and body of the response
+        """
+        result, leader = self._single_flight(
+            "sign:" + json.dumps(payload, sort_keys=True),
+            lambda: self._forward(payload),
+        )
+        if not leader:
+            METRICS.inc("vault_ssh_renew_relay_requests_total", outcome="deduplicated")
+        return result
+
+    def _single_flight(
+        self, key: str, func: Callable[[], Optional[Tuple[int, bytes]]]
+    ) -> Tuple[Optional[Tuple[int, bytes]], bool]:
+        """
+        Call `func`, unless a call with the same key is in flight, whose result is
+        shared instead
+        :return: The result, and whether `func` was called
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+        if not leader:
+            call.done.wait()
+            return call.result, False
+        try:
+            call.result = func()
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+        return call.result, True
+
+    def _forward(self, payload: Any) -> Tuple[int, bytes]:
+        with TRACER.span("relay.sign") as span:
+            with self._slots:
+                self._limiter.wait()
+
+                rejected = []
+
+                def _post(token: str):
+                    response = self._connection.post(
+                        self._url, payload, token_headers(token)
+                    )
+                    if response.status_code == 403:
+                        rejected.append(response)
+                        raise TokenRejected(response.text)
+                    return response
+
+                try:
+                    response = self._tokens.call(self._connection, _post)
+                except TokenRejected:
+                    # Vault also rejected a fresh token, pass on its answer
+                    response = rejected[-1]
+                except RenewError as e:
+                    METRICS.inc("vault_ssh_renew_relay_requests_total", outcome="error")
+                    span.set_attribute("status_code", 502)
+                    return _error(502, str(e))
+            METRICS.inc("vault_ssh_renew_relay_requests_total", outcome="forwarded")
+            span.set_attribute("status_code", response.status_code)
+            return response.status_code, response.content
+
+    def start(self) -> "SignRelay":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._connection.close()
+
+
+__all__ = ["BlockingRateLimiter", "SignRelay"]
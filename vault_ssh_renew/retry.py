@@ -0,0 +1,133 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+# Status codes that indicate a temporary condition on the Vault side (rate limiting,
+# standby or sealed nodes, overloaded load balancers)
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+class RetryPolicy:
+    """
+    Timeouts and retry behaviour for requests to Vault. Retries use exponential backoff
+    with full jitter, unless the server asks for a specific delay via Retry-After.
+    """
+
+    connect_timeout: float
+    read_timeout: float
+    deadline: float
+    max_retries: int
+    backoff_base: float
+    backoff_cap: float
+
+    def __init__(
+        self,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        deadline: float = 120.0,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+        backoff_cap: float = 30.0,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    @classmethod
+    def from_config(cls, config) -> "RetryPolicy":
+        return cls(
+            connect_timeout=config.vault_connect_timeout,
+            read_timeout=config.vault_read_timeout,
+            deadline=config.vault_deadline,
+            max_retries=config.vault_max_retries,
+        )
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        :param attempt: The number of the retry, starting at 1
+        :param retry_after: The delay requested by the server, if any
+        :return: The number of seconds to wait before the next attempt
+        """
+        delay = random.uniform(
+            0, min(self.backoff_cap, self.backoff_base * 2 ** (attempt - 1))
+        )
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header, which is either a number of seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a Vault server that failed repeatedly. After `threshold`
+    consecutive failures the breaker opens and rejects requests for `reset_timeout`
+    seconds, after which a single trial request is let through.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 60.0):
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self) -> bool:
+        if self._threshold <= 0:
+            return True
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self._reset_timeout:
+                # Half open: let one request through, re-open on failure
+                self._opened_at = None
+                self._failures = self._threshold - 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._threshold > 0 and self._failures >= self._threshold:
+                self._opened_at = time.monotonic()
+
+
+__all__ = [
+    "CircuitBreaker",
+    "RETRYABLE_STATUS_CODES",
+    "RetryPolicy",
+    "parse_retry_after",
+]
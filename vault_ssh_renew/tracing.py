@@ -0,0 +1,176 @@
+import atexit
+import binascii
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, IO, Optional
+
+
+def _new_id(size: int) -> str:
+    return binascii.hexlify(os.urandom(size)).decode("ascii")
+
+
+class Span:
+    """
+    A timed step of the renewal pipeline. Spans nest per thread: a span started while
+    another one is active becomes its child and shares its trace id.
+    """
+
+    __slots__ = (
+        "_tracer",
+        "_parent",
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "attributes",
+        "status",
+        "_start_ns",
+        "_start",
+    )
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        self._tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.status = "ok"
+        self._parent: Optional[Span] = None
+        self.span_id = _new_id(8)
+        self.trace_id = ""
+        self.parent_span_id: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self._parent = self._tracer.current()
+        if self._parent is not None:
+            self.trace_id = self._parent.trace_id
+            self.parent_span_id = self._parent.span_id
+        else:
+            self.trace_id = _new_id(16)
+        self._tracer._activate(self)
+        self._start_ns = int(time.time() * 1e9)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.status = "error"
+            self.attributes["error"] = "%s: %s" % (exc_type.__name__, exc)
+        self._tracer._activate(self._parent)
+        self._tracer._export(
+            {
+                "name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_span_id": self.parent_span_id,
+                "start_time_unix_nano": self._start_ns,
+                "end_time_unix_nano": self._start_ns + int(duration * 1e9),
+                "duration_ms": round(duration * 1000, 3),
+                "status": self.status,
+                "attributes": self.attributes,
+            }
+        )
+        return False
+
+
+class _NoopSpan:
+    """
+    Returned by a disabled tracer. It is shared, so starting a span costs a single
+    attribute check and no allocation.
+    """
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Records spans as JSON lines whose fields follow the OpenTelemetry span data model,
+    so that they can be read without running a collector. Tracing is disabled until an
+    output is configured.
+    """
+
+    def __init__(self):
+        self._output: Optional[IO[str]] = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self._output is not None
+
+    def configure(self, path: Optional[str]):
+        """
+        :param path: The file to append spans to, - for stdout or None to disable
+            tracing
+        """
+        self.close()
+        if path == "-":
+            self._output = sys.stdout
+        elif path:
+            self._output = open(path, "a", encoding="utf-8", buffering=1)
+            atexit.register(self.close)
+
+    def close(self):
+        with self._lock:
+            output, self._output = self._output, None
+        if output is not None and output is not sys.stdout:
+            output.close()
+
+    def span(self, name: str, **attributes: Any):
+        if self._output is None:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def current(self) -> Optional[Span]:
+        return getattr(self._local, "span", None)
+
+    def wrap(self, func: Callable) -> Callable:
+        """
+        Make spans started by `func` children of the current span, even when it is
+        called on a different thread
+        """
+        if self._output is None:
+            return func
+        parent = self.current()
+
+        def _wrapped(*args, **kwargs):
+            previous = self.current()
+            self._activate(parent)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._activate(previous)
+
+        return _wrapped
+
+    def _activate(self, span: Optional[Span]):
+        self._local.span = span
+
+    def _export(self, record: Dict[str, Any]):
+        line = json.dumps(record, default=str, sort_keys=True) + "\n"
+        with self._lock:
+            if self._output is not None:
+                self._output.write(line)
+                self._output.flush()
+
+
+TRACER = Tracer()
+
+__all__ = ["NOOP_SPAN", "Span", "TRACER", "Tracer"]
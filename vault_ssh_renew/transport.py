@@ -0,0 +1,83 @@
+import socket
+import threading
+from typing import Dict
+from urllib.parse import unquote, urlparse
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+
+class _UnixHTTPConnection(HTTPConnection):
+    def __init__(self, socket_path: str, **kwargs):
+        super().__init__("localhost", **kwargs)
+        self._socket_path = socket_path
+
+    def _new_conn(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self._socket_path)
+        except OSError as e:
+            sock.close()
+            raise NewConnectionError(
+                self, "Failed to connect to %s: %s" % (self._socket_path, e)
+            )
+        return sock
+
+
+class _UnixConnectionPool(HTTPConnectionPool):
+    def __init__(self, socket_path: str, maxsize: int):
+        super().__init__("localhost", maxsize=maxsize)
+        self._socket_path = socket_path
+
+    def _new_conn(self) -> _UnixHTTPConnection:
+        self.num_connections += 1
+        return _UnixHTTPConnection(
+            self._socket_path, timeout=self.timeout.connect_timeout
+        )
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """
+    Sends requests for http+unix:// URLs over a Unix domain socket, e.g. to a Vault
+    Agent on the same host. The host part of the URL is the percent-encoded path of
+    the socket. Connections are pooled per socket like those of TCP endpoints, and
+    proxies do not apply.
+    """
+
+    def __init__(self, pool_size: int = 4):
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._pool_size = pool_size
+        self._pools: Dict[str, _UnixConnectionPool] = {}
+        self._pools_lock = threading.Lock()
+
+    def get_connection(self, url, proxies=None) -> _UnixConnectionPool:
+        socket_path = unquote(urlparse(url).netloc)
+        with self._pools_lock:
+            pool = self._pools.get(socket_path)
+            if pool is None:
+                pool = self._pools[socket_path] = _UnixConnectionPool(
+                    socket_path, self._pool_size
+                )
+            return pool
+
+    def get_connection_with_tls_context(
+        self, request, verify, proxies=None, cert=None
+    ) -> _UnixConnectionPool:
+        return self.get_connection(request.url)
+
+    def request_url(self, request, proxies) -> str:
+        return request.path_url
+
+    def close(self):
+        super().close()
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+
+__all__ = ["UnixSocketAdapter"]
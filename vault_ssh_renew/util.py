@@ -1,7 +1,71 @@
-from urllib.parse import ParseResult, urlparse
+import json
+import os
+from pathlib import Path
+from typing import Any
+from urllib.parse import ParseResult, quote, urlparse
 
 from click import ParamType
 
+# The scheme of URLs for requests over a Unix domain socket
+UNIX_SCHEME = "http+unix"
+
+
+def base_url(addr: ParseResult) -> str:
+    """
+    :return: The URL below which the API of the Vault at an address is reached. For
+        unix:///path/to/socket addresses, this is an http+unix URL whose host is the
+        percent-encoded path of the socket.
+    """
+    if addr.scheme == "unix":
+        return "%s://%s" % (UNIX_SCHEME, quote(addr.path, safe=""))
+    return addr.geturl()
+
+
+def write_atomic(path: Path, text: str, mode: int = 0o600):
+    """
+    Replace a file with some text. The text is written to a hidden temporary file
+    next to it and synced to disk before the temporary file is renamed over the file.
+    The temporary file is removed again if any of this fails.
+    :param mode: The mode of the file
+    :raises OSError: If the file could not be written
+    """
+    from tempfile import NamedTemporaryFile
+
+    path = Path(str(path))
+    with NamedTemporaryFile(
+        "w",
+        encoding="utf-8",
+        dir=str(path.parent),
+        prefix=".%s." % path.name,
+        delete=False,
+    ) as tmp:
+        try:
+            tmp.write(text)
+            tmp.flush()
+            os.fchmod(tmp.fileno(), mode)
+            os.fsync(tmp.fileno())
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+    try:
+        os.replace(tmp.name, str(path))
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+
+def write_json_atomic(path: Path, data: Any, directory_mode: int = 0o777):
+    """
+    Replace a file with the JSON representation of some data, using `write_atomic`.
+    The file gets mode 0600.
+    :param directory_mode: The mode of the parent directories, if they are created
+    :raises OSError: If the file could not be written
+    :raises TypeError: If the data cannot be represented as JSON
+    """
+    path = Path(str(path))
+    path.parent.mkdir(mode=directory_mode, parents=True, exist_ok=True)
+    write_atomic(path, json.dumps(data))
+
 
 class URLParameterType(ParamType):
 
@@ -14,3 +78,35 @@ class URLParameterType(ParamType):
             return urlparse(value)
         except ValueError:
             self.fail("Invalid URL")
+
+
+class URLListParameterType(ParamType):
+    """
+    One or more URLs, separated by commas
+    """
+
+    name = "URL[,URL...]"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, list):
+            return value
+        if isinstance(value, ParseResult):
+            return [value]
+        try:
+            return [urlparse(url.strip()) for url in value.split(",") if url.strip()]
+        except ValueError:
+            self.fail("Invalid URL")
+
+
+class FractionParameterType(ParamType):
+
+    name = "fraction"
+
+    def convert(self, value, param, ctx):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            self.fail("%s is not a number" % value)
+        if not 0 < value < 1:
+            self.fail("%s is not between 0 and 1" % value)
+        return value
@@ -1,14 +1,165 @@
 import abc
-import os
-import shutil
+import time
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import Collection, Dict, Optional
+from typing import Any, Collection, Dict, Mapping, Optional
 from urllib.parse import ParseResult
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from .errors import RenewError
+from .auth import token_headers
+from .endpoints import Endpoints
+from .errors import RenewError, TokenRejected, VaultResponseError
+from .install import install_file
+from .metrics import METRICS
+from .retry import (
+    RETRYABLE_STATUS_CODES,
+    CircuitBreaker,
+    RetryPolicy,
+    parse_retry_after,
+)
+from .tracing import TRACER
+from .transport import UnixSocketAdapter
+from .util import UNIX_SCHEME, base_url
+
+
+def create_session(pool_size: int = 4, keep_alive: bool = True) -> requests.Session:
+    """
+    Create an HTTP session that can be shared by several VaultRenewer instances, so
+    that connections (and TLS sessions) to Vault are reused between requests. The
+    caller owns the session and should close it when done.
+    :param pool_size: The number of connections to keep open per Vault host
+    :param keep_alive: Whether to keep connections open between requests
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.mount(UNIX_SCHEME + "://", UnixSocketAdapter(pool_size))
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+class VaultConnection:
+    """
+    The HTTP session, timeouts, retry policy and circuit breaker used to talk to Vault.
+    A connection can be shared by several VaultRenewer instances and is owned by
+    whatever drives the renewals. With several endpoints, requests to any of them are
+    sent to the preferred one and fail over to the others.
+    """
+
+    session: requests.Session
+    policy: RetryPolicy
+    breaker: CircuitBreaker
+    endpoints: Optional[Endpoints]
+
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        endpoints: Optional[Endpoints] = None,
+    ):
+        self.session = session if session is not None else create_session(1, False)
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.endpoints = endpoints
+
+    @classmethod
+    def from_config(cls, config, pool_size: Optional[int] = None) -> "VaultConnection":
+        return cls(
+            create_session(
+                pool_size if pool_size is not None else config.vault_pool_size,
+                config.vault_keep_alive,
+            ),
+            RetryPolicy.from_config(config),
+            CircuitBreaker(config.vault_breaker_threshold),
+            Endpoints.from_config(config),
+        )
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self) -> "VaultConnection":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def post(
+        self, url: str, payload: Any, headers: Mapping[str, str]
+    ) -> requests.Response:
+        """
+        Send a request to Vault, retrying on connection errors and temporary failures
+        until the retries or the deadline of the policy are exhausted.
+        :return: The first response that is not a temporary failure, or the last
+            response received
+        :raises RenewError: If Vault could not be reached at all
+        """
+        policy = self.policy
+        deadline = time.monotonic() + policy.deadline
+        route = self.endpoints.route(url) if self.endpoints is not None else None
+        tried = set()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise RenewError("Vault is unavailable, not sending further requests")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RenewError("Deadline for Vault request exceeded")
+            endpoint = None
+            target = url
+            if route is not None:
+                endpoint = self.endpoints.select(self.session)
+                target = endpoint + route[1]
+                tried.add(endpoint)
+            retry_after = None
+            try:
+                with TRACER.span("vault.request", attempt=attempt + 1) as span:
+                    if endpoint is not None:
+                        span.set_attribute("endpoint", endpoint)
+                    response = self.session.post(
+                        target,
+                        json=payload,
+                        headers=headers,
+                        timeout=(
+                            min(policy.connect_timeout, remaining),
+                            min(policy.read_timeout, remaining),
+                        ),
+                    )
+                    span.set_attribute("status_code", response.status_code)
+            except requests.RequestException as e:
+                METRICS.inc("vault_ssh_renew_vault_responses_total", code="error")
+                self.breaker.record_failure()
+                response = None
+                error = "Could not reach Vault: %s" % e
+            else:
+                METRICS.inc(
+                    "vault_ssh_renew_vault_responses_total",
+                    code=str(response.status_code),
+                )
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_success()
+                    if endpoint is not None:
+                        self.endpoints.report_success(endpoint, response)
+                    return response
+                self.breaker.record_failure()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                error = "Vault responded with status %d" % response.status_code
+            attempt += 1
+            if endpoint is not None:
+                self.endpoints.report_failure(endpoint)
+                failover = self.endpoints.select(self.session) not in tried
+                if failover and attempt <= policy.max_retries:
+                    # Try an endpoint that has not failed yet right away
+                    continue
+            delay = policy.backoff(attempt, retry_after)
+            if attempt > policy.max_retries or time.monotonic() + delay >= deadline:
+                if response is not None:
+                    return response
+                raise RenewError(error)
+            time.sleep(delay)
 
 
 class VaultRenewInit(abc.ABC):
@@ -29,6 +180,7 @@ class VaultRenewer(VaultRenewInit, VaultRenewDone):
     _public_key: str
     _principals: Collection[str]
     _cert_path: Path
+    _connection: Optional[VaultConnection]
     _signed_key: Optional[str]
 
     def __init__(
@@ -39,41 +191,48 @@ class VaultRenewer(VaultRenewInit, VaultRenewDone):
         public_key: str,
         principals: Collection[str],
         cert_path: Path,
+        connection: Optional[VaultConnection] = None,
     ):
-        self._url = addr.geturl() + "/v1/" + sign_path
+        self._url = base_url(addr) + "/v1/" + sign_path
         self._public_key = public_key
         self._token = token
         self._principals = principals
         self._cert_path = cert_path
+        self._connection = connection
 
     def renew(self) -> VaultRenewDone:
-        response = requests.post(
-            self._url, json=self._get_payload(), headers={"X-Vault-Token": self._token}
+        with TRACER.span("vault.sign", url=self._url):
+            if self._connection is None:
+                with VaultConnection() as connection:
+                    return self._renew(connection)
+            return self._renew(self._connection)
+
+    def _renew(self, connection: VaultConnection) -> VaultRenewDone:
+        response = connection.post(
+            self._url, self._get_payload(), token_headers(self._token)
         )
-        if response.status_code == 200:
+        if response.status_code == 403:
+            raise TokenRejected("Could not renew certificate: %s" % response.text)
+        if response.status_code != 200:
+            raise VaultResponseError(
+                "Could not renew certificate: %s" % response.text, response.status_code
+            )
+        try:
             self._signed_key = response.json()["data"]["signed_key"]
-        else:
-            raise RenewError("Could not renew certificate: %s" % response.text)
+        except (ValueError, KeyError, TypeError):
+            raise RenewError("Unexpected response from Vault: %s" % response.text)
         return self
 
-    def write_certificate(self):
-        assert self._signed_key is not None
-
-        try:
-            temp_file = NamedTemporaryFile(
-                delete=False, dir=os.path.dirname(str(self._cert_path))
-            )
-        except OSError:
-            # We might not be allowed to write to the certificate directory.
-            # In that case, we fall back to TMPDIR. This is slightly less
-            # safe if TMPDIR is on a different device since we cannot atomically
-            # switch out the certificate.
-            temp_file = NamedTemporaryFile(delete=False)
-
-        with temp_file as tmp:
-            tmp.write(self._signed_key.encode("utf-8"))
-            tmp.flush()
-            shutil.move(tmp.name, str(self._cert_path))
+    def write_certificate(self) -> bool:
+        """
+        Install the new certificate, unless it is identical to the existing one
+        :return: Whether the certificate file was changed
+        """
+        with TRACER.span("cert.write", cert=str(self._cert_path)) as span:
+            assert self._signed_key is not None
+            changed = install_file(self._cert_path, self._signed_key.encode("utf-8"))
+            span.set_attribute("changed", changed)
+        return changed
 
     def _get_payload(self) -> Dict[str, str]:
         return {
@@ -91,8 +250,15 @@ class VaultRenewer(VaultRenewInit, VaultRenewDone):
         public_key: str,
         principals: Collection[str],
         cert_path: Path,
+        connection: Optional[VaultConnection] = None,
     ) -> VaultRenewInit:
-        return cls(addr, token, sign_path, public_key, principals, cert_path)
+        """
+        :param connection: A shared connection owned by the caller. If omitted, a new
+            connection with the default retry policy is made for the request.
+        """
+        return cls(
+            addr, token, sign_path, public_key, principals, cert_path, connection
+        )
 
 
-__all__ = ["VaultRenewer"]
+__all__ = ["VaultConnection", "VaultRenewer", "create_session"]
@@ -0,0 +1,162 @@
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from .errors import RenewError
+
+# Quiet period after the last event before the files are compared, so that a key
+# rotation writing several files in a row results in a single check
+DEBOUNCE = 2.0
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_ONLYDIR = 0x01000000
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+def _load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def fingerprint(path: Path) -> Optional[str]:
+    """
+    :return: A digest of the file contents, or None if the file does not exist
+    """
+    try:
+        with open(str(path), "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+class FileWatcher:
+    """
+    Watches the directories containing a set of files with inotify and calls
+    `on_change` when the contents of one of the files changed, or when one was
+    created, removed or replaced. Events are debounced, and files that were written
+    with identical contents do not count as changed. Watching directories instead
+    of the files themselves also catches files that are replaced by renaming, and
+    host keys that are added to the directory.
+    """
+
+    _paths: Callable[[], Iterable[Path]]
+    _on_change: Callable[[], None]
+    _debounce: float
+
+    def __init__(
+        self,
+        paths: Callable[[], Iterable[Path]],
+        on_change: Callable[[], None],
+        debounce: float = DEBOUNCE,
+    ):
+        """
+        :param paths: Returns the files to watch. Called again on every reset, so that
+            newly discovered host keys are picked up.
+        :param on_change: Invoked from the watcher thread
+        """
+        self._paths = paths
+        self._on_change = on_change
+        self._debounce = debounce
+        self._libc = None
+        self._fd = -1
+        self._stop_r, self._stop_w = -1, -1
+        self._directories: Set[Path] = set()
+        self._baseline: Dict[Path, Optional[str]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "FileWatcher":
+        """
+        :raises RenewError: If inotify is not available
+        """
+        try:
+            self._libc = _load_libc()
+            self._fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        except (OSError, AttributeError) as e:
+            raise RenewError("inotify is not available: %s" % e)
+        if self._fd < 0:
+            raise RenewError(
+                "inotify is not available: %s" % os.strerror(ctypes.get_errno())
+            )
+        self._stop_r, self._stop_w = os.pipe()
+        self.reset()
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        os.write(self._stop_w, b"\0")
+        self._thread.join()
+        self._thread = None
+        for fd in (self._fd, self._stop_r, self._stop_w):
+            os.close(fd)
+
+    def reset(self):
+        """
+        Record the current contents of the files as unchanged and watch any new
+        directories
+        """
+        snapshot = self._snapshot()
+        with self._lock:
+            self._baseline = snapshot
+        for directory in {path.parent for path in snapshot}:
+            if directory in self._directories:
+                continue
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(str(directory)), _WATCH_MASK | _IN_ONLYDIR
+            )
+            if wd >= 0:
+                self._directories.add(directory)
+
+    def _snapshot(self) -> Dict[Path, Optional[str]]:
+        return {
+            Path(os.path.abspath(str(path))): fingerprint(path)
+            for path in self._paths()
+        }
+
+    def changed(self) -> bool:
+        snapshot = self._snapshot()
+        with self._lock:
+            return snapshot != self._baseline
+
+    def _work(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            readable, _, _ = select.select([self._fd, self._stop_r], [], [], timeout)
+            if self._stop_r in readable:
+                return
+            if self._fd in readable and self._read_events():
+                deadline = time.monotonic() + self._debounce
+            elif deadline is not None and time.monotonic() >= deadline:
+                deadline = None
+                if self.changed():
+                    self._on_change()
+
+    def _read_events(self) -> bool:
+        """
+        Drain the pending events. Whether they are relevant is decided by comparing
+        the files after the debounce period, which also covers newly discovered keys.
+        :return: Whether there were any events
+        """
+        try:
+            return bool(os.read(self._fd, 65536))
+        except BlockingIOError:
+            return False
+
+
+__all__ = ["DEBOUNCE", "FileWatcher", "fingerprint"]
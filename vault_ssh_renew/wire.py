@@ -0,0 +1,69 @@
+import struct
+
+from .errors import RenewError
+
+_UINT32 = struct.Struct(">I")
+_UINT64 = struct.Struct(">Q")
+
+
+class WireReader:
+    """
+    Sequential reader for the SSH wire encoding (RFC 4251, section 5). Strings are
+    returned as memoryview slices of the underlying buffer, so skipping or peeking
+    at a field never copies it.
+    """
+
+    __slots__ = ("_view", "_offset")
+
+    def __init__(self, data: bytes):
+        self._view = memoryview(data)
+        self._offset = 0
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    @property
+    def remaining(self) -> int:
+        return len(self._view) - self._offset
+
+    def _advance(self, length: int) -> int:
+        start = self._offset
+        end = start + length
+        if end > len(self._view):
+            raise RenewError("Truncated data in certificate")
+        self._offset = end
+        return start
+
+    def get_uint32(self) -> int:
+        return _UINT32.unpack_from(self._view, self._advance(4))[0]
+
+    def get_uint64(self) -> int:
+        return _UINT64.unpack_from(self._view, self._advance(8))[0]
+
+    def get_string(self) -> memoryview:
+        length = self.get_uint32()
+        start = self._advance(length)
+        return self._view[start : start + length]
+
+    def get_text(self) -> str:
+        try:
+            return str(self.get_string(), "utf-8")
+        except UnicodeDecodeError:
+            raise RenewError("Invalid text in certificate")
+
+    def since(self, start: int) -> memoryview:
+        """
+        :return: The raw data from `start` up to the current position
+        """
+        return self._view[start : self._offset]
+
+    def skip(self, length: int):
+        self._advance(length)
+
+    def skip_string(self, count: int = 1):
+        for _ in range(count):
+            self._advance(self.get_uint32())
+
+
+__all__ = ["WireReader"]